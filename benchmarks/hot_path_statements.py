@@ -0,0 +1,100 @@
+"""Микробенчмарк поиска ссылки по коду: запрос, собираемый на каждый вызов, с commit после чтения против
+заранее собранного SELECT_LINK_BY_CODE в сессии без транзакции (read_session).
+
+Обращается к Postgres из конфигурации приложения напрямую, без HTTP. Для каждого варианта выводит в JSON
+среднее процессорное время и p50/p99 задержки на запрос. Ссылка для поиска создается и удаляется бенчмарком.
+
+Запуск из корня репозитория с теми же переменными окружения, что и у приложения:
+    python benchmarks/hot_path_statements.py --requests 5000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from sqlalchemy import select, delete
+
+from database import async_session_maker, read_session
+from shurl.models import Link, LinkCode, link_by_code
+from shurl.schemas import ShortenedItem
+from shurl.statements import SELECT_LINK_BY_CODE, INSERT_LINK, INSERT_LINK_CODE
+
+SHORT_CODE = "benchHOT"
+
+
+async def rebuilt_with_commit(short_code: str):
+    """Как было: выражение строится заново, после чтения - commit."""
+    async with async_session_maker() as session:
+        query = select(Link.__table__).where(link_by_code(short_code)) # type: ignore
+        result = await session.execute(query)
+        await session.commit()
+        return result.one()
+
+
+async def prebuilt_without_transaction(short_code: str):
+    """Как стало: готовый запрос, сессия без BEGIN/COMMIT."""
+    async with read_session() as session:
+        result = await session.execute(SELECT_LINK_BY_CODE, {"short_code": short_code})
+        return result.one()
+
+
+async def measure(lookup, requests: int) -> dict:
+    for _ in range(min(requests, 200)):
+        await lookup(SHORT_CODE)
+
+    latencies = []
+    cpu_started = time.process_time()
+    for _ in range(requests):
+        started = time.perf_counter()
+        await lookup(SHORT_CODE)
+        latencies.append(time.perf_counter() - started)
+    cpu = time.process_time() - cpu_started
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "cpu_us_per_request": round(cpu / requests * 1e6, 1),
+        "p50_ms": round(quantiles[49] * 1000, 3),
+        "p99_ms": round(quantiles[98] * 1000, 3),
+    }
+
+
+async def run(requests: int) -> dict:
+    async with async_session_maker() as session:
+        await session.execute(INSERT_LINK_CODE, {"short_url": SHORT_CODE, "expires_at": None})
+        await session.execute(INSERT_LINK, ShortenedItem(short_url=SHORT_CODE, original_url="https://example.com").model_dump())
+        await session.commit()
+    try:
+        before = await measure(rebuilt_with_commit, requests)
+        after = await measure(prebuilt_without_transaction, requests)
+    finally:
+        async with async_session_maker() as session:
+            await session.execute(delete(Link.__table__).where(Link.__table__.c.short_url == SHORT_CODE))
+            await session.execute(delete(LinkCode.__table__).where(LinkCode.__table__.c.short_url == SHORT_CODE))
+            await session.commit()
+
+    return {
+        "benchmark": "hot_path_statements",
+        "requests": requests,
+        "rebuilt_with_commit": before,
+        "prebuilt_without_transaction": after,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(args.log_level)
+    print(json.dumps(asyncio.run(run(args.requests))))
+
+
+if __name__ == "__main__":
+    main()
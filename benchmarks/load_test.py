@@ -0,0 +1,246 @@
+"""Нагрузочный тест сервиса на смеси запросов.
+
+Приложение из src/main.py запускается в процессе (httpx + ASGITransport, с lifespan: фоновые флашеры работают
+как в проде). Нужен Postgres из конфигурации приложения с накатанными миграциями: схема использует секционирование,
+последовательности и advisory-блокировки, поэтому SQLite ее не заменит. Redis берется из конфигурации или,
+с --fake-redis, подменяется fakeredis в памяти процесса (нужны пакеты fakeredis и lupa).
+
+Перед замером регистрируется пользователь и создается --links его ссылок. Затем --concurrency клиентов
+выполняют --requests запросов, выбирая операцию по весам из --mix:
+    redirect  - GET /links/{code} по существующей ссылке, в основном попадания в кэш
+    miss      - то же, но кэш ссылки сброшен перед запросом (сброс не входит в замер)
+    notfound  - GET /links/{code} по несуществующему коду
+    shorten   - POST /links/shorten от имени пользователя
+    stats     - GET /links/{code}/stats
+    mylinks   - GET /account/mylinks?limit=100
+Для каждой операции и для всей смеси выводятся число запросов, ошибки, запросы в секунду и p50/p95/p99 задержки
+в мс, одной строкой JSON. С --output строка дописывается в файл (JSON Lines), чтобы сравнивать прогоны.
+Созданные ссылки и пользователь удаляются после замера.
+
+Запуск из корня репозитория с теми же переменными окружения, что и у приложения:
+    python benchmarks/load_test.py --requests 20000 --concurrency 16 --mix redirect=80,miss=5,shorten=10,stats=5
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import httpx
+
+OPERATIONS = ("redirect", "miss", "notfound", "shorten", "stats", "mylinks")
+DEFAULT_MIX = "redirect=70,miss=5,notfound=5,shorten=10,stats=5,mylinks=5"
+# коды длиннее выдаваемых (8 символов), поэтому не существуют
+NOT_FOUND_PREFIX = "nf"
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise SystemExit(f"Unknown operation in --mix: {name!r}, expected one of {', '.join(OPERATIONS)}")
+        weights[name] = float(weight or 1)
+    return {name: weight for name, weight in weights.items() if weight > 0}
+
+
+def use_fake_redis():
+    """Подменяет клиент Redis до импорта приложения: redis_caching.client создает его при импорте."""
+    try:
+        import fakeredis
+        # без lupa fakeredis не выполняет Lua-скрипты, на которых держится кэш
+        import lupa  # noqa: F401
+    except ImportError as e:
+        raise SystemExit(f"--fake-redis needs the fakeredis and lupa packages (pip install fakeredis lupa): {e}")
+    import redis.asyncio
+    redis.asyncio.Redis = fakeredis.FakeAsyncRedis
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> dict:
+    summary = {"requests": len(latencies), "errors": errors, "rps": round(len(latencies) / elapsed, 1)}
+    if len(latencies) >= 2:
+        quantiles = statistics.quantiles(latencies, n=100)
+        summary.update({"p50_ms": round(quantiles[49] * 1000, 3),
+                        "p95_ms": round(quantiles[94] * 1000, 3),
+                        "p99_ms": round(quantiles[98] * 1000, 3)})
+    return summary
+
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, weights: Dict[str, float], seed: int):
+        self.client = client
+        self.operations = list(weights)
+        self.weights = list(weights.values())
+        self.random = random.Random(seed)
+        self.headers: Dict[str, str] = {}
+        self.codes: List[str] = []
+        self.created: List[str] = []
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    async def setup(self, links: int) -> str:
+        email = f"loadtest-{uuid.uuid4().hex[:12]}@example.com"
+        response = await self.client.post("/auth/register", json={"email": email, "password": "loadtest-password"})
+        assert response.status_code == 201, response.text
+        response = await self.client.post("/auth/jwt/login", data={"username": email, "password": "loadtest-password"})
+        assert response.status_code == 200, response.text
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        for start in range(0, links, 1000):
+            items = [{"original_url": f"https://example.com/load/{i}"} for i in range(start, min(start + 1000, links))]
+            response = await self.client.post("/links/shorten/batch", json=items, headers=self.headers)
+            assert response.status_code == 201, response.text
+            self.codes.extend(result["short_code"] for result in response.json()["results"]
+                              if result["status"] == "created")
+        return email
+
+    async def request(self, operation: str):
+        from redis_caching import drop_cached_link
+
+        code = self.random.choice(self.codes)
+        expected = 200
+        if operation == "redirect":
+            call, expected = self.client.get(f"/links/{code}"), 302
+        elif operation == "miss":
+            await drop_cached_link(code)
+            call, expected = self.client.get(f"/links/{code}"), 302
+        elif operation == "notfound":
+            call, expected = self.client.get(f"/links/{NOT_FOUND_PREFIX}{uuid.uuid4().hex[:10]}"), 404
+        elif operation == "shorten":
+            call, expected = self.client.post("/links/shorten", params={
+                "original_url": f"https://example.com/shorten/{uuid.uuid4().hex}"}, headers=self.headers), 201
+        elif operation == "stats":
+            call = self.client.get(f"/links/{code}/stats")
+        else:
+            call = self.client.get("/account/mylinks", params={"limit": 100}, headers=self.headers)
+
+        started = time.perf_counter()
+        response = await call
+        self.latencies[operation].append(time.perf_counter() - started)
+        if response.status_code != expected:
+            self.errors[operation] += 1
+        elif operation == "shorten":
+            self.created.append(response.json()["short_code"])
+
+    async def worker(self, requests: int):
+        for _ in range(requests):
+            await self.request(self.random.choices(self.operations, self.weights)[0])
+
+    async def run(self, requests: int, concurrency: int) -> float:
+        started = time.perf_counter()
+        # остаток от деления достается первым клиентам, чтобы выполнить ровно requests запросов
+        share, extra = divmod(requests, concurrency)
+        await asyncio.gather(*(self.worker(share + (i < extra)) for i in range(concurrency)))
+        return time.perf_counter() - started
+
+    def report(self, elapsed: float) -> dict:
+        everything = [latency for latencies in self.latencies.values() for latency in latencies]
+        return {
+            "total": summarize(everything, sum(self.errors.values()), elapsed),
+            "operations": {operation: summarize(self.latencies[operation], self.errors[operation], elapsed)
+                           for operation in self.operations},
+        }
+
+
+async def cleanup(short_codes: List[str], email: str):
+    from sqlalchemy import delete
+    from database import async_session_maker
+    from shurl.models import Link, LinkCode, UserStats
+    from auth.models import User
+    from redis_caching import r, drop_cached_links
+    from redis_caching.user_stats import USERS_DIRTY_KEY
+
+    async with async_session_maker() as session:
+        for start in range(0, len(short_codes), 1000):
+            chunk = short_codes[start:start + 1000]
+            await session.execute(delete(Link.__table__).where(Link.__table__.c.short_url.in_(chunk)))
+            await session.execute(delete(LinkCode.__table__).where(LinkCode.__table__.c.short_url.in_(chunk)))
+        deleted = await session.execute(delete(User.__table__).where(User.__table__.c.email == email)
+                                        .returning(User.__table__.c.id))
+        user_ids = deleted.scalars().all()
+        await session.execute(delete(UserStats.__table__).where(UserStats.__table__.c.user_id.in_(user_ids)))
+        await session.commit()
+    await drop_cached_links(short_codes)
+    for user_id in user_ids:
+        await r.delete(f"user_stats:{user_id}")
+        await r.zrem(USERS_DIRTY_KEY, str(user_id))
+
+
+@asynccontextmanager
+async def app_client():
+    from main import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://load", timeout=None) as client:
+            yield client
+
+
+async def run(args) -> dict:
+    weights = parse_mix(args.mix)
+    async with app_client() as client:
+        load_test = LoadTest(client, weights, args.seed)
+        email = await load_test.setup(args.links)
+        try:
+            # прогрев: кэши, подготовленные запросы, пул соединений
+            await load_test.run(min(args.requests // 10, 1000), args.concurrency)
+            load_test.latencies.clear()
+            load_test.errors.clear()
+
+            elapsed = await load_test.run(args.requests, args.concurrency)
+            report = load_test.report(elapsed)
+        finally:
+            await cleanup(load_test.codes + load_test.created, email)
+
+    return {
+        "benchmark": "load_test",
+        "label": args.label,
+        "timestamp": time.time(),
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "mix": weights,
+        "links": args.links,
+        "fake_redis": args.fake_redis,
+        "elapsed_s": round(elapsed, 3),
+        **report,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--links", type=int, default=1000, help="сколько ссылок создать перед замером")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fake-redis", action="store_true", help="fakeredis в памяти процесса вместо Redis")
+    parser.add_argument("--label", default="", help="метка прогона в результате, например коммит")
+    parser.add_argument("--output", help="дописать результат в этот файл (JSON Lines)")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    if args.fake_redis:
+        use_fake_redis()
+    # до импорта приложения: его basicConfig(level=LOG_LEVEL) тогда ничего не меняет, уровень задает --log-level
+    logging.basicConfig(level=args.log_level)
+
+    result = json.dumps(asyncio.run(run(args)))
+    print(result)
+    if args.output:
+        with open(args.output, "a") as output:
+            output.write(result + "\n")
+
+
+if __name__ == "__main__":
+    main()
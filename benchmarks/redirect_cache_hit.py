@@ -0,0 +1,94 @@
+"""Бенчмарк редиректа при попадании в кэш.
+
+Приложение запускается в процессе (httpx + ASGITransport, с lifespan: фоновые флашеры кликов работают как в проде
+и выгружают буферы при остановке), Redis и Postgres берутся из конфигурации приложения. К Postgres при попаданиях
+обращений быть не должно. Выводит p50/p99 задержки в JSON.
+
+--cache выбирает, какой уровень кэша замеряется:
+    redis - локальный кэш воркера выключен, каждый запрос идет в Redis (скрипт record_hit);
+    local - попадания в локальный кэш воркера, клики копятся в памяти и уходят в Redis фоном.
+
+Запуск из корня репозитория с теми же переменными окружения, что и у приложения:
+    python benchmarks/redirect_cache_hit.py --requests 5000 --concurrency 1 --cache redis
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import httpx
+
+from main import app
+from redis_caching import cache_link, drop_cached_link, local_links
+
+
+async def run(requests: int, concurrency: int, short_code: str, cache: str) -> dict:
+    local_max_entries = local_links.max_entries
+    if cache == "redis":
+        # с нулевым размером локальный кэш ничего не запоминает
+        local_links.max_entries = 0
+        local_links.clear()
+    latencies = []
+
+    try:
+        async with app.router.lifespan_context(app):
+            # запись в Redis живет не меньше CACHE_TTL_MIN секунд, и попадания продлевают ее
+            await cache_link(short_code, "https://example.com", None, 0)
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                async def worker(n: int):
+                    for _ in range(n):
+                        start = time.perf_counter()
+                        response = await client.get(f"/links/{short_code}")
+                        latencies.append(time.perf_counter() - start)
+                        assert response.status_code == 302, response.status_code
+
+                # прогрев
+                await worker(100)
+                latencies.clear()
+                local_hits = local_links.hits
+
+                started = time.perf_counter()
+                await asyncio.gather(*(worker(requests // concurrency) for _ in range(concurrency)))
+                elapsed = time.perf_counter() - started
+                local_hits = local_links.hits - local_hits
+
+            await drop_cached_link(short_code)
+    finally:
+        local_links.max_entries = local_max_entries
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "benchmark": "redirect_cache_hit",
+        "cache": cache,
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "local_hits": local_hits,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(quantiles[49] * 1000, 3),
+        "p99_ms": round(quantiles[98] * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--short-code", default="benchhit")
+    parser.add_argument("--cache", choices=["redis", "local"], default="redis",
+                        help="какой уровень кэша замерять")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(args.log_level)
+    print(json.dumps(asyncio.run(run(args.requests, args.concurrency, args.short_code, args.cache))))
+
+
+if __name__ == "__main__":
+    main()
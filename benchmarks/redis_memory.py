@@ -0,0 +1,134 @@
+"""Память Redis на ссылку: прежний формат (хэши short_url:{code} и stats:{code} на каждую ссылку) против
+записей статистик в хэшах-корзинах stats_bucket:{n} (short_url:{code} остаются отдельными ключами).
+
+Пишет --links ссылок в каждом формате и меряет прирост used_memory, затем удаляет их. Отдельно меряются одни записи
+short_url:{code}, чтобы показать, сколько занимают статистики. Половина ссылок с владельцем, у всех есть клики
+и время последнего перехода. Число корзин по умолчанию - --links / 100: столько записей на корзину держит хэш
+в компактной кодировке (hash-max-listpack-entries по умолчанию 128). Прирост used_memory честен, только если в Redis
+в это время никто больше не пишет.
+
+Запуск из корня репозитория с теми же переменными окружения, что и у приложения:
+    python benchmarks/redis_memory.py --links 100000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+BATCH_SIZE = 1000
+
+LinkRow = namedtuple("LinkRow", "short_url original_url expires_at clicks last_used created_by_uuid")
+
+
+def make_links(count: int) -> List[LinkRow]:
+    now = datetime.now(timezone.utc)
+    prefix = uuid.uuid4().hex[:3]
+    # восьмисимвольные коды, как у выдаваемых ссылок (длиннее при --links больше 2^20)
+    return [LinkRow(short_url=f"{prefix}{i:05x}",
+                    original_url=f"https://example.com/articles/{i}?utm_source=newsletter",
+                    expires_at=None, clicks=i % 5000, last_used=now - timedelta(seconds=i),
+                    created_by_uuid=uuid.uuid4() if i % 2 else None)
+            for i in range(count)]
+
+
+async def used_memory(r) -> int:
+    return (await r.info("memory"))["used_memory"]
+
+
+async def write_link_entries(r, links: List[LinkRow]):
+    for start in range(0, len(links), BATCH_SIZE):
+        async with r.pipeline(transaction=False) as pipe:
+            for link in links[start:start + BATCH_SIZE]:
+                pipe.hset(f"short_url:{link.short_url}", mapping={"original_url": link.original_url, "expires_at": "",
+                                                                  "hits": 1})
+                pipe.expire(f"short_url:{link.short_url}", 3600)
+            await pipe.execute()
+
+
+async def write_legacy_stats(r, links: List[LinkRow]):
+    for start in range(0, len(links), BATCH_SIZE):
+        async with r.pipeline(transaction=False) as pipe:
+            for link in links[start:start + BATCH_SIZE]:
+                pipe.hset(f"stats:{link.short_url}", mapping={
+                    "clicks": link.clicks, "last_used": link.last_used.isoformat(),
+                    "owner": str(link.created_by_uuid) if link.created_by_uuid else ""})
+            await pipe.execute()
+
+
+async def write_compact(links: List[LinkRow]):
+    from redis_caching import warm_cached_links
+    for start in range(0, len(links), BATCH_SIZE):
+        await warm_cached_links(links[start:start + BATCH_SIZE])
+
+
+async def cleanup(r, links: List[LinkRow]):
+    from redis_caching import stats_bucket_key
+    for start in range(0, len(links), BATCH_SIZE):
+        async with r.pipeline(transaction=False) as pipe:
+            for link in links[start:start + BATCH_SIZE]:
+                pipe.delete(f"short_url:{link.short_url}", f"stats:{link.short_url}")
+                pipe.hdel(stats_bucket_key(link.short_url), link.short_url)
+            await pipe.execute()
+
+
+async def write_per_key(r, links: List[LinkRow]):
+    await write_link_entries(r, links)
+    await write_legacy_stats(r, links)
+
+
+async def measure(r, links: List[LinkRow], write) -> int:
+    """Прирост used_memory от записи ссылок. Ссылки удаляются после замера."""
+    before = await used_memory(r)
+    await write
+    used = await used_memory(r) - before
+    await cleanup(r, links)
+    return used
+
+
+async def run(count: int) -> dict:
+    from redis_caching import r, stats_bucket_key
+    from config import STATS_BUCKETS
+
+    links = make_links(count)
+    await cleanup(r, links)
+
+    entries = await measure(r, links, write_link_entries(r, links))
+    per_key = await measure(r, links, write_per_key(r, links))
+    await write_compact(links)
+    encoding = await r.object("encoding", stats_bucket_key(links[0].short_url))
+    await cleanup(r, links)
+    bucketed = await measure(r, links, write_compact(links))
+
+    return {
+        "benchmark": "redis_memory",
+        "links": count,
+        "stats_buckets": STATS_BUCKETS,
+        "bucket_encoding": encoding,
+        "link_entry_bytes_per_link": round(entries / count, 1),
+        "per_key_bytes_per_link": round(per_key / count, 1),
+        "bucketed_bytes_per_link": round(bucketed / count, 1),
+        "per_key_stats_bytes_per_link": round((per_key - entries) / count, 1),
+        "bucketed_stats_bytes_per_link": round((bucketed - entries) / count, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--links", type=int, default=100000)
+    parser.add_argument("--buckets", type=int, help="STATS_BUCKETS для замера, по умолчанию --links / 100")
+    args = parser.parse_args()
+
+    # до импорта приложения: config читает STATS_BUCKETS при импорте
+    os.environ["STATS_BUCKETS"] = str(args.buckets or max(1, args.links // 100))
+    print(json.dumps(asyncio.run(run(args.links))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Бенчмарк создания ссылок: одиночный /links/shorten против пакетного /links/shorten/batch.
+
+Приложение запускается в процессе (httpx + ASGITransport) с Postgres и Redis из конфигурации приложения.
+Выводит ссылки в секунду для обоих вариантов в JSON. Созданные ссылки удаляются после замера.
+
+Запуск из корня репозитория с теми же переменными окружения, что и у приложения:
+    python benchmarks/shorten_throughput.py --links 2000 --concurrency 8
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import httpx
+from sqlalchemy import delete
+
+from main import app
+from database import async_session_maker
+from shurl.models import Link
+
+
+async def _cleanup(short_codes: list):
+    async with async_session_maker() as session:
+        for start in range(0, len(short_codes), 1000):
+            await session.execute(delete(Link.__table__).where(
+                Link.__table__.c.short_url.in_(short_codes[start:start + 1000])))
+        await session.commit()
+
+
+async def bench_single(client: httpx.AsyncClient, links: int, concurrency: int) -> tuple:
+    short_codes = []
+
+    async def worker(n: int):
+        for i in range(n):
+            response = await client.post("/links/shorten", params={"original_url": f"example.com/single/{i}"})
+            assert response.status_code == 201, response.text
+            short_codes.append(response.json()["short_code"])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(links // concurrency) for _ in range(concurrency)))
+    return len(short_codes) / (time.perf_counter() - started), short_codes
+
+
+async def bench_batch(client: httpx.AsyncClient, links: int, ndjson: bool) -> tuple:
+    items = [{"original_url": f"example.com/batch/{i}"} for i in range(links)]
+    if ndjson:
+        kwargs = {"content": "\n".join(json.dumps(item) for item in items),
+                  "headers": {"Content-Type": "application/x-ndjson"}}
+    else:
+        kwargs = {"json": items}
+
+    started = time.perf_counter()
+    response = await client.post("/links/shorten/batch", **kwargs)
+    elapsed = time.perf_counter() - started
+    assert response.status_code == 201, response.text
+    short_codes = [result["short_code"] for result in response.json()["results"] if result["status"] == "created"]
+    assert len(short_codes) == links, len(short_codes)
+    return links / elapsed, short_codes
+
+
+async def run(links: int, concurrency: int) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        single_rate, single_codes = await bench_single(client, links, concurrency)
+        await _cleanup(single_codes)
+        json_rate, json_codes = await bench_batch(client, links, ndjson=False)
+        await _cleanup(json_codes)
+        ndjson_rate, ndjson_codes = await bench_batch(client, links, ndjson=True)
+        await _cleanup(ndjson_codes)
+
+    return {
+        "benchmark": "shorten_throughput",
+        "links": links,
+        "concurrency": concurrency,
+        "single_links_per_sec": round(single_rate, 1),
+        "batch_json_links_per_sec": round(json_rate, 1),
+        "batch_ndjson_links_per_sec": round(ndjson_rate, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--links", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(args.log_level)
+    print(json.dumps(asyncio.run(run(args.links, args.concurrency))))
+
+
+if __name__ == "__main__":
+    main()
@@ -9,4 +9,4 @@ sleep 1
 cd src || exit
 
 #gunicorn main:app --workers 4 --worker-class uvicorn.workers.UvicornWorker --bind=0.0.0.0:8000
-uvicorn main:app --host=0.0.0.0 --port=8000
\ No newline at end of file
+uvicorn main:app --host=0.0.0.0 --port=8000 --workers="${APP_WORKERS:-4}"
\ No newline at end of file
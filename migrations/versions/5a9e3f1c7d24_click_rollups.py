@@ -0,0 +1,34 @@
+"""Click rollups
+
+Revision ID: 5a9e3f1c7d24
+Revises: c41d7b2e9f08
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5a9e3f1c7d24'
+down_revision: Union[str, None] = 'c41d7b2e9f08'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('click_rollups',
+    sa.Column('short_url', sa.String(), nullable=False),
+    sa.Column('granularity', sa.String(), nullable=False),
+    sa.Column('bucket_start', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('clicks', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('short_url', 'granularity', 'bucket_start')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('click_rollups')
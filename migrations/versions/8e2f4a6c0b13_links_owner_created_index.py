@@ -0,0 +1,28 @@
+"""Links owner/created_at index
+
+Revision ID: 8e2f4a6c0b13
+Revises: 3b7c1e9a4d52
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e2f4a6c0b13'
+down_revision: Union[str, None] = '3b7c1e9a4d52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_links_owner_created', 'links', ['created_by_uuid', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_links_owner_created', table_name='links')
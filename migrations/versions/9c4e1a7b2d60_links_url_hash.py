@@ -0,0 +1,53 @@
+"""Links url hash
+
+Revision ID: 9c4e1a7b2d60
+Revises: e7a2c5d8b316
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from src.shurl.url_hash import url_hash
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c4e1a7b2d60'
+down_revision: Union[str, None] = 'e7a2c5d8b316'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_BATCH_SIZE = 10000
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('links', sa.Column('url_hash', sa.BigInteger(), nullable=True))
+
+    # каноническая форма считается в python, поэтому хэши заполняются пачками по id
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(sa.text(
+            "SELECT id, original_url FROM links WHERE id > :last_id ORDER BY id LIMIT :limit"
+        ), {"last_id": last_id, "limit": BACKFILL_BATCH_SIZE}).all()
+        if not rows:
+            break
+        bind.execute(sa.text(
+            "UPDATE links SET url_hash = v.url_hash FROM unnest(CAST(:ids AS integer[]), CAST(:hashes AS bigint[])) "
+            "AS v(id, url_hash) WHERE links.id = v.id"
+        ), {"ids": [row.id for row in rows], "hashes": [url_hash(row.original_url) for row in rows]})
+        last_id = rows[-1].id
+
+    op.alter_column('links', 'url_hash', nullable=False)
+    op.create_index(op.f('ix_links_url_hash'), 'links', ['url_hash'], unique=False)
+    op.drop_index(op.f('ix_links_original_url'), table_name='links')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index(op.f('ix_links_original_url'), 'links', ['original_url'], unique=False)
+    op.drop_index(op.f('ix_links_url_hash'), table_name='links')
+    op.drop_column('links', 'url_hash')
@@ -0,0 +1,43 @@
+"""User stats
+
+Revision ID: c41d7b2e9f08
+Revises: 8e2f4a6c0b13
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41d7b2e9f08'
+down_revision: Union[str, None] = '8e2f4a6c0b13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('user_stats',
+    sa.Column('user_id', sa.UUID(), nullable=False),
+    sa.Column('total_clicks', sa.BigInteger(), nullable=False),
+    sa.Column('active_links', sa.Integer(), nullable=False),
+    sa.Column('last_activity', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    # начальные значения по уже существующим ссылкам, в active_links - только неистекшие
+    op.execute("""
+        INSERT INTO user_stats (user_id, total_clicks, active_links, last_activity)
+        SELECT created_by_uuid, COALESCE(SUM(clicks), 0),
+               COUNT(*) FILTER (WHERE expires_at IS NULL OR expires_at > now()), MAX(last_used)
+        FROM links
+        WHERE created_by_uuid IS NOT NULL
+        GROUP BY created_by_uuid
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('user_stats')
@@ -0,0 +1,92 @@
+"""Partition links by expiry
+
+Revision ID: e7a2c5d8b316
+Revises: 5a9e3f1c7d24
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from datetime import datetime, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from src.config import LINKS_PARTITION_DAYS
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7a2c5d8b316'
+down_revision: Union[str, None] = '5a9e3f1c7d24'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PARTITION_SECONDS = LINKS_PARTITION_DAYS * 86400
+
+LINKS_COLUMNS = """
+    id integer NOT NULL DEFAULT nextval('links_id_seq'::regclass),
+    original_url varchar NOT NULL,
+    short_url varchar NOT NULL,
+    created_by_uuid uuid,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    updated_at timestamptz NOT NULL DEFAULT now(),
+    expires_at timestamptz,
+    last_used timestamptz,
+    clicks integer NOT NULL
+"""
+
+
+def _create_indexes():
+    op.create_index(op.f('ix_links_created_by_uuid'), 'links', ['created_by_uuid'], unique=False)
+    op.create_index(op.f('ix_links_expires_at'), 'links', ['expires_at'], unique=False)
+    op.create_index(op.f('ix_links_original_url'), 'links', ['original_url'], unique=False)
+    op.create_index('ix_links_owner_created', 'links', ['created_by_uuid', 'created_at', 'id'], unique=False)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('link_codes',
+    sa.Column('short_url', sa.String(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('short_url')
+    )
+
+    op.execute("ALTER TABLE links RENAME TO links_old")
+    op.execute("ALTER SEQUENCE links_id_seq OWNED BY NONE")
+    op.execute(f"CREATE TABLE links ({LINKS_COLUMNS}) "
+               f"PARTITION BY RANGE (COALESCE(expires_at, 'infinity'::timestamptz))")
+    op.execute("ALTER SEQUENCE links_id_seq OWNED BY links.id")
+    op.execute("CREATE TABLE links_forever PARTITION OF links FOR VALUES FROM ('infinity') TO (MAXVALUE)")
+
+    # секции под сроки уже существующих ссылок, в том числе истекших: их удалит первое обслуживание секций
+    buckets = op.get_bind().execute(sa.text(
+        "SELECT DISTINCT floor(extract(epoch FROM expires_at) / :size)::bigint * :size "
+        "FROM links_old WHERE expires_at IS NOT NULL"
+    ), {"size": PARTITION_SECONDS}).scalars().all()
+    for start in map(int, buckets):
+        lower, upper = (datetime.fromtimestamp(bound, timezone.utc) for bound in (start, start + PARTITION_SECONDS))
+        op.execute(f"CREATE TABLE links_p{lower:%Y%m%d} PARTITION OF links "
+                   f"FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')")
+
+    op.execute("INSERT INTO links SELECT id, original_url, short_url, created_by_uuid, created_at, updated_at, "
+               "expires_at, last_used, clicks FROM links_old")
+    op.execute("INSERT INTO link_codes (short_url, expires_at) SELECT short_url, expires_at FROM links_old")
+    op.execute("DROP TABLE links_old")
+
+    _create_indexes()
+    op.create_index(op.f('ix_links_short_url'), 'links', ['short_url'], unique=False)
+    op.create_index('ix_links_id', 'links', ['id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("ALTER TABLE links RENAME TO links_partitioned")
+    op.execute("ALTER SEQUENCE links_id_seq OWNED BY NONE")
+    op.execute(f"CREATE TABLE links ({LINKS_COLUMNS}, PRIMARY KEY (id))")
+    op.execute("ALTER SEQUENCE links_id_seq OWNED BY links.id")
+    op.execute("INSERT INTO links SELECT id, original_url, short_url, created_by_uuid, created_at, updated_at, "
+               "expires_at, last_used, clicks FROM links_partitioned")
+    op.execute("DROP TABLE links_partitioned")
+
+    _create_indexes()
+    op.create_index(op.f('ix_links_short_url'), 'links', ['short_url'], unique=True)
+    op.drop_table('link_codes')
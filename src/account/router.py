@@ -1,21 +1,25 @@
 from fastapi import APIRouter, HTTPException, Depends, status, Query, Path
-from fastapi.responses import RedirectResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import RedirectResponse, StreamingResponse
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import insert, select, delete, update, or_, and_
+from sqlalchemy import insert, select, delete, update, or_, and_, tuple_
 from sqlalchemy.exc import IntegrityError, NoResultFound
 
 from typing_extensions import Annotated
+from typing import Any, AsyncIterator, Dict, List, Literal, Tuple
 from datetime import datetime, timezone, timedelta
-from logging import getLogger
+from base64 import urlsafe_b64encode, urlsafe_b64decode
 import json
+from logging import getLogger
 
-from database import get_async_session
+from database import get_async_session, get_read_session, read_session
 from shurl.utils import generate_random_string, validate_and_fix_url
-from shurl.models import Link
+from shurl.models import Link, LinkCode
 from shurl.schemas import ShortenedItem
 
-from redis_caching import r, write_stats_to_db
+from redis_caching import (get_cached_stats_many, pop_cached_stats_many, adjust_user_stats, get_user_summary,
+                           links_expired_until, is_counted_link)
 from auth.auth import User, current_active_user, current_user
 
 
@@ -26,58 +30,100 @@ router = APIRouter(
     tags=["Account"],
 )
 
+MYLINKS_MAX_PAGE_SIZE = 1000
+# Размер страницы, которыми читается БД при потоковой выгрузке
+MYLINKS_EXPORT_PAGE_SIZE = 1000
+
+
+def _encode_cursor(created_at: datetime, link_id: int) -> str:
+    return urlsafe_b64encode(json.dumps([created_at.isoformat(), link_id]).encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        created_at, link_id = json.loads(urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), int(link_id)
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+async def _my_links_page(session: AsyncSession, user_id, after: Tuple[datetime, int] | None,
+                         limit: int) -> List[Dict[str, Any]]:
+    """Страница живых ссылок пользователя по возрастанию (created_at, id) после курсора after.
+
+    Статистики из кэша забираются одним пайплайном на страницу.
+    """
+    table = Link.__table__
+    query = select(table).where(
+        and_(table.c.created_by_uuid == user_id,
+        or_(table.c.expires_at.is_(None), table.c.expires_at > datetime.now(timezone.utc)))
+    ) # type: ignore
+    if after is not None:
+        query = query.where(tuple_(table.c.created_at, table.c.id) > tuple_(*after))
+    query = query.order_by(table.c.created_at, table.c.id).limit(limit)
+
+    result = await session.execute(query)
+    links = result.all()
+
+    # Ищем клики в кэше
+    cached = await get_cached_stats_many([l.short_url for l in links])
+
+    page = []
+    for l, stats in zip(links, cached):
+        page.append({
+            "id": l.id,
+            "short_url": l.short_url,
+            "original_url": l.original_url,
+            "created_at": l.created_at,
+            "updated_at": l.updated_at,
+            "expires_at": l.expires_at,
+            "clicks": l.clicks if stats is None else stats['clicks'],
+            "last_used": l.last_used if stats is None else stats['last_used']
+        })
+    return page
+
+
+async def _export_my_links(user_id, after: Tuple[datetime, int] | None) -> AsyncIterator[str]:
+    """Все живые ссылки пользователя построчно в NDJSON, страницами по MYLINKS_EXPORT_PAGE_SIZE."""
+    # своя сессия: сессия из зависимости закрывается до начала отправки тела ответа
+    async with read_session() as session:
+        while True:
+            page = await _my_links_page(session, user_id, after, MYLINKS_EXPORT_PAGE_SIZE)
+            for link in page:
+                yield json.dumps(jsonable_encoder(link)) + "\n"
+            if len(page) < MYLINKS_EXPORT_PAGE_SIZE:
+                return
+            after = (page[-1]["created_at"], page[-1]["id"])
+
+
 @router.get("/mylinks")
-async def show_my_links(session: Annotated[AsyncSession, Depends(get_async_session)],
-                        user: Annotated[User, Depends(current_active_user)]):
+async def show_my_links(session: Annotated[AsyncSession, Depends(get_read_session)],
+                        user: Annotated[User, Depends(current_active_user)],
+                        limit: Annotated[int, Query(ge=1, le=MYLINKS_MAX_PAGE_SIZE)] = 100,
+                        cursor: Annotated[str | None, Query()] = None,
+                        format: Annotated[Literal["json", "ndjson"], Query()] = "json"):
+    """Ссылки пользователя постранично в порядке создания.
+
+    next_cursor из ответа передается в cursor для следующей страницы, на последней странице он null.
+    format=ndjson отдает потоком все ссылки, начиная с cursor, по одной в строке (limit не учитывается).
+    """
     try:
+        after = _decode_cursor(cursor) if cursor is not None else None
 
-        query = select(Link.__table__).where(
-            and_(Link.__table__.c.created_by_uuid == user.id,
-            or_(Link.__table__.c.expires_at.is_(None), Link.__table__.c.expires_at > datetime.now(timezone.utc)))
-        ) # type: ignore
+        if format == "ndjson":
+            return StreamingResponse(_export_my_links(user.id, after), media_type="application/x-ndjson")
 
-        # logger.debug(query)
+        links = await _my_links_page(session, user.id, after, limit)
 
-        result = await session.execute(query)
-        await session.commit()
-        links = result.all()
-
-        report = {'links':[],
-                  'total_clicks':0}
-
-        # Ищем клики в кэше
-        for l in links:
-            short_code = l.short_url
-            stats_key = f"stats:{short_code}"
-            stats = await r.get(stats_key)
-
-            if stats is None:
-                report['links'].append({
-                    "short_url": l.short_url,
-                    "original_url": l.original_url,
-                    "created_at": l.created_at,
-                    "updated_at": l.updated_at,
-                    "expires_at": l.expires_at,
-                    "clicks": l.clicks,
-                    "last_used": l.last_used
-                })
-                report['total_clicks']+=l.clicks
-            else:
-                stats = json.loads(stats)
-                report['links'].append({
-                    "short_url": l.short_url,
-                    "original_url": l.original_url,
-                    "created_at": l.created_at,
-                    "updated_at": l.updated_at,
-                    "expires_at": l.expires_at,
-                    "clicks": int(stats['clicks']),
-                    "last_used": datetime.fromisoformat(stats['last_used'])
-                })
-                report['total_clicks'] += int(stats['clicks'])
-
-        return report
-    except NoResultFound:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Original URL not found")
+        next_cursor = None
+        if len(links) == limit:
+            next_cursor = _encode_cursor(links[-1]["created_at"], links[-1]["id"])
+
+        # сумма по всем ссылкам пользователя, а не по странице: из агрегатов, без обхода ссылок
+        summary = await get_user_summary(user.id)
+        return {'links': links,
+                'total_clicks': summary['total_clicks'],
+                'next_cursor': next_cursor}
     except HTTPException as http_exc:
         raise http_exc
     except Exception as e:
@@ -85,6 +131,19 @@ async def show_my_links(session: Annotated[AsyncSession, Depends(get_async_sessi
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 
+@router.get("/summary")
+async def show_summary(user: Annotated[User, Depends(current_active_user)]):
+    """Агрегаты пользователя: всего кликов по его ссылкам, число ссылок и время последнего клика.
+
+    Счетчики поддерживаются при каждом клике, создании и удалении ссылки, так что ответ не зависит от числа ссылок.
+    """
+    try:
+        return await get_user_summary(user.id)
+    except Exception as e:
+        logger.warning(e.args)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+
 @router.delete("/remove_unused_links")
 async def remove_unused_links(session: Annotated[AsyncSession, Depends(get_async_session)],
                               user: Annotated[User, Depends(current_active_user)],
@@ -100,10 +159,20 @@ async def remove_unused_links(session: Annotated[AsyncSession, Depends(get_async
                 Link.__table__.c.last_used.is_(None),
                 Link.__table__.c.last_used < datetime.now(timezone.utc) - timedelta(days=days, hours=hours)
             )
-        ))  # type: ignore
+        )).returning(Link.__table__.c.short_url, Link.__table__.c.clicks, Link.__table__.c.expires_at)  # type: ignore
 
-        await session.execute(delete_query)
+        result = await session.execute(delete_query)
+        deleted = result.all()
+        short_codes = [l.short_url for l in deleted]
+        if short_codes:
+            await session.execute(delete(LinkCode.__table__).where(LinkCode.__table__.c.short_url.in_(short_codes)))
         await session.commit()
+
+        expired_until = await links_expired_until()
+        cached = await pop_cached_stats_many(short_codes)
+        clicks = sum(l.clicks if stats is None else stats['clicks'] for l, stats in zip(deleted, cached))
+        links = sum(is_counted_link(l.expires_at, expired_until) for l in deleted)
+        await adjust_user_stats({user.id: (-clicks, -links)})
         return {"message": "Links deleted successfully"}
     except HTTPException as http_exc:
         raise http_exc
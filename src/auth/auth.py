@@ -1,8 +1,11 @@
 from fastapi_users.authentication import BearerTransport, JWTStrategy, AuthenticationBackend
+from fastapi_users.jwt import decode_jwt
+from fastapi_users import exceptions
+import jwt
 from database import get_async_session
 from fastapi_users.db import SQLAlchemyUserDatabase
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import Optional
+from typing import Any, Dict, Optional
 from fastapi import Depends, Request
 from fastapi_users import BaseUserManager, UUIDIDMixin
 from config import SECRET
@@ -10,6 +13,7 @@ import logging
 import uuid
 from fastapi_users import FastAPIUsers
 from auth.models import User
+from redis_caching import local_users, publish_user_invalidation
 
 logger = logging.getLogger('auth_manager')
 
@@ -19,8 +23,39 @@ bearer_transport = BearerTransport(tokenUrl="auth/jwt/login")
 async def get_user_db(session: AsyncSession = Depends(get_async_session)):
     yield SQLAlchemyUserDatabase(session, User)
 
+class CachedJWTStrategy(JWTStrategy):
+    """JWT-стратегия, которая берет пользователя из локального кэша воркера вместо запроса в БД.
+
+    Подпись и срок токена проверяются на каждом запросе, кэшируется только пользователь по id.
+    UserManager сбрасывает его из кэшей всех воркеров при изменении.
+    """
+
+    async def read_token(self, token: Optional[str], user_manager: BaseUserManager[User, uuid.UUID]) -> Optional[User]:
+        if token is None:
+            return None
+
+        try:
+            data = decode_jwt(token, self.decode_key, self.token_audience, algorithms=[self.algorithm])
+            user_id = data.get("sub")
+            if user_id is None:
+                return None
+        except jwt.PyJWTError:
+            return None
+
+        user = local_users.get(user_id)
+        if user is not None:
+            return user
+
+        try:
+            user = await user_manager.get(user_manager.parse_id(user_id))
+        except (exceptions.UserNotExists, exceptions.InvalidID):
+            return None
+        local_users.set(user_id, user)
+        return user
+
+
 def get_jwt_strategy() -> JWTStrategy:
-    return JWTStrategy(secret=SECRET, lifetime_seconds=3600)
+    return CachedJWTStrategy(secret=SECRET, lifetime_seconds=3600)
 
 auth_backend = AuthenticationBackend(
     name="jwt",
@@ -36,6 +71,19 @@ class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
     async def on_after_register(self, user: User, request: Optional[Request] = None):
         logger.debug(f"User {user.id} has registered.")
 
+    async def on_after_update(self, user: User, update_dict: Dict[str, Any], request: Optional[Request] = None):
+        # в том числе деактивация: закэшированный пользователь не должен пройти проверку активности
+        await publish_user_invalidation(user.id)
+
+    async def on_after_reset_password(self, user: User, request: Optional[Request] = None):
+        await publish_user_invalidation(user.id)
+
+    async def on_after_verify(self, user: User, request: Optional[Request] = None):
+        await publish_user_invalidation(user.id)
+
+    async def on_after_delete(self, user: User, request: Optional[Request] = None):
+        await publish_user_invalidation(user.id)
+
     async def on_after_forgot_password(
         self, user: User, token: str, request: Optional[Request] = None
     ):
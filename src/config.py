@@ -10,6 +10,19 @@ DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
 DB_NAME = os.getenv("DB_NAME")
 
+# Реплики для чтения через запятую (host:port, учетные данные и база те же, что у основной БД)
+DB_REPLICA_HOSTS = [host.strip() for host in os.getenv("DB_REPLICA_HOSTS", "").split(",") if host.strip()]
+# Реплика с отставанием больше DB_REPLICA_MAX_LAG секунд не используется, пока не догонит
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "5"))
+# Пул соединений каждого движка (основная БД и каждая реплика) и ограничение времени запроса в секундах (0 - без него)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "-1"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() in ("1", "true", "yes")
+DB_STATEMENT_TIMEOUT = float(os.getenv("DB_STATEMENT_TIMEOUT", "0"))
+
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
 REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
@@ -18,3 +31,94 @@ SECRET = os.getenv("SECRET")
 
 APP_HOST = os.getenv("APP_HOST")
 APP_PORT = os.getenv("APP_PORT")
+
+# Уровень логов приложения. DEBUG пишет строку на каждый редирект, для прода он слишком дорог
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# Фоновая выгрузка статистик из Redis в БД
+STATS_FLUSH_INTERVAL = float(os.getenv("STATS_FLUSH_INTERVAL", "5"))
+STATS_FLUSH_BATCH_SIZE = int(os.getenv("STATS_FLUSH_BATCH_SIZE", "1000"))
+# Через сколько секунд неподтвержденная выгрузка считается потерянной и возвращается в очередь
+STATS_INFLIGHT_TIMEOUT = float(os.getenv("STATS_INFLIGHT_TIMEOUT", "60"))
+
+# Записи статистик в Redis: число хэшей-корзин (чтобы хэш оставался в компактной кодировке listpack, на корзину должно
+# приходиться не больше hash-max-listpack-entries записей; смена числа теряет невыгруженные клики), через сколько секунд
+# без изменений выгруженная запись удаляется (больше CACHE_TTL_MAX) и как часто лидер ищет такие записи
+STATS_BUCKETS = int(os.getenv("STATS_BUCKETS", "65536"))
+STATS_TTL = float(os.getenv("STATS_TTL", "86400"))
+STATS_EXPIRY_INTERVAL = float(os.getenv("STATS_EXPIRY_INTERVAL", "3600"))
+
+# Фоновую синхронизацию выполняет один процесс-лидер, остальные воркеры его подменяют при падении
+LEADER_LEASE_TTL = float(os.getenv("LEADER_LEASE_TTL", "15"))
+LEADER_RENEW_INTERVAL = float(os.getenv("LEADER_RENEW_INTERVAL", "5"))
+
+# Локальный кэш ссылок в каждом воркере перед Redis
+LOCAL_CACHE_MAX_ENTRIES = int(os.getenv("LOCAL_CACHE_MAX_ENTRIES", "10000"))
+LOCAL_CACHE_TTL = float(os.getenv("LOCAL_CACHE_TTL", "5"))
+LOCAL_CLICKS_FLUSH_INTERVAL = float(os.getenv("LOCAL_CLICKS_FLUSH_INTERVAL", "1"))
+
+# Локальный кэш пользователей, найденных по JWT: изменения пользователя сбрасывают его сразу,
+# изменения в обход приложения видны не позже чем через AUTH_USER_CACHE_TTL секунд
+AUTH_USER_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_USER_CACHE_MAX_ENTRIES", "10000"))
+AUTH_USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", "30"))
+
+# Загрузка ссылки из БД при промахе: один запрос на код, остальные ждут его результата
+LINK_LOAD_LOCK_TTL = float(os.getenv("LINK_LOAD_LOCK_TTL", "1"))
+LINK_LOAD_POLL_INTERVAL = float(os.getenv("LINK_LOAD_POLL_INTERVAL", "0.01"))
+
+# Фильтр Блума существующих коротких кодов и кэш ненайденных кодов перед запросом в БД
+BLOOM_CAPACITY = int(os.getenv("BLOOM_CAPACITY", "1000000"))
+BLOOM_ERROR_RATE = float(os.getenv("BLOOM_ERROR_RATE", "0.001"))
+BLOOM_REBUILD_INTERVAL = float(os.getenv("BLOOM_REBUILD_INTERVAL", "86400"))
+NEGATIVE_CACHE_TTL = int(os.getenv("NEGATIVE_CACHE_TTL", "30"))
+
+# Время жизни ссылки в кэше Redis: растет вдвое при каждом удвоении числа попаданий, от минимума до максимума
+CACHE_TTL_MIN = float(os.getenv("CACHE_TTL_MIN", "30"))
+CACHE_TTL_MAX = float(os.getenv("CACHE_TTL_MAX", "3600"))
+
+# Прогрев кэша при старте: сколько самых популярных ссылок загрузить в Redis (0 - не прогревать), порядок
+# (clicks - по числу кликов, last_used - по времени последнего перехода), размер пачки и предел времени в секундах
+WARMUP_LINKS = int(os.getenv("WARMUP_LINKS", "0"))
+WARMUP_ORDER = os.getenv("WARMUP_ORDER", "clicks")
+WARMUP_BATCH_SIZE = int(os.getenv("WARMUP_BATCH_SIZE", "1000"))
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "60"))
+
+# Пакетное создание ссылок
+SHORTEN_BATCH_MAX_ITEMS = int(os.getenv("SHORTEN_BATCH_MAX_ITEMS", "100000"))
+SHORTEN_BATCH_CHUNK_SIZE = int(os.getenv("SHORTEN_BATCH_CHUNK_SIZE", "1000"))
+
+# Выдача коротких кодов: sequence - переставленная последовательность блоками на воркер, random - случайные коды.
+# SHORT_CODE_KEY обязателен в режиме sequence. Смена ключа меняет перестановку, и новые коды могут столкнуться
+# со старыми (такие коллизии переживаются ретраем)
+SHORT_CODE_MODE = os.getenv("SHORT_CODE_MODE", "sequence")
+SHORT_CODE_BLOCK_SIZE = int(os.getenv("SHORT_CODE_BLOCK_SIZE", "1000"))
+SHORT_CODE_KEY = os.getenv("SHORT_CODE_KEY")
+
+# Аналитика переходов: события в Redis Stream и их свертка по часам и суткам
+CLICK_EVENTS_BUFFER_MAX = int(os.getenv("CLICK_EVENTS_BUFFER_MAX", "100000"))
+CLICK_STREAM_MAXLEN = int(os.getenv("CLICK_STREAM_MAXLEN", "1000000"))
+CLICK_ROLLUP_INTERVAL = float(os.getenv("CLICK_ROLLUP_INTERVAL", "60"))
+CLICK_ROLLUP_BATCH_SIZE = int(os.getenv("CLICK_ROLLUP_BATCH_SIZE", "10000"))
+# Через сколько секунд прочитанные, но не подтвержденные события забирает другой потребитель
+CLICK_ROLLUP_CLAIM_IDLE = float(os.getenv("CLICK_ROLLUP_CLAIM_IDLE", "300"))
+
+# Топ популярных ссылок: длина корзины и самое длинное окно в секундах, сколько кодов хранить в корзине,
+# размер Count-Min Sketch корзины (ширина строки и число строк), сколько разных кодов копить в памяти
+# воркера между отправками и сколько секунд кэшировать ответ GET /links/top
+HOT_LINKS_BUCKET_SECONDS = int(os.getenv("HOT_LINKS_BUCKET_SECONDS", "60"))
+HOT_LINKS_MAX_WINDOW = int(os.getenv("HOT_LINKS_MAX_WINDOW", "3600"))
+HOT_LINKS_CAPACITY = int(os.getenv("HOT_LINKS_CAPACITY", "1000"))
+HOT_LINKS_SKETCH_WIDTH = int(os.getenv("HOT_LINKS_SKETCH_WIDTH", "2048"))
+HOT_LINKS_SKETCH_DEPTH = int(os.getenv("HOT_LINKS_SKETCH_DEPTH", "4"))
+HOT_LINKS_BUFFER_MAX = int(os.getenv("HOT_LINKS_BUFFER_MAX", "10000"))
+HOT_LINKS_QUERY_CACHE_TTL = float(os.getenv("HOT_LINKS_QUERY_CACHE_TTL", "1"))
+
+# Удаление истекших ссылок пачками: размер пачки и пауза между пачками в секундах
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "1000"))
+PURGE_BATCH_PAUSE = float(os.getenv("PURGE_BATCH_PAUSE", "0.1"))
+
+# Секционирование links по сроку жизни: длина секции в сутках (после запуска не менять), самый дальний допустимый
+# срок ссылки в сутках и сколько секций создавать заранее сверх него
+LINKS_PARTITION_DAYS = int(os.getenv("LINKS_PARTITION_DAYS", "7"))
+LINKS_MAX_EXPIRY_DAYS = int(os.getenv("LINKS_MAX_EXPIRY_DAYS", "365"))
+LINKS_PARTITIONS_AHEAD = int(os.getenv("LINKS_PARTITIONS_AHEAD", "8"))
@@ -1,13 +1,160 @@
-from typing import AsyncGenerator
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
-from config import DB_HOST, DB_NAME, DB_PASS, DB_PORT, DB_USER
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from logging import getLogger
+from typing import Any, AsyncGenerator, Dict, List
+
+from prometheus_client import Histogram
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from config import (DB_HOST, DB_NAME, DB_PASS, DB_PORT, DB_USER, DB_REPLICA_HOSTS, DB_POOL_SIZE, DB_MAX_OVERFLOW,
+                    DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_STATEMENT_TIMEOUT, DB_REPLICA_MAX_LAG,
+                    DB_REPLICA_CHECK_INTERVAL)
+
+logger = getLogger('database')
 
 DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-engine = create_async_engine(DATABASE_URL)
+# Чтения GET-ручек идут через get_read_session: на реплику из DB_REPLICA_HOSTS, отставание которой не больше
+# DB_REPLICA_MAX_LAG секунд, а если таких нет - на основную БД. Отставание реплик раз в DB_REPLICA_CHECK_INTERVAL
+# секунд проверяет фоновая задача run_replica_checks, выбор сессии только читает результат последней проверки.
+# Без этой задачи (например, в celery) чтения идут на основную БД. Запись всегда идет через get_async_session.
+
+
+# Время запросов к БД по первому слову запроса (SELECT, INSERT, ...), от отправки до получения результата
+DB_QUERY_SECONDS = Histogram(
+    "shurl_db_query_duration_seconds", "Database statement execution time", ["operation"],
+    buckets=(0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+    DB_QUERY_SECONDS.labels(operation).observe(time.perf_counter() - started)
+
+
+def _handle_error(context):
+    # после ошибки after_cursor_execute не вызывается, убираем отметку начала сами
+    started = context.connection.info.get("query_started") if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def _create_engine(url: str) -> AsyncEngine:
+    connect_args = {}
+    if DB_STATEMENT_TIMEOUT > 0:
+        connect_args["server_settings"] = {"statement_timeout": str(int(DB_STATEMENT_TIMEOUT * 1000))}
+    created = create_async_engine(url, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                                  pool_timeout=DB_POOL_TIMEOUT, pool_recycle=DB_POOL_RECYCLE,
+                                  pool_pre_ping=DB_POOL_PRE_PING, connect_args=connect_args)
+    event.listen(created.sync_engine, "before_cursor_execute", _before_execute)
+    event.listen(created.sync_engine, "after_cursor_execute", _after_execute)
+    event.listen(created.sync_engine, "handle_error", _handle_error)
+    return created
+
+
+engine = _create_engine(DATABASE_URL)
 async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
+# Чтения без транзакции: запрос уходит без BEGIN и COMMIT, одним обращением к БД. Пул общий с engine
+read_engine = engine.execution_options(isolation_level="AUTOCOMMIT")
 
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session_maker() as session:
         yield session
+
+
+# 0, если реплика проиграла все полученное от основной БД: на простаивающей основной БД
+# pg_last_xact_replay_timestamp стоит на месте, и отставание по нему росло бы без записей
+_REPLICA_LAG_QUERY = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class _Replica:
+    def __init__(self, host: str):
+        self.host = host
+        self.engine = _create_engine(f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{host}/{DB_NAME}")
+        self.read_engine = self.engine.execution_options(isolation_level="AUTOCOMMIT")
+        self.lag: float | None = None
+        self.healthy = False
+
+    async def check(self):
+        try:
+            async with asyncio.timeout(DB_REPLICA_CHECK_INTERVAL):
+                async with self.engine.connect() as conn:
+                    self.lag = float((await conn.execute(_REPLICA_LAG_QUERY)).scalar_one())
+            healthy = self.lag <= DB_REPLICA_MAX_LAG
+            if not healthy and self.healthy:
+                logger.warning(f"Реплика {self.host} отстает на {self.lag:.1f} с, чтения идут мимо нее")
+        except Exception as e:
+            if self.healthy:
+                logger.warning(f"Реплика {self.host} недоступна, чтения идут мимо нее: {e}")
+            self.lag = None
+            healthy = False
+        self.healthy = healthy
+
+
+replicas = [_Replica(host) for host in DB_REPLICA_HOSTS]
+_next_replica = 0
+
+
+async def run_replica_checks():
+    """Раз в DB_REPLICA_CHECK_INTERVAL секунд проверяет отставание всех реплик. Запускается в каждом воркере."""
+    if not replicas:
+        return
+    while True:
+        await asyncio.gather(*(replica.check() for replica in replicas))
+        await asyncio.sleep(DB_REPLICA_CHECK_INTERVAL)
+
+
+def _read_engine() -> AsyncEngine:
+    """Следующая по кругу реплика с допустимым отставанием или основная БД, без транзакций."""
+    global _next_replica
+    for i in range(len(replicas)):
+        replica = replicas[(_next_replica + i) % len(replicas)]
+        if replica.healthy:
+            _next_replica = (_next_replica + i + 1) % len(replicas)
+            return replica.read_engine
+    return read_engine
+
+
+@asynccontextmanager
+async def read_session() -> AsyncGenerator[AsyncSession, None]:
+    """Сессия только для чтения. Данные в ней могут отставать от основной БД на DB_REPLICA_MAX_LAG секунд.
+
+    Каждый запрос выполняется в своей транзакции (AUTOCOMMIT), commit после чтения не нужен.
+    """
+    async with async_session_maker(bind=_read_engine()) as session:
+        yield session
+
+
+@asynccontextmanager
+async def primary_read_session() -> AsyncGenerator[AsyncSession, None]:
+    """Сессия только для чтения с основной БД, тоже без транзакций."""
+    async with async_session_maker(bind=read_engine) as session:
+        yield session
+
+
+async def get_read_session() -> AsyncGenerator[AsyncSession, None]:
+    async with read_session() as session:
+        yield session
+
+
+def is_replica_session(session: AsyncSession) -> bool:
+    """Читает ли сессия с реплики. Если на реплике чего-то не нашлось, это стоит перепроверить в основной БД."""
+    return session.bind is not read_engine
+
+
+def get_database_status() -> Dict[str, Any]:
+    pool: Any = engine.pool
+    replicas_status: List[Dict[str, Any]] = [{"host": replica.host, "healthy": replica.healthy, "lag": replica.lag}
+                                             for replica in replicas]
+    return {"pool": {"size": pool.size(), "checked_out": pool.checkedout(), "overflow": pool.overflow()},
+            "replicas": replicas_status}
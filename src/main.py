@@ -1,24 +1,57 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from shurl.router import router as shurl_router
+from shurl.partitions import create_future_partitions
 from contextlib import asynccontextmanager
 import asyncio
 import uvicorn
 import logging
-from redis_caching import process_expired_keys
+from redis_caching import (run_as_leader, run_stats_sync, run_stats_expiry, flush_stats, get_flusher_status,
+                           listen_invalidations,
+                           run_click_buffer_flusher, flush_buffered_clicks, get_cache_status, single_flight_stats,
+                           run_bloom_maintenance, get_bloom_status, flush_user_stats,
+                           run_click_event_flusher, flush_click_events, get_analytics_status,
+                           run_hot_clicks_flusher, flush_hot_clicks, get_hot_links_status,
+                           warm_up_cache, get_warmup_status)
 from auth.auth import auth_backend, fastapi_users_app
 from auth.schemas import UserRead, UserCreate
 from account.router import router as account_router
+from database import get_database_status, run_replica_checks
+from metrics import MetricsMiddleware, render_metrics
+from prometheus_client import CONTENT_TYPE_LATEST
+from config import LOG_LEVEL
 
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=LOG_LEVEL)
 
 @asynccontextmanager
 async def lifespan(application: FastAPI):
-    task = asyncio.create_task(process_expired_keys())
+    # секции links под все допустимые сроки ссылок, если задача обслуживания еще не успела их создать
+    try:
+        await create_future_partitions()
+    except Exception as e:
+        logging.getLogger('shurl_partitions').warning(f"Не удалось создать секции links: {e}")
+    # прогрев кэша до начала приема запросов: воркер готов, только когда самые популярные ссылки уже в Redis
+    await warm_up_cache()
+    # фоновая синхронизация работает только в одном воркере (лидере), остальные ждут своей очереди
+    tasks = [asyncio.create_task(run_as_leader([run_stats_sync, run_stats_expiry, run_bloom_maintenance])),
+             asyncio.create_task(listen_invalidations()),
+             asyncio.create_task(run_click_buffer_flusher()),
+             asyncio.create_task(run_click_event_flusher()),
+             asyncio.create_task(run_hot_clicks_flusher()),
+             asyncio.create_task(run_replica_checks())]
     yield
-    task.cancel()
-    await task
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    # выгружаем буферы воркера и то, что осталось в очереди, чтобы не ждать следующего запуска.
+    # Ошибка одной выгрузки не должна мешать остальным
+    for flush in (flush_buffered_clicks, flush_click_events, flush_hot_clicks, flush_stats, flush_user_stats):
+        try:
+            await flush()
+        except Exception as e:
+            logging.getLogger('redis_caching').warning(f"Ошибка при выгрузке {flush.__name__} при остановке: {e}")
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(fastapi_users_app.get_auth_router(auth_backend), prefix="/auth/jwt", tags=["auth"])
 app.include_router(fastapi_users_app.get_register_router(UserRead, UserCreate), prefix="/auth", tags=["auth"])
@@ -30,6 +63,30 @@ app.include_router(shurl_router)
 async def root():
     return {"message": "App healthy"}
 
+@app.get("/status/stats_sync")
+async def stats_sync_status():
+    """Состояние выгрузки статистик из Redis в БД: размер очереди, отставание, последние выгрузки."""
+    return await get_flusher_status()
+
+@app.get("/status/cache")
+async def cache_status():
+    """Попадания в локальный кэш воркера (L1) и в Redis (L2), отсев неизвестных кодов, загрузки ссылок из БД,
+    буферы событий переходов и кликов для топа ссылок, прогрев кэша при старте."""
+    return {**get_cache_status(), "bloom": get_bloom_status(), "db_loads": single_flight_stats,
+            "click_events": get_analytics_status(), "hot_links": get_hot_links_status(),
+            "warmup": get_warmup_status()}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Метрики в формате Prometheus: время запросов по маршрутам, команд Redis и запросов к БД, попадания в кэши,
+    пулы соединений и очередь выгрузки статистик."""
+    return Response(await render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/status/database")
+async def database_status():
+    """Занятость пула соединений основной БД, доступность и отставание реплик для чтения."""
+    return get_database_status()
+
 
 if __name__ == "__main__":
     uvicorn.run("main:app", reload=False, host="0.0.0.0", log_level="info")
\ No newline at end of file
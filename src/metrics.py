@@ -0,0 +1,136 @@
+import time
+from logging import getLogger
+from typing import Any, Iterable
+
+from prometheus_client import REGISTRY, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
+from prometheus_client.registry import Collector
+
+from database import engine, replicas
+from redis_caching import (r, local_links, local_users, single_flight_stats, get_analytics_status, get_bloom_status,
+                           get_cache_status)
+from redis_caching.clicks import redis_stats, get_dirty_stats
+from redis_caching.flusher import flusher_status
+from redis_caching.leader import lease
+
+# Метрики Prometheus для GET /metrics. Время HTTP-запросов пишет MetricsMiddleware, время команд Redis -
+# redis_caching.client, время запросов к БД - database. Счетчики кэшей, пулы соединений и очередь выгрузки
+# статистик не считаются на горячем пути: collector читает их из уже существующих счетчиков при сборе метрик.
+# Метрики свои у каждого воркера uvicorn, /metrics отдает метрики ответившего воркера.
+
+logger = getLogger('metrics')
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "shurl_http_request_duration_seconds", "HTTP request handling time by route template", ["method", "route", "status"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+
+class MetricsMiddleware:
+    """ASGI-middleware, которое пишет время обработки запроса в HTTP_REQUEST_SECONDS.
+
+    Маршрут берется шаблоном (/links/{short_code}), а не путем, чтобы число рядов не росло с числом ссылок.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(scope["method"], route.path if route is not None else "unmatched",
+                                        str(status_code)).observe(time.perf_counter() - started)
+
+
+# Значения, которые можно получить только из Redis, обновляются перед каждой отдачей метрик
+_stats_sync = {"dirty": 0, "inflight": 0, "lag_seconds": 0.0}
+
+
+def _pool_metrics(family: GaugeMetricFamily, name: str, pool: Any):
+    family.add_metric([name, "size"], pool.size())
+    family.add_metric([name, "checked_out"], pool.checkedout())
+    family.add_metric([name, "overflow"], max(pool.overflow(), 0))
+
+
+class _StatusCollector(Collector):
+    def collect(self) -> Iterable[Metric]:
+        cache = CounterMetricFamily("shurl_cache_requests", "Link and user cache lookups", labels=["cache", "result"])
+        for name, hits, misses in (("l1", local_links.hits, local_links.misses),
+                                   ("l2", redis_stats["hits"], redis_stats["misses"]),
+                                   ("users", local_users.hits, local_users.misses)):
+            cache.add_metric([name, "hit"], hits)
+            cache.add_metric([name, "miss"], misses)
+        yield cache
+
+        bloom = get_bloom_status()
+        unknown = CounterMetricFamily("shurl_bloom_checks", "Bloom filter checks before DB lookup", labels=["result"])
+        unknown.add_metric(["rejected"], bloom["rejected"])
+        unknown.add_metric(["passed"], bloom["passed"])
+        yield unknown
+
+        loads = CounterMetricFamily("shurl_link_loads", "Link loads from DB on cache miss", labels=["kind"])
+        for kind, value in single_flight_stats.items():
+            loads.add_metric([kind], value)
+        yield loads
+
+        db_pool = GaugeMetricFamily("shurl_db_pool_connections", "Database pool connections",
+                                    labels=["engine", "state"])
+        _pool_metrics(db_pool, "primary", engine.pool)
+        for replica in replicas:
+            _pool_metrics(db_pool, replica.host, replica.engine.pool)
+        yield db_pool
+
+        redis_pool = GaugeMetricFamily("shurl_redis_pool_connections", "Redis pool connections", labels=["state"])
+        pool = r.connection_pool
+        redis_pool.add_metric(["in_use"], len(getattr(pool, "_in_use_connections", ())))
+        redis_pool.add_metric(["available"], len(getattr(pool, "_available_connections", ())))
+        redis_pool.add_metric(["max"], getattr(pool, "max_connections", 0))
+        yield redis_pool
+
+        backlog = GaugeMetricFamily("shurl_stats_sync_backlog", "Link stats waiting to be written to DB",
+                                    labels=["queue"])
+        backlog.add_metric(["dirty"], _stats_sync["dirty"])
+        backlog.add_metric(["inflight"], _stats_sync["inflight"])
+        # буфер кликов пересоздается при каждой отправке, поэтому берем его размер через get_cache_status
+        backlog.add_metric(["local_clicks"], get_cache_status()["pending_clicks"])
+        backlog.add_metric(["click_events"], get_analytics_status()["pending"])
+        yield backlog
+        yield GaugeMetricFamily("shurl_stats_sync_lag_seconds", "Age of the oldest unsynced stats",
+                                value=_stats_sync["lag_seconds"])
+        yield GaugeMetricFamily("shurl_stats_sync_leader", "Whether this worker runs background sync",
+                                value=int(lease.is_leader))
+
+        flushed = CounterMetricFamily("shurl_stats_sync_rows", "Stats rows written to DB by this worker")
+        flushed.add_metric([], flusher_status["total_rows"])
+        yield flushed
+        errors = CounterMetricFamily("shurl_stats_sync_errors", "Stats flush errors in this worker")
+        errors.add_metric([], flusher_status["errors"])
+        yield errors
+
+
+REGISTRY.register(_StatusCollector())
+
+
+async def render_metrics() -> bytes:
+    """Текст метрик в формате Prometheus. Очередь выгрузки статистик читается из Redis."""
+    try:
+        _stats_sync.update(await get_dirty_stats())
+    except Exception as e:
+        # Redis недоступен: отдаем остальные метрики с последними известными значениями очереди
+        logger.warning(f"Не удалось прочитать очередь выгрузки статистик: {e}")
+    return generate_latest(REGISTRY)
@@ -1,42 +1,21 @@
-import redis.asyncio as redis
-import json
-from config import REDIS_HOST, REDIS_PORT, REDIS_PASSWORD
-from logging import getLogger
-from redis_caching.db_sync import write_stats_to_db
-from datetime import datetime
-
-logger = getLogger('redis_caching')
-
-r = redis.Redis(
-    host=REDIS_HOST,
-    port=REDIS_PORT,
-    password=REDIS_PASSWORD,
-    decode_responses=True
-)
-
-async def process_expired_keys():
-    pubsub = r.pubsub()
-    await pubsub.psubscribe("__keyevent@0__:expired")  # Подписываемся на события истечения срока жизни ключей
-
-    async for message in pubsub.listen():
-        if message["type"] == "pmessage":
-            key = message["data"]
-
-            logger.debug(key)
-
-            if key.startswith("short_url:"):
-                # logger.debug('got to point 1')
-                # logger.debug(type(key))
-                _, short_code = key.split(sep=':')
-                stats_key = f"stats:{short_code}"
-                try:
-                    # Получаем данные из Redis
-                    stats = json.loads(await r.get(stats_key))
-                    stats['last_used'] = datetime.fromisoformat(stats['last_used'])
-
-                    # Записываем данные в базу данных
-                    await write_stats_to_db(short_code, stats)
-
-                    logger.debug(f"Записаны статистики для {short_code}: {stats}")
-                except Exception as e:
-                    logger.warning(f"Ошибка при обработке ключа {key}: {e}")
\ No newline at end of file
+from redis_caching.client import r
+from redis_caching.db_sync import write_stats_to_db, write_stats_batch_to_db
+from redis_caching.clicks import (HIT_MISS, HIT_OK, record_hit, cache_link, get_cached_stats, get_cached_stats_many,
+                                  drop_cached_link, drop_cached_links, mark_dirty, buffer_click, flush_buffered_clicks,
+                                  run_click_buffer_flusher, get_cache_status, warm_cached_links,
+                                  stats_bucket_key, pop_cached_stats, pop_cached_stats_many)
+from redis_caching.local_cache import (LocalCache, local_links, local_users, publish_invalidation, publish_user_invalidation,
+                                       listen_invalidations)
+from redis_caching.flusher import (flush_stats, recover_stats, run_stats_flusher, run_stats_sync, run_stats_expiry,
+                                   get_flusher_status)
+from redis_caching.leader import LeaderLease, lease, run_as_leader
+from redis_caching.single_flight import load_once, single_flight_stats
+from redis_caching.bloom import (might_exist, add_code, add_codes, remember_missing, rebuild_bloom,
+                                 run_bloom_maintenance, get_bloom_status)
+from redis_caching.user_stats import (adjust_user_stats, get_user_summary, flush_user_stats, links_expired_until,
+                                     is_counted_link, claim_expired_links, release_expired_links)
+from redis_caching.analytics import (GRANULARITIES, record_click_event, flush_click_events, run_click_event_flusher,
+                                    rollup_click_events, get_analytics_status)
+from redis_caching.hot_links import (count_hot_click, flush_hot_clicks, run_hot_clicks_flusher, get_top_links,
+                                    get_hot_links_status)
+from redis_caching.warmup import warm_up_cache, get_warmup_status
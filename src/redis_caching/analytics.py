@@ -0,0 +1,148 @@
+import asyncio
+import os
+import socket
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+from hashlib import blake2b
+from logging import getLogger
+from typing import Any, Deque, Dict, List, Tuple
+
+from redis.exceptions import ResponseError
+
+from config import (LOCAL_CLICKS_FLUSH_INTERVAL, CLICK_EVENTS_BUFFER_MAX, CLICK_STREAM_MAXLEN, CLICK_ROLLUP_BATCH_SIZE,
+                    CLICK_ROLLUP_CLAIM_IDLE)
+from redis_caching.client import r
+from redis_caching.db_sync import write_click_rollups_to_db
+
+logger = getLogger('redis_caching')
+
+# Каждый переход по ссылке - событие в Redis Stream clicks:events с полями c (код), t (unix-время в мс)
+# и необязательными r/u (хэши Referer и User-Agent). Редирект события только копит в памяти воркера,
+# в стрим они уходят фоном одним пайплайном. Стрим читает группа потребителей rollup (celery-задача
+# rollup_click_events), которая сворачивает события в почасовые и посуточные счетчики в таблице click_rollups.
+
+CLICK_STREAM_KEY = "clicks:events"
+ROLLUP_GROUP = "rollup"
+GRANULARITIES = {"hour": 3600, "day": 86400}
+
+_pending_events: Deque[Dict[str, Any]] = deque(maxlen=CLICK_EVENTS_BUFFER_MAX)
+
+analytics_stats = {"buffered": 0, "dropped": 0, "sent": 0}
+
+
+def _short_hash(value: str) -> str:
+    return blake2b(value.encode(), digest_size=8).hexdigest()
+
+
+def record_click_event(short_code: str, referrer: str | None = None, user_agent: str | None = None):
+    """Запоминает событие перехода. Не обращается к Redis, событие уйдет в стрим фоном.
+
+    Если буфер переполнен (Redis недоступен), самые старые события отбрасываются.
+    """
+    event = {"c": short_code, "t": int(time.time() * 1000)}
+    if referrer:
+        event["r"] = _short_hash(referrer)
+    if user_agent:
+        event["u"] = _short_hash(user_agent)
+    if len(_pending_events) == _pending_events.maxlen:
+        analytics_stats["dropped"] += 1
+    _pending_events.append(event)
+    analytics_stats["buffered"] += 1
+
+
+async def flush_click_events() -> int:
+    """Отправляет накопленные события в стрим одним пайплайном. Возвращает количество событий."""
+    if not _pending_events:
+        return 0
+    events = list(_pending_events)
+    _pending_events.clear()
+    try:
+        async with r.pipeline(transaction=False) as pipe:
+            for event in events:
+                pipe.xadd(CLICK_STREAM_KEY, event, maxlen=CLICK_STREAM_MAXLEN, approximate=True)
+            await pipe.execute()
+    except Exception:
+        # возвращаем события в начало буфера, чтобы отправить их в следующий раз
+        _pending_events.extendleft(reversed(events))
+        raise
+    analytics_stats["sent"] += len(events)
+    return len(events)
+
+
+async def run_click_event_flusher():
+    """Периодически отправляет события переходов в стрим. Запускается в каждом воркере."""
+    while True:
+        await asyncio.sleep(LOCAL_CLICKS_FLUSH_INTERVAL)
+        try:
+            await flush_click_events()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Ошибка при отправке событий переходов: {e}")
+
+
+def get_analytics_status() -> Dict[str, Any]:
+    return {**analytics_stats, "pending": len(_pending_events)}
+
+
+async def _ensure_group():
+    try:
+        # с начала стрима: события, записанные до создания группы, тоже попадут в счетчики
+        await r.xgroup_create(CLICK_STREAM_KEY, ROLLUP_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def _rollup(entries: List[Tuple[str, Dict[str, str]]]) -> List[Dict[str, Any]]:
+    counts: Dict[Tuple[str, str, int], int] = defaultdict(int)
+    for _, event in entries:
+        seconds = int(event["t"]) // 1000
+        for granularity, size in GRANULARITIES.items():
+            counts[(event["c"], granularity, seconds - seconds % size)] += 1
+    return [{"short_url": short_code, "granularity": granularity,
+             "bucket_start": datetime.fromtimestamp(bucket, timezone.utc), "clicks": clicks}
+            for (short_code, granularity, bucket), clicks in counts.items()]
+
+
+async def _process(entries: List[Tuple[str, Dict[str, str]]]) -> int:
+    if not entries:
+        return 0
+    await write_click_rollups_to_db(_rollup(entries))
+    await r.xack(CLICK_STREAM_KEY, ROLLUP_GROUP, *[entry_id for entry_id, _ in entries])
+    return len(entries)
+
+
+async def rollup_click_events(consumer: str | None = None, batch_size: int = CLICK_ROLLUP_BATCH_SIZE,
+                              max_batches: int = 100) -> int:
+    """Сворачивает события из стрима в click_rollups. Возвращает количество обработанных событий.
+
+    Сначала забирает события, которые другой потребитель прочитал, но не подтвердил дольше CLICK_ROLLUP_CLAIM_IDLE
+    секунд (упал), потом читает новые, не больше max_batches пачек за вызов. Доставка не реже одного раза:
+    если процесс упадет между записью в БД и XACK, пачка будет посчитана повторно.
+    """
+    consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+    await _ensure_group()
+
+    processed = 0
+    start_id = "0-0"
+    while True:
+        result = await r.xautoclaim(CLICK_STREAM_KEY, ROLLUP_GROUP, consumer, int(CLICK_ROLLUP_CLAIM_IDLE * 1000),
+                                    start_id, count=batch_size)
+        start_id, claimed = result[0], result[1]
+        # Redis 7 отдает отдельным списком id событий, которые успели вытесниться из стрима по MAXLEN
+        deleted = result[2] if len(result) > 2 else []
+        if deleted:
+            await r.xack(CLICK_STREAM_KEY, ROLLUP_GROUP, *deleted)
+        processed += await _process([entry for entry in claimed if entry[1]])
+        if start_id == "0-0":
+            break
+
+    for _ in range(max_batches):
+        response = await r.xreadgroup(ROLLUP_GROUP, consumer, {CLICK_STREAM_KEY: ">"}, count=batch_size)
+        entries = response[0][1] if response else []
+        processed += await _process(entries)
+        if len(entries) < batch_size:
+            break
+    return processed
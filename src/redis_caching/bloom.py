@@ -0,0 +1,146 @@
+import asyncio
+import math
+import time
+from hashlib import blake2b
+from logging import getLogger
+from typing import Dict, Any, Iterable, List
+
+from config import BLOOM_CAPACITY, BLOOM_ERROR_RATE, BLOOM_REBUILD_INTERVAL, NEGATIVE_CACHE_TTL
+from redis_caching.client import r
+from redis_caching.db_sync import stream_short_codes
+
+logger = getLogger('redis_caching')
+
+# Фильтр Блума существующих кодов хранится битовой строкой bloom:links. Пока он строится заново,
+# новые коды пишутся и в bloom:links:building, который по готовности атомарно его заменяет.
+# bloom:ready содержит параметры (m:k) готового фильтра: если параметры в конфиге поменялись,
+# фильтр считается неготовым и не используется до перестройки.
+# Удаления фильтр не поддерживает, поэтому удаленные и ненайденные коды на NEGATIVE_CACHE_TTL
+# секунд запоминаются в neg:{code}.
+
+BLOOM_KEY = "bloom:links"
+BLOOM_BUILDING_KEY = "bloom:links:building"
+BLOOM_READY_KEY = "bloom:ready"
+
+BLOOM_BITS = max(8, int(-BLOOM_CAPACITY * math.log(BLOOM_ERROR_RATE) / math.log(2) ** 2))
+BLOOM_HASHES = max(1, round(BLOOM_BITS / BLOOM_CAPACITY * math.log(2)))
+BLOOM_VERSION = f"{BLOOM_BITS}:{BLOOM_HASHES}"
+
+# KEYS: bloom:links, bloom:ready, neg:{code}
+# ARGV: версия фильтра, смещения битов
+_might_exist = r.register_script("""
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    return 0
+end
+if redis.call('GET', KEYS[2]) ~= ARGV[1] then
+    return 1
+end
+for i = 2, #ARGV do
+    if redis.call('GETBIT', KEYS[1], ARGV[i]) == 0 then
+        return 0
+    end
+end
+return 1
+""")
+
+# KEYS: bloom:links, bloom:links:building, neg:{code}
+# ARGV: смещения битов
+_add_code = r.register_script("""
+local building = redis.call('EXISTS', KEYS[2]) == 1
+for i = 1, #ARGV do
+    redis.call('SETBIT', KEYS[1], ARGV[i], 1)
+    if building then
+        redis.call('SETBIT', KEYS[2], ARGV[i], 1)
+    end
+end
+redis.call('DEL', KEYS[3])
+""")
+
+bloom_stats = {"rejected": 0, "passed": 0}
+
+
+def _offsets(short_code: str) -> List[int]:
+    digest = blake2b(short_code.encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:], "little") | 1
+    return [(h1 + i * h2) % BLOOM_BITS for i in range(BLOOM_HASHES)]
+
+
+async def might_exist(short_code: str) -> bool:
+    """False, если кода точно нет: он не прошел фильтр Блума или недавно не нашелся в БД."""
+    result = await _might_exist(keys=[BLOOM_KEY, BLOOM_READY_KEY, f"neg:{short_code}"],
+                                args=[BLOOM_VERSION, *_offsets(short_code)])
+    bloom_stats["passed" if result else "rejected"] += 1
+    return bool(result)
+
+
+async def add_code(short_code: str):
+    """Добавляет код в фильтр и снимает с него отметку о несуществовании.
+
+    Вызывается до вставки в БД: лишний код в фильтре безопасен, а недостающий дал бы 404 на живую ссылку.
+    """
+    await _add_code(keys=[BLOOM_KEY, BLOOM_BUILDING_KEY, f"neg:{short_code}"], args=_offsets(short_code))
+
+
+async def add_codes(short_codes: Iterable[str]):
+    """add_code для многих кодов одним пайплайном."""
+    async with r.pipeline(transaction=False) as pipe:
+        for short_code in short_codes:
+            await _add_code(keys=[BLOOM_KEY, BLOOM_BUILDING_KEY, f"neg:{short_code}"], args=_offsets(short_code),
+                            client=pipe)
+        await pipe.execute()
+
+
+async def remember_missing(short_code: str):
+    """Запоминает, что кода нет в БД."""
+    await r.set(f"neg:{short_code}", 1, ex=NEGATIVE_CACHE_TTL)
+
+
+async def rebuild_bloom(batch_size: int = 10000) -> int:
+    """Строит фильтр заново по всем кодам из БД. Возвращает количество кодов."""
+    started = time.perf_counter()
+    await r.delete(BLOOM_BUILDING_KEY)
+    # пустая строка нужного размера, чтобы новые коды начали попадать в строящийся фильтр сразу
+    await r.setbit(BLOOM_BUILDING_KEY, BLOOM_BITS - 1, 0)
+
+    count = 0
+    async for codes in stream_short_codes(batch_size):
+        async with r.pipeline(transaction=False) as pipe:
+            for short_code in codes:
+                for offset in _offsets(short_code):
+                    pipe.setbit(BLOOM_BUILDING_KEY, offset, 1)
+            await pipe.execute()
+        count += len(codes)
+
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.rename(BLOOM_BUILDING_KEY, BLOOM_KEY)
+        pipe.set(BLOOM_READY_KEY, BLOOM_VERSION)
+        await pipe.execute()
+    logger.info(f"Фильтр Блума построен: {count} кодов, {BLOOM_BITS} бит, {BLOOM_HASHES} хэшей, "
+                f"{time.perf_counter() - started:.1f} с")
+    return count
+
+
+async def run_bloom_maintenance():
+    """Задача лидера: строит фильтр, если он не готов, и периодически перестраивает его, вычищая удаленные коды."""
+    while True:
+        try:
+            if await r.get(BLOOM_READY_KEY) != BLOOM_VERSION:
+                await rebuild_bloom()
+            await asyncio.sleep(BLOOM_REBUILD_INTERVAL)
+            await rebuild_bloom()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Ошибка при построении фильтра Блума: {e}")
+            await asyncio.sleep(60)
+
+
+def get_bloom_status() -> Dict[str, Any]:
+    return {
+        "capacity": BLOOM_CAPACITY,
+        "error_rate": BLOOM_ERROR_RATE,
+        "bits": BLOOM_BITS,
+        "hashes": BLOOM_HASHES,
+        **bloom_stats,
+    }
@@ -0,0 +1,645 @@
+import asyncio
+import json
+import math
+import time
+from datetime import datetime, timezone
+from logging import getLogger
+from typing import AsyncGenerator, Dict, Any, Iterable, List, Tuple
+from uuid import UUID
+
+from config import LOCAL_CLICKS_FLUSH_INTERVAL, CACHE_TTL_MIN, CACHE_TTL_MAX, STATS_BUCKETS, STATS_TTL
+from redis_caching.client import r
+from redis_caching.local_cache import local_links, local_users, publish_invalidation, INVALIDATION_CHANNEL
+from redis_caching.user_stats import add_user_clicks
+
+logger = getLogger('redis_caching')
+
+# Ссылка в кэше хранится в хэше short_url:{code} (original_url, expires_at в unix-времени или "", hits) со своим TTL.
+# Статистики (clicks, last_used, владелец) - компактной записью в поле {code} одного из STATS_BUCKETS хэшей
+# stats_bucket:{n}: отдельный ключ на каждую ссылку стоил бы в Redis больше самих данных. Запись, которая не менялась
+# STATS_TTL секунд и уже выгружена в БД, удаляется (см. expire_stale_stats), ее место снова займет загрузка из БД.
+# Клик засчитывается одним скриптом на стороне Redis: один RTT и никаких потерянных кликов при гонках.
+# Коды с изменившимися статистиками попадают в sorted set sync:dirty (score - время первого изменения),
+# откуда их пачками забирает фоновый флашер (см. redis_caching.flusher). Забранные коды до подтверждения
+# записи в БД лежат в sync:inflight (score - время захвата), поэтому падение процесса посреди выгрузки
+# ничего не теряет: зависшие коды возвращаются в очередь по таймауту.
+# Перед Redis стоит локальный кэш воркера (см. redis_caching.local_cache): клики по попавшим в него ссылкам
+# копятся в памяти и раз в LOCAL_CLICKS_FLUSH_INTERVAL секунд отправляются в Redis одним пайплайном.
+
+HIT_MISS = 0
+HIT_OK = 1
+
+STATS_BUCKET_PREFIX = "stats_bucket:"
+# код -> корзина: h = (h * 31 + байт) по модулю простого числа меньше 2^24
+_BUCKET_HASH_MODULUS = 16777213
+
+DIRTY_KEY = "sync:dirty"
+INFLIGHT_KEY = "sync:inflight"
+
+# Общая часть скриптов попадания. Считает попадания по записи short_url:{code} и при каждом удвоении
+# их числа удваивает TTL записи, от CACHE_TTL_MIN до CACHE_TTL_MAX. Срок жизни записи выставляется
+# через PEXPIREAT и никогда не выходит за expires_at ссылки, так что Redis удаляет запись ровно тогда,
+# когда ссылка истекает, и проверять срок на каждом попадании не нужно.
+_COUNT_HITS = """
+local function level(n)
+    local l = 0
+    while n >= 2 do
+        n = math.floor(n / 2)
+        l = l + 1
+    end
+    return l
+end
+
+local function count_hits(link_key, n, now_ms, ttl_min_ms, ttl_max_ms)
+    local hits = redis.call('HINCRBY', link_key, 'hits', n)
+    local lvl = level(hits)
+    if lvl > level(hits - n) then
+        local deadline = tonumber(now_ms) + math.min(tonumber(ttl_max_ms), tonumber(ttl_min_ms) * 2 ^ lvl)
+        local expires_at = redis.call('HGET', link_key, 'expires_at')
+        if expires_at and expires_at ~= '' then
+            deadline = math.min(deadline, tonumber(expires_at) * 1000)
+        end
+        redis.call('PEXPIREAT', link_key, math.floor(deadline))
+    end
+end
+"""
+
+# Общая часть скриптов, работающих с записями статистик. Запись - поле {code} хэша stats_bucket:{n}, значение -
+# двоичная строка фиксированной ширины: клики (6 байт), last_used в мс (6 байт, 0 - переходов не было),
+# время последней записи в секундах (4 байта) и uuid владельца (16 байт, если владелец есть), числа big-endian.
+# Хэш на STATS_BUCKETS корзин хранится компактной кодировкой listpack, пока в нем не больше
+# hash-max-listpack-entries полей. Каждая запись продлевает корзине TTL до STATS_TTL секунд.
+_STATS_RECORDS = """
+local STATS_TTL = """ + str(int(STATS_TTL)) + """
+
+local function pack_uint(n, size)
+    local bytes = {}
+    for i = size, 1, -1 do
+        bytes[i] = string.char(n % 256)
+        n = math.floor(n / 256)
+    end
+    return table.concat(bytes)
+end
+
+local function unpack_uint(s, from, size)
+    local n = 0
+    for i = from, from + size - 1 do
+        n = n * 256 + string.byte(s, i)
+    end
+    return n
+end
+
+-- клики, last_used в мс, uuid владельца в байтах (или ''), время записи; nil, если записи нет
+local function read_stats(key, code)
+    local record = redis.call('HGET', key, code)
+    if not record then
+        return nil
+    end
+    return unpack_uint(record, 1, 6), unpack_uint(record, 7, 6), string.sub(record, 17), unpack_uint(record, 13, 4)
+end
+
+local function write_stats(key, code, clicks, last_used_ms, owner, now)
+    redis.call('HSET', key, code, pack_uint(clicks, 6) .. pack_uint(tonumber(last_used_ms), 6)
+                                  .. pack_uint(math.floor(tonumber(now)), 4) .. owner)
+    redis.call('EXPIRE', key, STATS_TTL)
+end
+"""
+
+# Общая часть скриптов клика. uuid владельца строкой из байтов записи статистик ('' - владельца нет).
+# Ключ агрегатов владельца до чтения записи неизвестен, поэтому скрипты клика его не трогают, а возвращают владельца:
+# клики прибавляются к его агрегатам из Python (см. _buffer_user_clicks).
+_OWNER_UUID = """
+local function owner_uuid(owner)
+    if owner == '' then
+        return ''
+    end
+    local hex = string.gsub(owner, '.', function(c) return string.format('%02x', string.byte(c)) end)
+    return string.sub(hex, 1, 8) .. '-' .. string.sub(hex, 9, 12) .. '-' .. string.sub(hex, 13, 16) .. '-'
+           .. string.sub(hex, 17, 20) .. '-' .. string.sub(hex, 21, 32)
+end
+"""
+
+# KEYS: short_url:{code}, stats_bucket:{n}, sync:dirty
+# ARGV: текущее unix-время, код, текущее время в мс, CACHE_TTL_MIN и CACHE_TTL_MAX в мс
+# Возвращает {0} при промахе, иначе {1, original_url, expires_at, uuid владельца или ''}
+_record_hit = r.register_script(_STATS_RECORDS + _COUNT_HITS + _OWNER_UUID + """
+-- JSON-строка прежнего формата - промах, cache_link перезапишет ее хэшем
+if redis.call('TYPE', KEYS[1]).ok ~= 'hash' then
+    return {0}
+end
+local link = redis.call('HMGET', KEYS[1], 'original_url', 'expires_at')
+if not link[1] then
+    return {0}
+end
+local clicks, _, owner = read_stats(KEYS[2], ARGV[2])
+if not clicks then
+    return {0}
+end
+write_stats(KEYS[2], ARGV[2], clicks + 1, ARGV[3], owner, ARGV[1])
+redis.call('ZADD', KEYS[3], 'NX', ARGV[1], ARGV[2])
+count_hits(KEYS[1], 1, ARGV[3], ARGV[4], ARGV[5])
+return {1, link[1], link[2], owner_uuid(owner)}
+""")
+
+# KEYS: short_url:{code}, stats_bucket:{n}, sync:dirty
+# ARGV: original_url, expires_at, момент истечения записи в мс, клики из БД, текущее unix-время,
+#       код, uuid владельца в байтах или ""
+_cache_link = r.register_script(_STATS_RECORDS + """
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], 'original_url', ARGV[1], 'expires_at', ARGV[2], 'hits', 1)
+redis.call('PEXPIREAT', KEYS[1], ARGV[3])
+local clicks = read_stats(KEYS[2], ARGV[6]) or tonumber(ARGV[4])
+write_stats(KEYS[2], ARGV[6], clicks + 1, math.floor(tonumber(ARGV[5]) * 1000), ARGV[7], ARGV[5])
+redis.call('ZADD', KEYS[3], 'NX', ARGV[5], ARGV[6])
+""")
+
+# Прогрев: кладет ссылку из БД в кэш, не засчитывая клик и не трогая то, что в кэше уже есть (оно новее).
+# Запись прежнего формата (JSON-строка) перезаписывается.
+# Запись получает число попаданий, при котором TTL уже дорос до CACHE_TTL_MAX: прогреваются самые популярные ссылки.
+# KEYS: short_url:{code}, stats_bucket:{n}
+# ARGV: original_url, expires_at, момент истечения записи в мс, попадания, клики из БД, last_used в мс или 0,
+#       uuid владельца в байтах или "", текущее unix-время, код
+_warm_link = r.register_script(_STATS_RECORDS + """
+if redis.call('TYPE', KEYS[1]).ok ~= 'hash' then
+    redis.call('DEL', KEYS[1])
+    redis.call('HSET', KEYS[1], 'original_url', ARGV[1], 'expires_at', ARGV[2], 'hits', ARGV[4])
+    redis.call('PEXPIREAT', KEYS[1], ARGV[3])
+end
+if redis.call('HEXISTS', KEYS[2], ARGV[9]) == 0 then
+    write_stats(KEYS[2], ARGV[9], tonumber(ARGV[5]), ARGV[6], ARGV[7], ARGV[8])
+end
+""")
+# попадания, с которых count_hits держит TTL записи на CACHE_TTL_MAX
+WARM_HITS = 2 ** max(0, math.ceil(math.log2(CACHE_TTL_MAX / CACHE_TTL_MIN)))
+
+# Добавляет клики, накопленные в локальном буфере воркера.
+# Если статистик в кэше уже нет (ссылку удалили или обновили), клики отбрасываются.
+# KEYS: short_url:{code}, stats_bucket:{n}, sync:dirty
+# ARGV: количество кликов, unix-время первого клика, код, текущее время в мс, CACHE_TTL_MIN и CACHE_TTL_MAX в мс,
+#       время последнего клика в мс
+# Возвращает 0, если статистик нет, иначе uuid владельца или ''
+_add_clicks = r.register_script(_STATS_RECORDS + _COUNT_HITS + _OWNER_UUID + """
+local clicks, _, owner = read_stats(KEYS[2], ARGV[3])
+if not clicks then
+    return 0
+end
+write_stats(KEYS[2], ARGV[3], clicks + tonumber(ARGV[1]), ARGV[7], owner, tonumber(ARGV[4]) / 1000)
+redis.call('ZADD', KEYS[3], 'NX', ARGV[2], ARGV[3])
+if redis.call('TYPE', KEYS[1]).ok == 'hash' then
+    count_hits(KEYS[1], tonumber(ARGV[1]), ARGV[4], ARGV[5], ARGV[6])
+end
+return owner_uuid(owner)
+""")
+
+# Статистики кодов из записей. KEYS: stats_bucket:{n} для каждого кода; ARGV: коды
+# Возвращает плоский список: clicks, last_used в мс (false, false, если записи нет)
+_read_stats = r.register_script(_STATS_RECORDS + """
+local result = {}
+for i = 1, #ARGV do
+    local clicks, last_used = read_stats(KEYS[i], ARGV[i])
+    table.insert(result, clicks or false)
+    table.insert(result, last_used or false)
+end
+return result
+""")
+
+# Забирает статистики кодов и удаляет их вместе с записями ссылок: клик между отдельными чтением и удалением
+# пропал бы из агрегатов владельца.
+# KEYS: short_url:{code} и stats_bucket:{n} для каждого кода; ARGV: коды
+# Возвращает плоский список: clicks, last_used в мс (false, false, если записи нет)
+_pop_stats = r.register_script(_STATS_RECORDS + """
+local result = {}
+for i = 1, #ARGV do
+    local clicks, last_used = read_stats(KEYS[2 * i], ARGV[i])
+    redis.call('DEL', KEYS[2 * i - 1])
+    redis.call('HDEL', KEYS[2 * i], ARGV[i])
+    table.insert(result, clicks or false)
+    table.insert(result, last_used or false)
+end
+return result
+""")
+# столько кодов забирает один вызов _pop_stats, чтобы не держать Redis на больших удалениях
+POP_STATS_BATCH_SIZE = 500
+
+# Переносит из sync:dirty в sync:inflight до ARGV[1] самых старых кодов. Статистики забранных кодов читаются
+# следующим запросом: корзины известны только после того, как известны коды.
+# KEYS: sync:dirty, sync:inflight
+# ARGV: количество, текущее unix-время
+# Возвращает плоский список: код, score
+_claim_dirty = r.register_script("""
+local popped = redis.call('ZPOPMIN', KEYS[1], ARGV[1])
+for i = 1, #popped, 2 do
+    redis.call('ZADD', KEYS[2], ARGV[2], popped[i])
+end
+return popped
+""")
+
+# Возвращает в sync:dirty коды, захваченные раньше ARGV[1] и так и не подтвержденные.
+# KEYS: sync:dirty, sync:inflight
+_reclaim_inflight = r.register_script("""
+local stale = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1], 'WITHSCORES')
+for i = 1, #stale, 2 do
+    redis.call('ZADD', KEYS[1], 'LT', stale[i + 1], stale[i])
+    redis.call('ZREM', KEYS[2], stale[i])
+end
+return #stale / 2
+""")
+
+# Удаляет из корзины записи, которые не менялись с ARGV[1] (unix-время) и не ждут выгрузки в БД.
+# KEYS: stats_bucket:{n}, sync:dirty, sync:inflight
+_expire_stats = r.register_script(_STATS_RECORDS + """
+local fields = redis.call('HGETALL', KEYS[1])
+local cutoff = tonumber(ARGV[1])
+local expired = 0
+for i = 1, #fields, 2 do
+    if unpack_uint(fields[i + 1], 13, 4) < cutoff and not redis.call('ZSCORE', KEYS[2], fields[i])
+            and not redis.call('ZSCORE', KEYS[3], fields[i]) then
+        redis.call('HDEL', KEYS[1], fields[i])
+        expired = expired + 1
+    end
+end
+return expired
+""")
+
+
+redis_stats = {"hits": 0, "misses": 0}
+
+
+def stats_bucket_key(short_code: str) -> str:
+    """Ключ хэша, в котором лежит запись статистик кода."""
+    h = 0
+    for byte in short_code.encode():
+        h = (h * 31 + byte) % _BUCKET_HASH_MODULUS
+    return f"{STATS_BUCKET_PREFIX}{h % STATS_BUCKETS}"
+
+
+def _owner_bytes(owner) -> bytes:
+    return UUID(str(owner)).bytes if owner else b""
+
+
+def _ttl_args(now: datetime) -> List[int]:
+    return [int(now.timestamp() * 1000), int(CACHE_TTL_MIN * 1000), int(CACHE_TTL_MAX * 1000)]
+
+# код -> [количество кликов, unix-время первого клика, unix-время последнего клика]
+_pending_clicks: Dict[str, list] = {}
+# uuid владельца -> [количество кликов, unix-время первого клика, время последнего клика в ISO 8601].
+# Отправляются в агрегаты владельцев вместе с локальным буфером кликов
+_pending_user_clicks: Dict[str, list] = {}
+
+
+def _buffer_user_clicks(owner: str, clicks: int, first_click: float, last_used: str):
+    pending = _pending_user_clicks.get(owner)
+    if pending is None:
+        _pending_user_clicks[owner] = [clicks, first_click, last_used]
+    else:
+        pending[0] += clicks
+        pending[1] = min(pending[1], first_click)
+        pending[2] = max(pending[2], last_used)
+
+
+async def record_hit(short_code: str) -> Tuple[int, str | None]:
+    """Засчитывает клик по закэшированной ссылке. Возвращает (статус, original_url).
+
+    Попадания кладутся в локальный кэш воркера.
+    """
+    now = datetime.now(timezone.utc)
+    result = await _record_hit(keys=[f"short_url:{short_code}", stats_bucket_key(short_code), DIRTY_KEY],
+                               args=[now.timestamp(), short_code, *_ttl_args(now)])
+    if result[0] == HIT_OK:
+        redis_stats["hits"] += 1
+        if result[3]:
+            _buffer_user_clicks(result[3], 1, now.timestamp(), now.isoformat())
+        local_links.set(short_code, result[1], float(result[2]) if result[2] else None)
+        return HIT_OK, result[1]
+    redis_stats["misses"] += 1
+    return HIT_MISS, None
+
+
+def buffer_click(short_code: str):
+    """Засчитывает клик по ссылке из локального кэша без обращения к Redis."""
+    now = time.time()
+    pending = _pending_clicks.get(short_code)
+    if pending is None:
+        _pending_clicks[short_code] = [1, now, now]
+    else:
+        pending[0] += 1
+        pending[2] = now
+
+
+async def flush_buffered_clicks() -> int:
+    """Отправляет накопленные клики в Redis одним пайплайном, затем клики владельцев ссылок в их агрегаты.
+    Возвращает количество кодов."""
+    global _pending_clicks
+    flushed = 0
+    if _pending_clicks:
+        pending, _pending_clicks = _pending_clicks, {}
+        try:
+            ttl_args = _ttl_args(datetime.now(timezone.utc))
+            async with r.pipeline(transaction=False) as pipe:
+                for short_code, (clicks, first_click, last_used) in pending.items():
+                    await _add_clicks(keys=[f"short_url:{short_code}", stats_bucket_key(short_code), DIRTY_KEY],
+                                      args=[clicks, first_click, short_code, *ttl_args, int(last_used * 1000)],
+                                      client=pipe)
+                owners = await pipe.execute()
+        except Exception:
+            # возвращаем клики в буфер, чтобы отправить их в следующий раз
+            for short_code, (clicks, first_click, last_used) in pending.items():
+                current = _pending_clicks.setdefault(short_code, [0, first_click, last_used])
+                current[0] += clicks
+                current[1] = min(current[1], first_click)
+                current[2] = max(current[2], last_used)
+            raise
+        for owner, (clicks, first_click, last_used) in zip(owners, pending.values()):
+            if owner:
+                last_used_iso = datetime.fromtimestamp(last_used, timezone.utc).isoformat()
+                _buffer_user_clicks(owner, clicks, first_click, last_used_iso)
+        flushed = len(pending)
+    await _flush_user_clicks()
+    return flushed
+
+
+async def _flush_user_clicks():
+    global _pending_user_clicks
+    if not _pending_user_clicks:
+        return
+    pending, _pending_user_clicks = _pending_user_clicks, {}
+    try:
+        await add_user_clicks(pending)
+    except Exception:
+        for owner, (clicks, first_click, last_used) in pending.items():
+            _buffer_user_clicks(owner, clicks, first_click, last_used)
+        raise
+
+
+async def run_click_buffer_flusher():
+    """Периодически отправляет клики из локального буфера в Redis. Запускается в каждом воркере."""
+    while True:
+        await asyncio.sleep(LOCAL_CLICKS_FLUSH_INTERVAL)
+        try:
+            await flush_buffered_clicks()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Ошибка при отправке кликов из локального буфера: {e}")
+
+
+def get_cache_status() -> Dict[str, Any]:
+    """Попадания в локальный кэш воркера (L1) и в Redis (L2), в кэш пользователей по JWT."""
+    total = redis_stats["hits"] + redis_stats["misses"]
+    return {
+        "l1": local_links.stats(),
+        "users": local_users.stats(),
+        "l2": {**redis_stats, "hit_ratio": round(redis_stats["hits"] / total, 4) if total else 0.0},
+        "pending_clicks": len(_pending_clicks),
+        "pending_user_clicks": len(_pending_user_clicks),
+    }
+
+
+async def cache_link(short_code: str, original_url: str, expires_at: datetime | None, clicks: int, owner=None):
+    """Кладет ссылку в кэш (Redis и локальный) на CACHE_TTL_MIN секунд, но не дольше срока жизни ссылки,
+    и засчитывает клик.
+
+    Клики из БД берутся только если статистик в кэше еще нет, иначе накопленные в Redis значения новее.
+    owner - uuid владельца ссылки, клики по ней прибавляются к его агрегатам.
+    """
+    now = datetime.now(timezone.utc)
+    deadline = now.timestamp() + CACHE_TTL_MIN
+    if expires_at is not None:
+        deadline = min(deadline, expires_at.timestamp())
+    await _cache_link(keys=[f"short_url:{short_code}", stats_bucket_key(short_code), DIRTY_KEY],
+                      args=[original_url, expires_at.timestamp() if expires_at else "", int(deadline * 1000),
+                            clicks, now.timestamp(), short_code, _owner_bytes(owner)])
+    if owner:
+        _buffer_user_clicks(str(owner), 1, now.timestamp(), now.isoformat())
+    local_links.set(short_code, original_url, expires_at.timestamp() if expires_at else None)
+
+
+async def warm_cached_links(links: Iterable[Any]) -> int:
+    """Кладет в Redis ссылки из БД одним пайплайном, без кликов. Возвращает количество ссылок.
+
+    links - строки с short_url, original_url, expires_at, clicks, last_used и created_by_uuid.
+    """
+    now = datetime.now(timezone.utc).timestamp()
+    count = 0
+    async with r.pipeline(transaction=False) as pipe:
+        for link in links:
+            deadline = now + CACHE_TTL_MAX
+            if link.expires_at is not None:
+                deadline = min(deadline, link.expires_at.timestamp())
+            await _warm_link(keys=[f"short_url:{link.short_url}", stats_bucket_key(link.short_url)],
+                             args=[link.original_url, link.expires_at.timestamp() if link.expires_at else "",
+                                   int(deadline * 1000), WARM_HITS, link.clicks,
+                                   int(link.last_used.timestamp() * 1000) if link.last_used else 0,
+                                   _owner_bytes(link.created_by_uuid), now, link.short_url],
+                             client=pipe)
+            count += 1
+        await pipe.execute()
+    return count
+
+
+def _last_used(last_used_ms: int) -> datetime | None:
+    return datetime.fromtimestamp(last_used_ms / 1000, timezone.utc) if last_used_ms else None
+
+
+def _parse_stats(clicks: int | None, last_used_ms: int | None) -> Dict[str, Any] | None:
+    if clicks is None:
+        return None
+    return {
+        "clicks": clicks,
+        "last_used": _last_used(last_used_ms)
+    }
+
+
+async def get_cached_stats(short_code: str) -> Dict[str, Any] | None:
+    """Статистики ссылки из кэша или None, если их там нет."""
+    return (await get_cached_stats_many([short_code]))[0]
+
+
+async def get_cached_stats_many(short_codes: List[str]) -> List[Dict[str, Any] | None]:
+    """get_cached_stats для многих кодов за один поход в Redis. Порядок результатов совпадает с short_codes."""
+    if not short_codes:
+        return []
+    result = await _read_stats(keys=[stats_bucket_key(short_code) for short_code in short_codes], args=short_codes)
+    return [_parse_stats(result[i], result[i + 1]) for i in range(0, len(result), 2)]
+
+
+async def drop_cached_link(short_code: str):
+    """Удаляет ссылку и ее статистики из кэша, в том числе из локальных кэшей всех воркеров."""
+    async with r.pipeline(transaction=False) as pipe:
+        pipe.delete(f"short_url:{short_code}")
+        pipe.hdel(stats_bucket_key(short_code), short_code)
+        await pipe.execute()
+    await publish_invalidation(short_code)
+
+
+async def drop_cached_links(short_codes: List[str]):
+    """drop_cached_link для многих кодов одним пайплайном."""
+    if not short_codes:
+        return
+    async with r.pipeline(transaction=False) as pipe:
+        for short_code in short_codes:
+            local_links.invalidate(short_code)
+            pipe.delete(f"short_url:{short_code}")
+            pipe.hdel(stats_bucket_key(short_code), short_code)
+            pipe.publish(INVALIDATION_CHANNEL, short_code)
+        await pipe.execute()
+
+
+async def pop_cached_stats(short_code: str) -> Dict[str, Any] | None:
+    """Статистики ссылки из кэша (None, если их там нет) с удалением ссылки и статистик из кэша, в том числе
+    из локальных кэшей всех воркеров. Чтение и удаление атомарны."""
+    return (await pop_cached_stats_many([short_code]))[0]
+
+
+async def pop_cached_stats_many(short_codes: List[str]) -> List[Dict[str, Any] | None]:
+    """pop_cached_stats для многих кодов одним пайплайном. Порядок результатов совпадает с short_codes."""
+    if not short_codes:
+        return []
+    batches = range(0, len(short_codes), POP_STATS_BATCH_SIZE)
+    async with r.pipeline(transaction=False) as pipe:
+        for start in batches:
+            batch = short_codes[start:start + POP_STATS_BATCH_SIZE]
+            await _pop_stats(keys=[key for short_code in batch
+                                   for key in (f"short_url:{short_code}", stats_bucket_key(short_code))],
+                             args=batch, client=pipe)
+        for short_code in short_codes:
+            local_links.invalidate(short_code)
+            pipe.publish(INVALIDATION_CHANNEL, short_code)
+        replies = await pipe.execute()
+    result = [value for reply in replies[:len(batches)] for value in reply]
+    return [_parse_stats(result[i], result[i + 1]) for i in range(0, len(result), 2)]
+
+
+async def mark_dirty(*short_codes: str):
+    """Ставит коды в очередь на выгрузку статистик в БД."""
+    if short_codes:
+        now = datetime.now(timezone.utc).timestamp()
+        await r.zadd(DIRTY_KEY, {code: now for code in short_codes}, nx=True)
+
+
+async def drain_dirty(count: int) -> Tuple[List[Dict[str, Any]], Dict[str, float]]:
+    """Забирает из очереди до count кодов. До ack_dirty или requeue_dirty они числятся в sync:inflight.
+
+    Возвращает статистики для записи в БД и исходные score всех забранных кодов (для возврата в очередь).
+    """
+    now = datetime.now(timezone.utc).timestamp()
+    popped = await _claim_dirty(keys=[DIRTY_KEY, INFLIGHT_KEY], args=[count, now])
+    scores = {popped[i]: float(popped[i + 1]) for i in range(0, len(popped), 2)}
+    rows = []
+    # клики, пришедшие после захвата, снова ставят код в sync:dirty, так что читать статистики позже безопасно
+    for short_code, stats in zip(scores, await get_cached_stats_many(list(scores))):
+        if stats is None:
+            # ссылку удалили или обновили, статистики уже неактуальны
+            continue
+        rows.append({"short_url": short_code, **stats})
+    return rows, scores
+
+
+async def ack_dirty(short_codes: Iterable[str]):
+    """Подтверждает, что статистики кодов записаны в БД."""
+    short_codes = list(short_codes)
+    if short_codes:
+        await r.zrem(INFLIGHT_KEY, *short_codes)
+
+
+async def requeue_dirty(scores: Dict[str, float]):
+    """Возвращает коды в очередь, сохраняя более раннее время первого изменения."""
+    if scores:
+        async with r.pipeline(transaction=True) as pipe:
+            pipe.zadd(DIRTY_KEY, scores, lt=True)
+            pipe.zrem(INFLIGHT_KEY, *scores)
+            await pipe.execute()
+
+
+async def reclaim_inflight(timeout: float) -> int:
+    """Возвращает в очередь коды, захваченные больше timeout секунд назад (например, упавшим процессом)."""
+    cutoff = datetime.now(timezone.utc).timestamp() - timeout
+    return await _reclaim_inflight(keys=[DIRTY_KEY, INFLIGHT_KEY], args=[cutoff])
+
+
+async def sweep_cached_stats(batch_size: int = 1000) -> int:
+    """Ставит в очередь все статистики, которые есть в Redis. Возвращает количество найденных записей."""
+    found = 0
+    async for key in r.scan_iter(match=f"{STATS_BUCKET_PREFIX}*", count=batch_size, _type="hash"):
+        short_codes = await r.hkeys(key)
+        await mark_dirty(*short_codes)
+        found += len(short_codes)
+    return found
+
+
+async def expire_stale_stats(batch_size: int = 1000) -> int:
+    """Удаляет записи статистик, которые не менялись STATS_TTL секунд и не ждут выгрузки в БД.
+    Возвращает количество удаленных записей."""
+    cutoff = time.time() - STATS_TTL
+    expired = 0
+    for start in range(0, STATS_BUCKETS, batch_size):
+        async with r.pipeline(transaction=False) as pipe:
+            for bucket in range(start, min(start + batch_size, STATS_BUCKETS)):
+                await _expire_stats(keys=[f"{STATS_BUCKET_PREFIX}{bucket}", DIRTY_KEY, INFLIGHT_KEY], args=[cutoff],
+                                    client=pipe)
+            expired += sum(await pipe.execute())
+    return expired
+
+
+async def drop_legacy_links(batch_size: int = 1000) -> int:
+    """Удаляет записи ссылок в прежнем формате (JSON-строка short_url:{code}). Возвращает количество ключей."""
+    dropped = 0
+    keys = []
+    async for key in r.scan_iter(match="short_url:*", count=batch_size, _type="string"):
+        keys.append(key)
+        if len(keys) >= batch_size:
+            dropped += await r.delete(*keys)
+            keys = []
+    if keys:
+        dropped += await r.delete(*keys)
+    return dropped
+
+
+async def legacy_stats_batches(batch_size: int = 1000) -> AsyncGenerator[Tuple[List[str], List[Dict[str, Any]]], None]:
+    """Статистики в прежних форматах (ключ stats:{code} на каждую ссылку: хэш или еще более ранняя JSON-строка)
+    пачками: ключи и строки для записи в БД."""
+    for key_type in ("hash", "string"):
+        keys = []
+        async for key in r.scan_iter(match="stats:*", count=batch_size, _type=key_type):
+            keys.append(key)
+            if len(keys) >= batch_size:
+                yield keys, await _legacy_rows(keys, key_type)
+                keys = []
+        if keys:
+            yield keys, await _legacy_rows(keys, key_type)
+
+
+async def _legacy_rows(keys: List[str], key_type: str) -> List[Dict[str, Any]]:
+    async with r.pipeline(transaction=False) as pipe:
+        for key in keys:
+            if key_type == "hash":
+                pipe.hmget(key, "clicks", "last_used")
+            else:
+                pipe.get(key)
+        values = await pipe.execute()
+    rows = []
+    for key, value in zip(keys, values):
+        if key_type == "string":
+            try:
+                stats = json.loads(value) if value else {}
+            except ValueError:
+                logger.warning(f"Не удалось разобрать статистики {key}: {value!r}")
+                continue
+            value = (stats.get("clicks"), stats.get("last_used"))
+        clicks, last_used = value
+        if clicks is None:
+            continue
+        rows.append({"short_url": key.split(sep=':', maxsplit=1)[1], "clicks": int(clicks),
+                     "last_used": datetime.fromisoformat(last_used) if last_used else None})
+    return rows
+
+
+async def get_dirty_stats() -> Dict[str, Any]:
+    """Размер очереди, число неподтвержденных кодов и отставание самого старого кода в секундах."""
+    async with r.pipeline(transaction=False) as pipe:
+        pipe.zcard(DIRTY_KEY)
+        pipe.zcard(INFLIGHT_KEY)
+        pipe.zrange(DIRTY_KEY, 0, 0, withscores=True)
+        size, inflight, oldest = await pipe.execute()
+    lag = datetime.now(timezone.utc).timestamp() - oldest[0][1] if oldest else 0.0
+    return {"dirty": size, "inflight": inflight, "lag_seconds": round(lag, 3)}
@@ -0,0 +1,45 @@
+import time
+
+import redis.asyncio as redis
+from redis.asyncio.client import Pipeline
+from prometheus_client import Histogram
+
+from config import REDIS_HOST, REDIS_PORT, REDIS_PASSWORD
+
+# Время команд Redis по имени команды (скрипты - EVALSHA), пайплайны целиком - PIPELINE
+REDIS_COMMAND_SECONDS = Histogram(
+    "shurl_redis_command_duration_seconds", "Redis command round trip time", ["command"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+_pipeline_seconds = REDIS_COMMAND_SECONDS.labels("PIPELINE")
+
+
+class _TimedPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        started = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            _pipeline_seconds.observe(time.perf_counter() - started)
+
+
+class TimedRedis(redis.Redis):
+    """Клиент Redis, который пишет время каждой команды и пайплайна в REDIS_COMMAND_SECONDS."""
+
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            REDIS_COMMAND_SECONDS.labels(str(args[0]).upper()).observe(time.perf_counter() - started)
+
+    def pipeline(self, transaction: bool = True, shard_hint: str | None = None) -> Pipeline:
+        return _TimedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+r = TimedRedis(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    password=REDIS_PASSWORD,
+    decode_responses=True
+)
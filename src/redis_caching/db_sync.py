@@ -1,8 +1,9 @@
-from database import get_async_session
-from sqlalchemy import update
-from shurl.models import Link
+from database import get_async_session, primary_read_session
+from sqlalchemy import select, update, text, or_, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from shurl.models import Link, LinkCode, UserStats, ClickRollup
 from logging import getLogger
-from typing import Dict, Any
+from typing import AsyncGenerator, Dict, Any, Iterable, List
 
 logger = getLogger('redis_caching')
 
@@ -16,4 +17,115 @@ async def write_stats_to_db(short_code: str, stats: Dict[str, Any]):
             await session.rollback()
             raise e
         finally:
-            await session.close()
\ No newline at end of file
+            await session.close()
+
+# Массивы вместо VALUES со строкой параметров на каждую запись: текст запроса не зависит от размера пачки,
+# поэтому он компилируется и подготавливается один раз на соединение. Ключ секции каждого кода берется из link_codes,
+# и условие на него отсекает остальные секции при выполнении: каждая ссылка ищется по индексу одной секции
+_UPDATE_STATS_BATCH = text(
+    "UPDATE links SET clicks = stats.clicks, last_used = stats.last_used "
+    "FROM unnest(CAST(:short_urls AS varchar[]), CAST(:clicks AS integer[]), CAST(:last_used AS timestamptz[])) "
+    "AS stats(short_url, clicks, last_used) JOIN link_codes codes ON codes.short_url = stats.short_url "
+    "WHERE links.short_url = stats.short_url "
+    "AND COALESCE(links.expires_at, 'infinity'::timestamptz) = COALESCE(codes.expires_at, 'infinity'::timestamptz)"
+)
+
+async def write_stats_batch_to_db(rows: List[Dict[str, Any]]):
+    """Записывает статистики пачкой одним UPDATE ... FROM unnest(...)."""
+    params = {"short_urls": [row['short_url'] for row in rows],
+              "clicks": [row['clicks'] for row in rows],
+              "last_used": [row['last_used'] for row in rows]}
+
+    async for session in get_async_session():
+        try:
+            await session.execute(_UPDATE_STATS_BATCH, params)
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            raise e
+        finally:
+            await session.close()
+
+async def stream_short_codes(batch_size: int) -> AsyncGenerator[List[str], None]:
+    """Отдает все короткие коды из БД пачками, читая их серверным курсором."""
+    async for session in get_async_session():
+        # узкая link_codes читается быстрее секций links
+        query = select(LinkCode.__table__.c.short_url).execution_options(yield_per=batch_size)
+        result = await session.stream(query)
+        async for partition in result.scalars().partitions():
+            yield partition
+
+async def stream_hot_links(limit: int, order: str, batch_size: int) -> AsyncGenerator[List[Any], None]:
+    """Отдает пачками не больше limit неистекших ссылок с наибольшим числом кликов (order="clicks")
+    или самых недавно использованных (order="last_used"), читая их серверным курсором."""
+    links = Link.__table__
+    ordering = links.c.clicks.desc() if order == "clicks" else links.c.last_used.desc().nulls_last()
+    query = (
+        select(links.c.short_url, links.c.original_url, links.c.expires_at, links.c.clicks, links.c.last_used,
+               links.c.created_by_uuid)
+        .where(or_(links.c.expires_at.is_(None), links.c.expires_at > func.now()))
+        .order_by(ordering)
+        .limit(limit)
+        .execution_options(yield_per=batch_size)
+    )
+    async for session in get_async_session():
+        result = await session.stream(query)
+        async for partition in result.partitions():
+            yield partition
+
+async def read_user_stats_from_db(user_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """Сохраненные агрегаты пользователей. Пользователей без строки в таблице в результате нет."""
+    async with primary_read_session() as session:
+        query = select(UserStats.__table__).where(UserStats.__table__.c.user_id.in_(list(user_ids)))
+        result = await session.execute(query)
+        return {str(row.user_id): {"total_clicks": row.total_clicks,
+                                   "active_links": row.active_links,
+                                   "last_activity": row.last_activity} for row in result.all()}
+
+async def write_user_stats_to_db(rows: List[Dict[str, Any]]):
+    """Сохраняет агрегаты пользователей пачкой одним INSERT ... ON CONFLICT DO UPDATE."""
+    async for session in get_async_session():
+        try:
+            statement = pg_insert(UserStats.__table__).values(rows)
+            statement = statement.on_conflict_do_update(
+                index_elements=['user_id'],
+                set_={"total_clicks": statement.excluded.total_clicks,
+                      "active_links": statement.excluded.active_links,
+                      "last_activity": statement.excluded.last_activity}
+            )
+            await session.execute(statement)
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            raise e
+        finally:
+            await session.close()
+
+# Как и _UPDATE_STATS_BATCH - массивами: VALUES с четырьмя параметрами на строку упирается в предел asyncpg
+# в 32767 параметров уже на 8192 строках, а пачка событий дает до двух строк на событие
+_UPSERT_CLICK_ROLLUPS = text(
+    "INSERT INTO click_rollups (short_url, granularity, bucket_start, clicks) "
+    "SELECT * FROM unnest(CAST(:short_urls AS varchar[]), CAST(:granularities AS varchar[]), "
+    "CAST(:bucket_starts AS timestamptz[]), CAST(:clicks AS bigint[])) "
+    "ON CONFLICT (short_url, granularity, bucket_start) DO UPDATE SET clicks = click_rollups.clicks + EXCLUDED.clicks"
+)
+
+async def write_click_rollups_to_db(rows: List[Dict[str, Any]]):
+    """Прибавляет переходы к счетчикам click_rollups одним INSERT ... SELECT FROM unnest(...) ON CONFLICT DO UPDATE.
+
+    Ключи (short_url, granularity, bucket_start) в rows не должны повторяться.
+    """
+    params = {"short_urls": [row['short_url'] for row in rows],
+              "granularities": [row['granularity'] for row in rows],
+              "bucket_starts": [row['bucket_start'] for row in rows],
+              "clicks": [row['clicks'] for row in rows]}
+
+    async for session in get_async_session():
+        try:
+            await session.execute(_UPSERT_CLICK_ROLLUPS, params)
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            raise e
+        finally:
+            await session.close()
@@ -0,0 +1,133 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from logging import getLogger
+from typing import Dict, Any
+
+from config import STATS_FLUSH_INTERVAL, STATS_FLUSH_BATCH_SIZE, STATS_INFLIGHT_TIMEOUT, STATS_EXPIRY_INTERVAL
+from redis_caching.client import r
+from redis_caching.clicks import (drain_dirty, ack_dirty, requeue_dirty, reclaim_inflight, sweep_cached_stats,
+                                  expire_stale_stats, legacy_stats_batches, drop_legacy_links, get_dirty_stats)
+from redis_caching.db_sync import write_stats_batch_to_db
+from redis_caching.leader import lease
+from redis_caching.user_stats import flush_user_stats
+
+logger = getLogger('redis_caching')
+
+flusher_status: Dict[str, Any] = {
+    "flush_interval": STATS_FLUSH_INTERVAL,
+    "batch_size": STATS_FLUSH_BATCH_SIZE,
+    "last_flush_at": None,
+    "last_flush_rows": 0,
+    "last_flush_seconds": 0.0,
+    "total_rows": 0,
+    "total_batches": 0,
+    "errors": 0,
+    "reclaimed": 0,
+    "expired": 0,
+}
+
+
+async def flush_stats(batch_size: int = STATS_FLUSH_BATCH_SIZE) -> int:
+    """Выгружает очередь измененных статистик в БД пачками по batch_size. Возвращает число записанных строк."""
+    flushed = 0
+    while True:
+        rows, scores = await drain_dirty(batch_size)
+        if rows:
+            try:
+                await write_stats_batch_to_db(rows)
+            except Exception:
+                await requeue_dirty(scores)
+                raise
+            flushed += len(rows)
+            flusher_status["total_batches"] += 1
+        await ack_dirty(scores)
+
+        # неполная пачка - очередь разобрана, новые изменения подождут следующего цикла
+        if len(scores) < batch_size:
+            return flushed
+
+
+async def recover_stats() -> int:
+    """Восстановление при старте лидера: возвращает в очередь зависшие выгрузки и ставит в нее все статистики из Redis.
+
+    Запись статистик идемпотентна, поэтому повторная выгрузка уже записанных значений безопасна.
+    """
+    reclaimed = await reclaim_inflight(STATS_INFLIGHT_TIMEOUT)
+    swept = await sweep_cached_stats()
+    flusher_status["reclaimed"] += reclaimed
+    logger.info(f"Восстановление статистик: возвращено зависших {reclaimed}, найдено в кэше {swept}")
+    migrated = await migrate_legacy_stats()
+    if migrated:
+        logger.info(f"Статистики в прежнем формате выгружены в БД и удалены из кэша: {migrated}")
+    dropped = await drop_legacy_links()
+    if dropped:
+        logger.info(f"Удалены записи ссылок в прежнем формате: {dropped}")
+    return swept
+
+
+async def migrate_legacy_stats(batch_size: int = STATS_FLUSH_BATCH_SIZE) -> int:
+    """Выгружает в БД и удаляет из Redis статистики, оставшиеся от прежних форматов (ключ stats:{code} на ссылку:
+    хэш или JSON-строка).
+
+    Такие ключи не имеют TTL и без этого копились бы вечно. Возвращает количество выгруженных строк.
+    """
+    migrated = 0
+    async for keys, rows in legacy_stats_batches(batch_size):
+        if rows:
+            await write_stats_batch_to_db(rows)
+        await r.delete(*keys)
+        migrated += len(rows)
+    return migrated
+
+
+async def run_stats_flusher():
+    """Периодически выгружает статистики ссылок и агрегаты пользователей из Redis в БД."""
+    while True:
+        await asyncio.sleep(STATS_FLUSH_INTERVAL)
+        started = time.perf_counter()
+        try:
+            flusher_status["reclaimed"] += await reclaim_inflight(STATS_INFLIGHT_TIMEOUT)
+            flushed = await flush_stats()
+            # агрегаты пользователей сохраняем тем же циклом
+            await flush_user_stats(STATS_FLUSH_BATCH_SIZE)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            flusher_status["errors"] += 1
+            logger.warning(f"Ошибка при выгрузке статистик: {e}")
+            continue
+
+        flusher_status["last_flush_at"] = datetime.now(timezone.utc)
+        flusher_status["last_flush_rows"] = flushed
+        flusher_status["last_flush_seconds"] = round(time.perf_counter() - started, 3)
+        flusher_status["total_rows"] += flushed
+        if flushed:
+            logger.debug(f"Выгружено статистик: {flushed} за {flusher_status['last_flush_seconds']} с")
+
+
+async def run_stats_sync():
+    """Задача лидера: восстановление после рестарта или смены лидера и периодическая выгрузка."""
+    await recover_stats()
+    await run_stats_flusher()
+
+
+async def run_stats_expiry():
+    """Задача лидера: раз в STATS_EXPIRY_INTERVAL секунд удаляет давно не менявшиеся выгруженные статистики."""
+    while True:
+        await asyncio.sleep(STATS_EXPIRY_INTERVAL)
+        started = time.perf_counter()
+        try:
+            expired = await expire_stale_stats()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Ошибка при удалении устаревших статистик: {e}")
+            continue
+        flusher_status["expired"] += expired
+        logger.info(f"Удалено устаревших статистик: {expired} за {time.perf_counter() - started:.1f} с")
+
+
+async def get_flusher_status() -> Dict[str, Any]:
+    """Состояние флашера вместе с размером очереди и отставанием выгрузки."""
+    return {**flusher_status, "is_leader": lease.is_leader, **await get_dirty_stats()}
@@ -0,0 +1,170 @@
+import asyncio
+import math
+import time
+import uuid
+from hashlib import blake2b
+from logging import getLogger
+from typing import Any, Dict, List
+
+from config import (LOCAL_CLICKS_FLUSH_INTERVAL, HOT_LINKS_BUCKET_SECONDS, HOT_LINKS_MAX_WINDOW, HOT_LINKS_CAPACITY,
+                    HOT_LINKS_SKETCH_WIDTH, HOT_LINKS_SKETCH_DEPTH, HOT_LINKS_BUFFER_MAX, HOT_LINKS_QUERY_CACHE_TTL)
+from redis_caching.client import r
+from redis_caching.local_cache import LocalCache
+
+logger = getLogger('redis_caching')
+
+# Самые популярные ссылки за последние минуты. Время делится на корзины по HOT_LINKS_BUCKET_SECONDS секунд,
+# на каждую корзину в Redis два ключа:
+#   hot:cms:{bucket} - Count-Min Sketch кликов: HOT_LINKS_SKETCH_DEPTH строк по HOT_LINKS_SKETCH_WIDTH счетчиков u32
+#                      в одной строке BITFIELD. Оценка кликов кода - минимум его счетчиков по строкам, она не меньше
+#                      настоящего числа и завышена не больше чем на e / ширину от всех кликов корзины;
+#   hot:top:{bucket} - sorted set не больше HOT_LINKS_CAPACITY кодов с наибольшей оценкой. Вытесненный код,
+#                      снова набравший клики, возвращается с полной оценкой из скетча.
+# Память на корзину не зависит от числа ссылок. Редирект только считает клик в памяти воркера, в Redis клики
+# уходят фоном пачками скриптов, поэтому корзины общие для всех воркеров. Топ за окно - объединение sorted set
+# последних корзин (текущая еще заполняется), его стоимость зависит только от окна и HOT_LINKS_CAPACITY.
+
+SKETCH_KEY = "hot:cms:{}"
+TOP_KEY = "hot:top:{}"
+# корзины живут чуть дольше самого длинного окна
+BUCKET_TTL = HOT_LINKS_MAX_WINDOW + 2 * HOT_LINKS_BUCKET_SECONDS
+# сколько кодов отправлять одним скриптом: Redis однопоточный, и длинный скрипт задержал бы остальные команды
+HOT_LINKS_SCRIPT_BATCH = 500
+
+# KEYS: hot:cms:{bucket}, hot:top:{bucket}
+# ARGV: число строк скетча, HOT_LINKS_CAPACITY, TTL корзины, затем для каждого кода: код, клики, смещения счетчиков
+_add_clicks = r.register_script("""
+local depth = tonumber(ARGV[1])
+local step = depth + 2
+for i = 4, #ARGV, step do
+    local clicks = ARGV[i + 1]
+    local args = {'OVERFLOW', 'SAT'}
+    for row = 1, depth do
+        args[#args + 1] = 'INCRBY'
+        args[#args + 1] = 'u32'
+        args[#args + 1] = ARGV[i + 1 + row]
+        args[#args + 1] = clicks
+    end
+    local counters = redis.call('BITFIELD', KEYS[1], unpack(args))
+    local estimate = counters[1]
+    for row = 2, depth do
+        estimate = math.min(estimate, counters[row])
+    end
+    redis.call('ZADD', KEYS[2], estimate, ARGV[i])
+end
+local extra = redis.call('ZCARD', KEYS[2]) - tonumber(ARGV[2])
+if extra > 0 then
+    redis.call('ZREMRANGEBYRANK', KEYS[2], 0, extra - 1)
+end
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+""")
+
+# KEYS: временный ключ, hot:top:{bucket} корзин окна
+# ARGV: k
+_top = r.register_script("""
+redis.call('ZUNIONSTORE', KEYS[1], #KEYS - 1, unpack(KEYS, 2))
+local top = redis.call('ZREVRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1, 'WITHSCORES')
+redis.call('DEL', KEYS[1])
+return top
+""")
+
+# код -> количество кликов с последней отправки
+_pending_hot: Dict[str, int] = {}
+
+hot_links_stats = {"buffered": 0, "dropped": 0, "sent": 0}
+
+# одинаковые запросы топа от дашбордов в пределах HOT_LINKS_QUERY_CACHE_TTL секунд не ходят в Redis
+_top_cache = LocalCache(max_entries=256, ttl=HOT_LINKS_QUERY_CACHE_TTL)
+
+
+def _bucket(moment: float) -> int:
+    return int(moment) // HOT_LINKS_BUCKET_SECONDS
+
+
+def _counter_offsets(short_code: str) -> List[str]:
+    digest = blake2b(short_code.encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:], "little") | 1
+    # по счетчику на строку, строки идут подряд; '#' - смещение в счетчиках, а не в битах
+    return [f"#{row * HOT_LINKS_SKETCH_WIDTH + (h1 + row * h2) % HOT_LINKS_SKETCH_WIDTH}"
+            for row in range(HOT_LINKS_SKETCH_DEPTH)]
+
+
+def count_hot_click(short_code: str):
+    """Засчитывает клик для топа популярных ссылок. Не обращается к Redis.
+
+    Если в буфере уже HOT_LINKS_BUFFER_MAX кодов, клики по новым кодам отбрасываются: популярные коды к этому
+    моменту уже в буфере, и на топ это почти не влияет.
+    """
+    clicks = _pending_hot.get(short_code)
+    if clicks is not None:
+        _pending_hot[short_code] = clicks + 1
+    elif len(_pending_hot) < HOT_LINKS_BUFFER_MAX:
+        _pending_hot[short_code] = 1
+    else:
+        hot_links_stats["dropped"] += 1
+        return
+    hot_links_stats["buffered"] += 1
+
+
+async def flush_hot_clicks() -> int:
+    """Отправляет накопленные клики в корзину текущего времени скриптами по HOT_LINKS_SCRIPT_BATCH кодов.
+
+    Возвращает количество кодов.
+    """
+    global _pending_hot
+    if not _pending_hot:
+        return 0
+    pending, _pending_hot = list(_pending_hot.items()), {}
+    bucket = _bucket(time.time())
+    keys = [SKETCH_KEY.format(bucket), TOP_KEY.format(bucket)]
+    for start in range(0, len(pending), HOT_LINKS_SCRIPT_BATCH):
+        batch = pending[start:start + HOT_LINKS_SCRIPT_BATCH]
+        args: List[Any] = [HOT_LINKS_SKETCH_DEPTH, HOT_LINKS_CAPACITY, BUCKET_TTL]
+        for short_code, clicks in batch:
+            args += [short_code, clicks, *_counter_offsets(short_code)]
+        try:
+            await _add_clicks(keys=keys, args=args)
+        except Exception:
+            # возвращаем в буфер неотправленные клики, чтобы отправить их в следующий раз
+            for short_code, clicks in pending[start:]:
+                _pending_hot[short_code] = _pending_hot.get(short_code, 0) + clicks
+            raise
+        hot_links_stats["sent"] += sum(clicks for _, clicks in batch)
+    return len(pending)
+
+
+async def run_hot_clicks_flusher():
+    """Периодически отправляет клики для топа в Redis. Запускается в каждом воркере."""
+    while True:
+        await asyncio.sleep(LOCAL_CLICKS_FLUSH_INTERVAL)
+        try:
+            await flush_hot_clicks()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Ошибка при отправке кликов для топа ссылок: {e}")
+
+
+async def get_top_links(window: int, k: int) -> List[Dict[str, Any]]:
+    """Не больше k кодов с наибольшим числом кликов за последние window секунд, по убыванию.
+
+    Окно округляется вверх до целых корзин, последняя из которых - текущая, еще не заполненная. Число кликов -
+    оценка сверху, клики за последние LOCAL_CLICKS_FLUSH_INTERVAL секунд еще не учтены.
+    """
+    buckets = math.ceil(window / HOT_LINKS_BUCKET_SECONDS)
+    cache_key = f"{buckets}:{k}"
+    top = _top_cache.get(cache_key)
+    if top is None:
+        current = _bucket(time.time())
+        response = await _top(keys=[f"hot:query:{uuid.uuid4().hex}",
+                                    *[TOP_KEY.format(bucket) for bucket in range(current - buckets + 1, current + 1)]],
+                              args=[k])
+        top = [{"short_code": response[i], "clicks": int(float(response[i + 1]))} for i in range(0, len(response), 2)]
+        _top_cache.set(cache_key, top)
+    return top
+
+
+def get_hot_links_status() -> Dict[str, Any]:
+    return {**hot_links_stats, "pending": len(_pending_hot)}
@@ -0,0 +1,102 @@
+import asyncio
+from logging import getLogger
+from typing import Awaitable, Callable, List
+from uuid import uuid4
+
+from config import LEADER_LEASE_TTL, LEADER_RENEW_INTERVAL
+from redis_caching.client import r
+
+logger = getLogger('redis_caching')
+
+LEADER_KEY = "sync:leader"
+
+# KEYS: ключ аренды; ARGV: токен владельца, ttl в миллисекундах
+_renew = r.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+""")
+
+# KEYS: ключ аренды или блокировки; ARGV: токен владельца
+_release = r.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+
+async def release_lock(key: str, token: str):
+    """Удаляет ключ блокировки, только если он все еще принадлежит владельцу token."""
+    await _release(keys=[key], args=[token])
+
+
+class LeaderLease:
+    """Аренда лидерства в Redis: ключ с TTL, который продлевает только его владелец.
+
+    Если лидер перестал продлевать аренду (упал, завис, потерял связь), ключ истекает и лидером
+    становится другой процесс.
+    """
+
+    def __init__(self, key: str = LEADER_KEY, ttl: float = LEADER_LEASE_TTL):
+        self.key = key
+        self.ttl_ms = int(ttl * 1000)
+        self.token = uuid4().hex
+        self.is_leader = False
+
+    async def acquire(self) -> bool:
+        self.is_leader = bool(await r.set(self.key, self.token, nx=True, px=self.ttl_ms))
+        return self.is_leader
+
+    async def renew(self) -> bool:
+        self.is_leader = bool(await _renew(keys=[self.key], args=[self.token, self.ttl_ms]))
+        return self.is_leader
+
+    async def release(self):
+        if self.is_leader:
+            self.is_leader = False
+            await release_lock(self.key, self.token)
+
+
+lease = LeaderLease()
+
+
+async def run_as_leader(jobs: List[Callable[[], Awaitable]]):
+    """Запускает фоновые задачи только в процессе-лидере.
+
+    Остальные процессы ждут и пытаются забрать аренду раз в LEADER_RENEW_INTERVAL секунд.
+    При потере аренды задачи отменяются, процесс снова становится кандидатом.
+    """
+    while True:
+        try:
+            acquired = await lease.acquire()
+        except Exception as e:
+            logger.warning(f"Ошибка при получении лидерства: {e}")
+            acquired = False
+
+        if not acquired:
+            await asyncio.sleep(LEADER_RENEW_INTERVAL)
+            continue
+
+        logger.info(f"Процесс {lease.token} стал лидером фоновой синхронизации")
+        tasks = [asyncio.create_task(job()) for job in jobs]
+        try:
+            while lease.is_leader:
+                await asyncio.sleep(LEADER_RENEW_INTERVAL)
+                try:
+                    await lease.renew()
+                except Exception as e:
+                    logger.warning(f"Ошибка при продлении лидерства: {e}")
+                    lease.is_leader = False
+                if any(task.done() for task in tasks):
+                    # задача лидера не должна завершаться сама, отдаем лидерство другому процессу
+                    logger.warning("Фоновая задача лидера завершилась, освобождаем лидерство")
+                    await lease.release()
+            logger.warning(f"Процесс {lease.token} потерял лидерство")
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if lease.is_leader:
+                await lease.release()
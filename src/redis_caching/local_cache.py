@@ -0,0 +1,108 @@
+import asyncio
+import time
+from collections import OrderedDict
+from logging import getLogger
+from typing import Any, Dict
+
+from config import LOCAL_CACHE_MAX_ENTRIES, LOCAL_CACHE_TTL, AUTH_USER_CACHE_MAX_ENTRIES, AUTH_USER_CACHE_TTL
+from redis_caching.client import r
+
+logger = getLogger('redis_caching')
+
+INVALIDATION_CHANNEL = "links:invalidate"
+USERS_INVALIDATION_CHANNEL = "users:invalidate"
+
+
+class LocalCache:
+    """Ограниченный LRU-кэш с TTL в памяти воркера.
+
+    Записи живут не дольше ttl секунд и не дольше переданного дедлайна (например, срока жизни ссылки).
+    Работает без блокировок: все обращения идут из одного event loop.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Any | None:
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: str, value: Any, deadline: float | None = None):
+        """Кладет значение. deadline - unix-время, после которого запись недействительна."""
+        if self.max_entries <= 0:
+            return
+        ttl = self.ttl
+        if deadline is not None:
+            ttl = min(ttl, deadline - time.time())
+            if ttl <= 0:
+                return
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: str):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+local_links = LocalCache(LOCAL_CACHE_MAX_ENTRIES, LOCAL_CACHE_TTL)
+# пользователи, найденные по JWT, по строковому id (см. auth.auth.CachedJWTStrategy)
+local_users = LocalCache(AUTH_USER_CACHE_MAX_ENTRIES, AUTH_USER_CACHE_TTL)
+
+
+async def publish_invalidation(short_code: str):
+    """Сбрасывает ссылку из локального кэша этого и всех остальных воркеров."""
+    local_links.invalidate(short_code)
+    await r.publish(INVALIDATION_CHANNEL, short_code)
+
+
+async def publish_user_invalidation(user_id):
+    """Сбрасывает пользователя из локального кэша этого и всех остальных воркеров."""
+    local_users.invalidate(str(user_id))
+    await r.publish(USERS_INVALIDATION_CHANNEL, str(user_id))
+
+
+async def listen_invalidations():
+    """Слушает инвалидации от других воркеров. Запускается в каждом воркере."""
+    caches = {INVALIDATION_CHANNEL: local_links, USERS_INVALIDATION_CHANNEL: local_users}
+    while True:
+        try:
+            async with r.pubsub() as pubsub:
+                await pubsub.subscribe(*caches)
+                # пока не были подписаны, инвалидации могли пройти мимо
+                for cache in caches.values():
+                    cache.clear()
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        caches[message["channel"]].invalidate(message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Ошибка подписки на инвалидации локального кэша: {e}")
+            for cache in caches.values():
+                cache.clear()
+            await asyncio.sleep(1)
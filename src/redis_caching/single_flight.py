@@ -0,0 +1,66 @@
+import asyncio
+import time
+from logging import getLogger
+from typing import Awaitable, Callable, Dict, Tuple
+from uuid import uuid4
+
+from config import LINK_LOAD_LOCK_TTL, LINK_LOAD_POLL_INTERVAL
+from redis_caching.client import r
+from redis_caching.clicks import record_hit, HIT_OK
+from redis_caching.leader import release_lock
+
+logger = getLogger('redis_caching')
+
+# Загрузки ссылок из БД, которые сейчас выполняются в этом воркере
+_loading: Dict[str, asyncio.Task] = {}
+
+single_flight_stats = {"loads": 0, "shared": 0, "lock_waits": 0}
+
+
+async def _load_with_lock(short_code: str, loader: Callable[[], Awaitable[str]]) -> str:
+    """Загружает ссылку под короткой блокировкой в Redis, общей для всех воркеров.
+
+    Не получившие блокировку ждут, пока ссылка появится в кэше (засчитывая клик обычным попаданием),
+    и идут в БД сами, только если блокировка освободилась или истекла, а ссылки в кэше так и нет.
+    """
+    lock_key = f"lock:short_url:{short_code}"
+    token = uuid4().hex
+    if await r.set(lock_key, token, nx=True, px=int(LINK_LOAD_LOCK_TTL * 1000)):
+        try:
+            single_flight_stats["loads"] += 1
+            return await loader()
+        finally:
+            await release_lock(lock_key, token)
+
+    single_flight_stats["lock_waits"] += 1
+    deadline = time.monotonic() + LINK_LOAD_LOCK_TTL
+    while time.monotonic() < deadline:
+        await asyncio.sleep(LINK_LOAD_POLL_INTERVAL)
+        hit, original_url = await record_hit(short_code)
+        if hit == HIT_OK:
+            return original_url
+        if not await r.exists(lock_key):
+            break
+
+    single_flight_stats["loads"] += 1
+    return await loader()
+
+
+async def load_once(short_code: str, loader: Callable[[], Awaitable[str]]) -> Tuple[str, bool]:
+    """Single-flight загрузка ссылки при промахе кэша.
+
+    loader загружает ссылку из БД, кладет ее в кэш (засчитывая клик) и возвращает original_url.
+    Одновременные промахи по одному коду в воркере ждут одну и ту же загрузку, между воркерами
+    загрузку координирует блокировка в Redis. Возвращает (original_url, shared): shared=True значит,
+    что результат получен чужой загрузкой и клик этого запроса еще не засчитан.
+    """
+    task = _loading.get(short_code)
+    if task is not None:
+        single_flight_stats["shared"] += 1
+        return await asyncio.shield(task), True
+
+    task = asyncio.create_task(_load_with_lock(short_code, loader))
+    _loading[short_code] = task
+    task.add_done_callback(lambda _: _loading.pop(short_code, None))
+    # shield: если клиент первого запроса отвалится, загрузка продолжится для остальных
+    return await asyncio.shield(task), False
@@ -0,0 +1,181 @@
+from datetime import datetime, timezone
+from logging import getLogger
+from typing import Any, Dict, List, Tuple
+from uuid import UUID
+
+from redis_caching.client import r
+from redis_caching.db_sync import read_user_stats_from_db, write_user_stats_to_db
+
+logger = getLogger('redis_caching')
+
+# Агрегаты пользователя живут в хэше user_stats:{uuid} (clicks, links, last_activity в ISO 8601, loaded).
+# Клики прибавляет add_user_clicks: владельца ссылки возвращают скрипты клика (см. redis_caching.clicks), клики
+# копятся в воркере и отправляются вместе с его локальным буфером кликов. Ссылки прибавляют создание и удаление
+# ссылок. Пока в хэше нет поля loaded, в нем копятся только приращения: загрузка прибавляет к ним сохраненные
+# значения из таблицы user_stats. Измененные агрегаты попадают в sorted set sync:users_dirty
+# (score - время первого изменения) и сохраняются в таблицу флашером статистик.
+# links - число неистекших ссылок. Истекшие ссылки вычитает задача обслуживания (см. shurl.partitions.expire_user_links)
+# интервалами по сроку: ссылки со сроком не позже отметки sync:links_expired_until уже вычтены, и удаление такой
+# ссылки links не меняет (см. is_counted_link).
+
+USERS_DIRTY_KEY = "sync:users_dirty"
+LINKS_EXPIRED_UNTIL_KEY = "sync:links_expired_until"
+
+# Возвращает интервал отметке, если ее с тех пор никто не сдвинул.
+# KEYS: sync:links_expired_until; ARGV: отметка, поставленная при захвате, прежняя отметка или ""
+_release_expired = r.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    if ARGV[2] == '' then
+        redis.call('DEL', KEYS[1])
+    else
+        redis.call('SET', KEYS[1], ARGV[2])
+    end
+end
+""")
+
+# KEYS: user_stats:{uuid}
+# ARGV: total_clicks, active_links, last_activity в ISO 8601 или ""
+_load_user_stats = r.register_script("""
+if redis.call('HEXISTS', KEYS[1], 'loaded') == 1 then
+    return 0
+end
+redis.call('HINCRBY', KEYS[1], 'clicks', ARGV[1])
+redis.call('HINCRBY', KEYS[1], 'links', ARGV[2])
+if ARGV[3] ~= '' then
+    local last = redis.call('HGET', KEYS[1], 'last_activity')
+    if not last or last < ARGV[3] then
+        redis.call('HSET', KEYS[1], 'last_activity', ARGV[3])
+    end
+end
+redis.call('HSET', KEYS[1], 'loaded', 1)
+return 1
+""")
+
+
+# KEYS: user_stats:{uuid}, sync:users_dirty
+# ARGV: клики, unix-время первого клика, время последнего клика в ISO 8601, uuid
+_add_user_clicks = r.register_script("""
+redis.call('HINCRBY', KEYS[1], 'clicks', ARGV[1])
+local last = redis.call('HGET', KEYS[1], 'last_activity')
+if not last or last < ARGV[3] then
+    redis.call('HSET', KEYS[1], 'last_activity', ARGV[3])
+end
+redis.call('ZADD', KEYS[2], 'NX', ARGV[2], ARGV[4])
+""")
+
+
+async def add_user_clicks(clicks: Dict[str, list]):
+    """Прибавляет клики к агрегатам пользователей одним пайплайном.
+
+    clicks - {uuid: [клики, unix-время первого клика, время последнего клика в ISO 8601]}.
+    """
+    if not clicks:
+        return
+    async with r.pipeline(transaction=False) as pipe:
+        for user_id, (count, first_click, last_used) in clicks.items():
+            await _add_user_clicks(keys=[f"user_stats:{user_id}", USERS_DIRTY_KEY],
+                                   args=[count, first_click, last_used, user_id], client=pipe)
+        await pipe.execute()
+
+
+async def claim_expired_links(until: float) -> float | None:
+    """Сдвигает отметку до until и возвращает прежнюю (None при первом запуске): ссылки со сроком в интервале
+    (прежняя отметка, until] вычитает из links тот, кто его забрал. Одновременные запуски получают разные интервалы."""
+    previous = await r.set(LINKS_EXPIRED_UNTIL_KEY, str(until), get=True)
+    return float(previous) if previous is not None else None
+
+
+async def release_expired_links(until: float, previous: float | None):
+    """Возвращает интервал, забранный claim_expired_links, если вычесть ссылки не удалось."""
+    await _release_expired(keys=[LINKS_EXPIRED_UNTIL_KEY], args=[str(until), "" if previous is None else str(previous)])
+
+
+async def links_expired_until() -> float:
+    """Отметка, до которой истекшие ссылки уже вычтены из links. До первого запуска обслуживания - текущее время."""
+    value = await r.get(LINKS_EXPIRED_UNTIL_KEY)
+    return float(value) if value is not None else datetime.now(timezone.utc).timestamp()
+
+
+def is_counted_link(expires_at: datetime | None, expired_until: float) -> bool:
+    """Учтена ли ссылка в links владельца: удаление такой ссылки уменьшает links на единицу."""
+    return expires_at is None or expires_at.timestamp() > expired_until
+
+
+async def adjust_user_stats(deltas: Dict[Any, Tuple[int, int]]):
+    """Прибавляет к агрегатам пользователей {user_id: (клики, ссылки)}. Пользователь None пропускается."""
+    deltas = {str(user_id): delta for user_id, delta in deltas.items() if user_id is not None}
+    if not deltas:
+        return
+    now = datetime.now(timezone.utc).timestamp()
+    async with r.pipeline(transaction=False) as pipe:
+        for user_id, (clicks, links) in deltas.items():
+            if clicks:
+                pipe.hincrby(f"user_stats:{user_id}", "clicks", clicks)
+            if links:
+                pipe.hincrby(f"user_stats:{user_id}", "links", links)
+        pipe.zadd(USERS_DIRTY_KEY, {user_id: now for user_id in deltas}, nx=True)
+        await pipe.execute()
+
+
+async def _load_from_db(user_ids: List[str]):
+    """Прибавляет сохраненные в БД агрегаты к еще не загруженным хэшам."""
+    saved = await read_user_stats_from_db(user_ids)
+    async with r.pipeline(transaction=False) as pipe:
+        for user_id in user_ids:
+            row = saved.get(user_id, {"total_clicks": 0, "active_links": 0, "last_activity": None})
+            await _load_user_stats(keys=[f"user_stats:{user_id}"],
+                                   args=[row["total_clicks"], row["active_links"],
+                                         row["last_activity"].isoformat() if row["last_activity"] else ""],
+                                   client=pipe)
+        await pipe.execute()
+
+
+async def _read_user_stats(user_ids: List[str]) -> List[Dict[str, Any]]:
+    """Агрегаты пользователей из Redis, при необходимости загружая их из БД."""
+    async with r.pipeline(transaction=False) as pipe:
+        for user_id in user_ids:
+            pipe.hmget(f"user_stats:{user_id}", "clicks", "links", "last_activity", "loaded")
+        rows = await pipe.execute()
+
+    not_loaded = [user_id for user_id, row in zip(user_ids, rows) if row[3] is None]
+    if not_loaded:
+        await _load_from_db(not_loaded)
+        return await _read_user_stats(user_ids)
+
+    return [{
+        "user_id": user_id,
+        "total_clicks": int(clicks or 0),
+        "active_links": int(links or 0),
+        "last_activity": datetime.fromisoformat(last_activity) if last_activity else None,
+    } for user_id, (clicks, links, last_activity, _) in zip(user_ids, rows)]
+
+
+async def get_user_summary(user_id) -> Dict[str, Any]:
+    """Агрегаты пользователя: всего кликов по его ссылкам, число ссылок и время последнего клика."""
+    summary = (await _read_user_stats([str(user_id)]))[0]
+    del summary["user_id"]
+    return summary
+
+
+async def flush_user_stats(batch_size: int = 1000) -> int:
+    """Сохраняет измененные агрегаты в БД пачками по batch_size. Возвращает число записанных строк.
+
+    Записываются абсолютные значения, поэтому повторная запись безопасна. Если процесс упадет между
+    снятием пользователей с очереди и записью, агрегаты останутся в Redis и сохранятся при следующем изменении.
+    """
+    flushed = 0
+    while True:
+        popped = await r.zpopmin(USERS_DIRTY_KEY, batch_size)
+        if popped:
+            try:
+                rows = await _read_user_stats([user_id for user_id, _ in popped])
+                for row in rows:
+                    row["user_id"] = UUID(row["user_id"])
+                await write_user_stats_to_db(rows)
+            except Exception:
+                await r.zadd(USERS_DIRTY_KEY, dict(popped), lt=True)
+                raise
+            flushed += len(popped)
+
+        if len(popped) < batch_size:
+            return flushed
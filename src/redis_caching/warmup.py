@@ -0,0 +1,70 @@
+import asyncio
+import time
+from logging import getLogger
+from typing import Any, Dict
+from uuid import uuid4
+
+from config import WARMUP_LINKS, WARMUP_ORDER, WARMUP_BATCH_SIZE, WARMUP_TIMEOUT
+from redis_caching.client import r
+from redis_caching.clicks import warm_cached_links
+from redis_caching.db_sync import stream_hot_links
+from redis_caching.leader import release_lock
+
+logger = getLogger('redis_caching')
+
+# Прогрев кэша при старте: WARMUP_LINKS самых популярных неистекших ссылок из БД кладутся в Redis до того, как
+# воркер начнет принимать запросы, чтобы после деплоя или рестарта Redis промахи не шли лавиной в Postgres.
+# Ссылки читаются серверным курсором и пишутся пачками по WARMUP_BATCH_SIZE одним пайплайном на пачку.
+# Прогревает один воркер под блокировкой warmup:lock, остальные ждут ее снятия: кэш в Redis общий.
+
+WARMUP_LOCK_KEY = "warmup:lock"
+WARMUP_POLL_INTERVAL = 0.1
+
+warmup_status: Dict[str, Any] = {"enabled": WARMUP_LINKS > 0, "done": False, "links": 0, "seconds": 0.0}
+
+
+async def _warm_up() -> int:
+    warmed = 0
+    async for links in stream_hot_links(WARMUP_LINKS, WARMUP_ORDER, WARMUP_BATCH_SIZE):
+        warmed += await warm_cached_links(links)
+        warmup_status["links"] = warmed
+    return warmed
+
+
+async def warm_up_cache():
+    """Прогревает кэш, если WARMUP_LINKS > 0. Вызывается в lifespan до начала приема запросов.
+
+    Не дольше WARMUP_TIMEOUT секунд. Ошибки только логируются: холодный кэш не повод не запускаться.
+    """
+    if WARMUP_LINKS <= 0:
+        return
+    started = time.perf_counter()
+    token = uuid4().hex
+    acquired = False
+    try:
+        async with asyncio.timeout(WARMUP_TIMEOUT):
+            acquired = bool(await r.set(WARMUP_LOCK_KEY, token, nx=True, px=int(WARMUP_TIMEOUT * 1000)))
+            if acquired:
+                warmed = await _warm_up()
+                logger.info(f"Прогрев кэша: загружено ссылок {warmed} за {time.perf_counter() - started:.2f} с")
+            else:
+                # кэш прогревает другой воркер, принимать запросы начинаем вместе с ним
+                while await r.exists(WARMUP_LOCK_KEY):
+                    await asyncio.sleep(WARMUP_POLL_INTERVAL)
+                logger.info(f"Прогрев кэша выполнен другим воркером, ожидание {time.perf_counter() - started:.2f} с")
+    except TimeoutError:
+        logger.warning(f"Прогрев кэша не закончился за {WARMUP_TIMEOUT} с, загружено ссылок {warmup_status['links']}")
+    except Exception as e:
+        logger.warning(f"Ошибка при прогреве кэша: {e}")
+    finally:
+        if acquired:
+            try:
+                await release_lock(WARMUP_LOCK_KEY, token)
+            except Exception as e:
+                logger.warning(f"Не удалось снять блокировку прогрева кэша: {e}")
+        warmup_status["done"] = True
+        warmup_status["seconds"] = round(time.perf_counter() - started, 3)
+
+
+def get_warmup_status() -> Dict[str, Any]:
+    return dict(warmup_status)
@@ -0,0 +1,108 @@
+import asyncio
+import math
+from collections import deque
+from hashlib import blake2b
+from logging import getLogger
+from typing import Any, Deque, Dict, List
+
+from sqlalchemy import select, func
+
+from config import SHORT_CODE_MODE, SHORT_CODE_BLOCK_SIZE, SHORT_CODE_KEY
+from database import async_session_maker
+from shurl.models import short_code_seq
+from shurl.utils import alphabet, generate_random_string
+
+logger = getLogger('shurl_allocator')
+
+# Коды в режиме sequence: номер из последовательности short_code_seq, переставленный шифром Фейстеля
+# с секретным ключом и записанный в base62 фиксированной длины. Перестановка взаимно однозначна,
+# поэтому разные номера всегда дают разные коды, а по коду нельзя угадать соседние.
+# Номера берутся из БД блоками по SHORT_CODE_BLOCK_SIZE на воркер, выдача кода из блока не ходит в БД.
+
+CODE_LENGTH = 8
+CODE_SPACE = len(alphabet) ** CODE_LENGTH
+FEISTEL_HALF_BITS = math.ceil(math.log2(CODE_SPACE) / 2)
+FEISTEL_HALF_MASK = (1 << FEISTEL_HALF_BITS) - 1
+FEISTEL_ROUNDS = 8
+
+
+def _round(key: bytes, i: int, half: int) -> int:
+    digest = blake2b(half.to_bytes(8, "little"), digest_size=8, key=key, person=i.to_bytes(16, "little")).digest()
+    return int.from_bytes(digest, "little") & FEISTEL_HALF_MASK
+
+
+def permute(number: int, key: bytes) -> int:
+    """Биекция [0, CODE_SPACE) на себя: сеть Фейстеля на 2 * FEISTEL_HALF_BITS битах с cycle walking."""
+    if not 0 <= number < CODE_SPACE:
+        raise ValueError(f"Short code number {number} is out of range")
+    while True:
+        left, right = number >> FEISTEL_HALF_BITS, number & FEISTEL_HALF_MASK
+        for i in range(FEISTEL_ROUNDS):
+            left, right = right, left ^ _round(key, i, right)
+        number = (left << FEISTEL_HALF_BITS) | right
+        # сеть переставляет чуть большее пространство, выпавшие за CODE_SPACE значения шифруем повторно
+        if number < CODE_SPACE:
+            return number
+
+
+def encode(number: int) -> str:
+    chars = []
+    for _ in range(CODE_LENGTH):
+        number, digit = divmod(number, len(alphabet))
+        chars.append(alphabet[digit])
+    return ''.join(reversed(chars))
+
+
+class CodeAllocator:
+    """Выдает короткие коды.
+
+    mode="sequence" - уникальные коды из переставленной последовательности, mode="random" - прежние
+    случайные коды, уникальность которых проверяет только уникальный индекс при вставке.
+    Коллизии все равно возможны с кастомными алиасами и с кодами, выданными до перехода на sequence,
+    поэтому вызывающий код по-прежнему обрабатывает IntegrityError.
+    """
+
+    def __init__(self, mode: str, block_size: int, key: bytes):
+        if mode not in ("sequence", "random"):
+            raise ValueError(f"Unknown short code mode: {mode}")
+        self.mode = mode
+        self.block_size = block_size
+        self.key = key
+        self._numbers: Deque[int] = deque()
+        self._lock = asyncio.Lock()
+        self.leases = 0
+
+    async def _lease(self, count: int):
+        """Забирает из БД count номеров одним запросом."""
+        query = select(short_code_seq.next_value()).select_from(func.generate_series(1, count))
+        async with async_session_maker() as session:
+            result = await session.execute(query)
+            await session.commit()
+        self._numbers.extend(result.scalars().all())
+        self.leases += 1
+        logger.debug(f"Leased {count} short code numbers")
+
+    async def take(self, count: int = 1) -> List[str]:
+        if self.mode == "random":
+            return [generate_random_string(CODE_LENGTH) for _ in range(count)]
+
+        async with self._lock:
+            if len(self._numbers) < count:
+                await self._lease(max(self.block_size, count - len(self._numbers)))
+            numbers = [self._numbers.popleft() for _ in range(count)]
+        return [encode(permute(number, self.key)) for number in numbers]
+
+    async def next_code(self) -> str:
+        return (await self.take(1))[0]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"mode": self.mode, "block_size": self.block_size, "leases": self.leases,
+                "available": len(self._numbers)}
+
+
+# с пустым ключом перестановка публична, и по коду можно восстановить соседние
+if SHORT_CODE_MODE == "sequence" and not SHORT_CODE_KEY:
+    raise RuntimeError("SHORT_CODE_KEY не задан: он обязателен при SHORT_CODE_MODE=sequence")
+
+code_allocator = CodeAllocator(SHORT_CODE_MODE, SHORT_CODE_BLOCK_SIZE,
+                               blake2b((SHORT_CODE_KEY or "").encode(), digest_size=32).digest())
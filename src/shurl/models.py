@@ -1,17 +1,76 @@
-from sqlalchemy import Column, Integer, DateTime, MetaData, String, UUID
+from sqlalchemy import (Column, Integer, BigInteger, DateTime, MetaData, String, UUID, Sequence, Index, func,
+                        literal_column, select, and_)
 import sqlalchemy
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
+# Номера для выдачи коротких кодов, см. shurl.allocator
+short_code_seq = Sequence('short_code_seq', metadata=Base.metadata)
+
+# Таблица links секционирована по сроку жизни ссылки (см. shurl.partitions): ключ секционирования -
+# LINK_PARTITION_KEY, бессрочные ссылки лежат в секции links_forever. Уникальность short_url по всем секциям
+# держит таблица link_codes, она же подсказывает, в какой секции искать ссылку.
+LINK_PARTITION_KEY = "COALESCE(expires_at, 'infinity'::timestamptz)"
+
+
 class Link(Base):
     __tablename__ = 'links'
+    # у секционированной таблицы нет первичного ключа в БД (он обязан включать ключ секционирования),
+    # id уникален за счет последовательности
     id = Column(Integer, primary_key=True)
-    original_url = Column(String, nullable=False, index=True)
-    short_url = Column(String, nullable=False, unique=True, index=True)
+    original_url = Column(String, nullable=False)
+    # хэш канонической формы original_url, см. shurl.url_hash
+    url_hash = Column(BigInteger, nullable=False, index=True)
+    short_url = Column(String, nullable=False, index=True)
     created_by_uuid = Column(UUID, nullable=True, index=True)
     created_at = Column(DateTime(timezone=True), server_default=sqlalchemy.func.now(), nullable=False)
     updated_at = Column(DateTime(timezone=True), server_default=sqlalchemy.func.now(), nullable=False)
     expires_at = Column(DateTime(timezone=True), nullable=True, index=True)
     last_used = Column(DateTime(timezone=True), nullable=True)
     clicks = Column(Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        # keyset-пагинация ссылок пользователя по (created_at, id)
+        Index('ix_links_owner_created', 'created_by_uuid', 'created_at', 'id'),
+        {'postgresql_partition_by': f'RANGE ({LINK_PARTITION_KEY})'},
+    )
+
+
+class LinkCode(Base):
+    """Все занятые короткие коды с ключом секции их ссылки."""
+    __tablename__ = 'link_codes'
+    short_url = Column(String, primary_key=True)
+    expires_at = Column(DateTime(timezone=True), nullable=True)
+
+
+def link_partition_key(table):
+    return func.coalesce(table.c.expires_at, literal_column("'infinity'::timestamptz"))
+
+
+def link_by_code(short_code: str):
+    """Условие поиска ссылки по коду: секция берется из link_codes, остальные секции не просматриваются."""
+    links, codes = Link.__table__, LinkCode.__table__
+    return and_(
+        links.c.short_url == short_code,
+        link_partition_key(links) == select(link_partition_key(codes))
+        .where(codes.c.short_url == short_code).scalar_subquery()
+    )
+
+
+class UserStats(Base):
+    """Сохраненные агрегаты пользователя, живые значения хранятся в Redis (см. redis_caching.user_stats)."""
+    __tablename__ = 'user_stats'
+    user_id = Column(UUID, primary_key=True)
+    total_clicks = Column(BigInteger, default=0, nullable=False)
+    active_links = Column(Integer, default=0, nullable=False)
+    last_activity = Column(DateTime(timezone=True), nullable=True)
+
+
+class ClickRollup(Base):
+    """Переходы по ссылке за час или сутки (см. redis_caching.analytics)."""
+    __tablename__ = 'click_rollups'
+    short_url = Column(String, primary_key=True)
+    granularity = Column(String, primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    clicks = Column(BigInteger, default=0, nullable=False)
@@ -0,0 +1,197 @@
+import asyncio
+import math
+import re
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from logging import getLogger
+from typing import List
+
+from sqlalchemy import text, delete
+
+from config import (LINKS_PARTITION_DAYS, LINKS_PARTITIONS_AHEAD, LINKS_MAX_EXPIRY_DAYS, PURGE_BATCH_SIZE,
+                    PURGE_BATCH_PAUSE)
+from database import engine, async_session_maker
+from shurl.models import LinkCode, ClickRollup, LINK_PARTITION_KEY
+from redis_caching import (pop_cached_stats_many, adjust_user_stats, links_expired_until, is_counted_link,
+                           claim_expired_links, release_expired_links)
+
+logger = getLogger('shurl_partitions')
+
+# Ссылки с expires_at лежат в секциях links_pYYYYMMDD по LINKS_PARTITION_DAYS суток, выровненных от начала
+# unix-времени, бессрочные - в links_forever. Срок ссылки ограничен LINKS_MAX_EXPIRY_DAYS сутками вперед (см.
+# expiry_error), и все секции до этого горизонта и еще LINKS_PARTITIONS_AHEAD секций сверх него создаются заранее:
+# при старте приложения и задачей обслуживания. Запросы DDL не выполняют: создание секции берет ACCESS EXCLUSIVE
+# на links. Секция, все ссылки которой истекли больше часа назад, удаляется целиком вместо построчного DELETE.
+# Границы секций задаются при создании, поэтому LINKS_PARTITION_DAYS после запуска менять нельзя.
+
+PARTITION_SECONDS = LINKS_PARTITION_DAYS * 86400
+MAX_EXPIRY_SECONDS = LINKS_MAX_EXPIRY_DAYS * 86400
+# DDL над links ждет блокировку не дольше этого, чтобы не выстраивать за собой очередь запросов
+DDL_LOCK_TIMEOUT = "2s"
+
+_PARTITION_NAME = re.compile(r"^links_p(\d{8})$")
+
+
+def bucket_start(seconds: float) -> int:
+    seconds = int(seconds)
+    return seconds - seconds % PARTITION_SECONDS
+
+
+def partition_name(start: int) -> str:
+    return f"links_p{datetime.fromtimestamp(start, timezone.utc):%Y%m%d}"
+
+
+async def _list_partitions() -> List[int]:
+    async with engine.connect() as conn:
+        result = await conn.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'links'::regclass"
+        ))
+        names = result.scalars().all()
+    starts = []
+    for name in names:
+        match = _PARTITION_NAME.match(name)
+        if match:
+            starts.append(int(datetime.strptime(match.group(1), "%Y%m%d").replace(tzinfo=timezone.utc).timestamp()))
+    return sorted(starts)
+
+
+async def _create_partition(start: int):
+    bounds = [datetime.fromtimestamp(bound, timezone.utc).isoformat() for bound in (start, start + PARTITION_SECONDS)]
+    async with engine.begin() as conn:
+        await conn.execute(text(f"SET LOCAL lock_timeout = '{DDL_LOCK_TIMEOUT}'"))
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {partition_name(start)} PARTITION OF links "
+            f"FOR VALUES FROM ('{bounds[0]}') TO ('{bounds[1]}')"
+        ))
+    logger.info(f"Создана секция {partition_name(start)}")
+
+
+def expiry_error(expires_at: datetime | None) -> str | None:
+    """Причина, по которой ссылке нельзя дать такой срок, или None. Срок должен быть в будущем и не дальше
+    LINKS_MAX_EXPIRY_DAYS суток: под него заранее создана секция."""
+    if expires_at is None:
+        return None
+    now = time.time()
+    try:
+        seconds = expires_at.timestamp()
+    except (OverflowError, ValueError, OSError):
+        seconds = math.inf
+    if not now < seconds <= now + MAX_EXPIRY_SECONDS:
+        return f"expires_at must be in the future and at most {LINKS_MAX_EXPIRY_DAYS} days ahead"
+    return None
+
+
+async def create_future_partitions() -> int:
+    """Создает недостающие секции от текущей до горизонта LINKS_MAX_EXPIRY_DAYS и еще LINKS_PARTITIONS_AHEAD
+    секций сверх него. Возвращает количество созданных секций."""
+    now = time.time()
+    existing = set(await _list_partitions())
+    last = bucket_start(now + MAX_EXPIRY_SECONDS) + LINKS_PARTITIONS_AHEAD * PARTITION_SECONDS
+    created = 0
+    for start in range(bucket_start(now), last + 1, PARTITION_SECONDS):
+        if start not in existing:
+            await _create_partition(start)
+            created += 1
+    return created
+
+
+# условие записано через ключ секционирования, чтобы Postgres отсек все секции, кроме одной-двух
+_EXPIRED_LINKS_BY_OWNER = text(
+    f"SELECT created_by_uuid, count(*) AS links FROM links "
+    f"WHERE created_by_uuid IS NOT NULL AND {LINK_PARTITION_KEY} > :since AND {LINK_PARTITION_KEY} <= :until "
+    f"GROUP BY created_by_uuid"
+)
+
+
+async def expire_user_links() -> int:
+    """Вычитает из числа ссылок владельцев ссылки, истекшие с прошлого запуска. Возвращает их количество.
+
+    Первый запуск только ставит отметку: ссылки, истекшие раньше, не попали в начальные значения миграции user_stats.
+    """
+    until = time.time()
+    previous = await claim_expired_links(until)
+    if previous is None or previous >= until:
+        return 0
+    try:
+        async with engine.connect() as conn:
+            rows = (await conn.execute(_EXPIRED_LINKS_BY_OWNER, {
+                "since": datetime.fromtimestamp(previous, timezone.utc),
+                "until": datetime.fromtimestamp(until, timezone.utc),
+            })).all()
+        await adjust_user_stats({row.created_by_uuid: (0, -row.links) for row in rows})
+    except Exception:
+        await release_expired_links(until, previous)
+        raise
+    return sum(row.links for row in rows)
+
+
+async def _forget_links(short_codes: List[str], owners: list, clicks: List[int], expiries: list):
+    """Убирает следы удаляемых ссылок: ключи в Redis, вклад в агрегаты владельцев, свертки переходов и коды."""
+    expired_until = await links_expired_until()
+    cached = await pop_cached_stats_many(short_codes)
+
+    deltas = defaultdict(lambda: (0, 0))
+    for owner, link_clicks, expires_at, stats in zip(owners, clicks, expiries, cached):
+        total, links_count = deltas[owner]
+        deltas[owner] = (total - (link_clicks if stats is None else stats['clicks']),
+                         links_count - is_counted_link(expires_at, expired_until))
+    await adjust_user_stats(deltas)
+
+    async with async_session_maker() as session:
+        await session.execute(delete(ClickRollup.__table__).where(ClickRollup.__table__.c.short_url.in_(short_codes)))
+        await session.execute(delete(LinkCode.__table__).where(LinkCode.__table__.c.short_url.in_(short_codes)))
+        await session.commit()
+
+
+async def _drop_partition(start: int, batch_size: int) -> int:
+    """Удаляет секцию целиком. Возвращает количество ссылок в ней."""
+    name = partition_name(start)
+    dropped = 0
+    last_id = 0
+    # следы ссылок убираем пачками, сами строки уходят вместе с секцией
+    while True:
+        async with engine.connect() as conn:
+            result = await conn.execute(
+                text(f"SELECT id, short_url, created_by_uuid, clicks, expires_at FROM {name} WHERE id > :last_id "
+                     f"ORDER BY id LIMIT :limit"),
+                {"last_id": last_id, "limit": batch_size}
+            )
+            rows = result.all()
+        if rows:
+            await _forget_links([row.short_url for row in rows], [row.created_by_uuid for row in rows],
+                                [row.clicks for row in rows], [row.expires_at for row in rows])
+            dropped += len(rows)
+            last_id = rows[-1].id
+        if len(rows) < batch_size:
+            break
+        await asyncio.sleep(PURGE_BATCH_PAUSE)
+
+    async with engine.begin() as conn:
+        await conn.execute(text(f"SET LOCAL lock_timeout = '{DDL_LOCK_TIMEOUT}'"))
+        await conn.execute(text(f"ALTER TABLE links DETACH PARTITION {name}"))
+        await conn.execute(text(f"DROP TABLE {name}"))
+    logger.info(f"Удалена секция {name}: {dropped} ссылок")
+    return dropped
+
+
+async def maintain_partitions(batch_size: int = PURGE_BATCH_SIZE) -> int:
+    """Создает недостающие будущие секции (см. create_future_partitions), вычитает истекшие ссылки из агрегатов
+    владельцев (см. expire_user_links) и удаляет секции, истекшие больше часа назад.
+
+    Возвращает количество удаленных ссылок.
+    """
+    started = time.perf_counter()
+    now = datetime.now(timezone.utc)
+    await create_future_partitions()
+    expired = await expire_user_links()
+
+    cutoff = (now - timedelta(hours=1)).timestamp()
+    purged = 0
+    for start in await _list_partitions():
+        if start + PARTITION_SECONDS <= cutoff:
+            purged += await _drop_partition(start, batch_size)
+    logger.info(f"Обслуживание секций links: истекло {expired}, удалено {purged} ссылок "
+                f"за {time.perf_counter() - started:.1f} с")
+    return purged
@@ -1,21 +1,34 @@
-from fastapi import APIRouter, HTTPException, Depends, status, Query, Path
+from fastapi import APIRouter, HTTPException, Depends, status, Query, Path, Request, Response
 from fastapi.responses import RedirectResponse
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import insert, select, delete, update, or_, and_
+from sqlalchemy import insert, select, delete, update, or_, and_, func, literal, literal_column, DateTime
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import IntegrityError, NoResultFound
+from pydantic import ValidationError
 
 from typing_extensions import Annotated
+from typing import Any, Dict, List, Literal, Tuple
 from datetime import datetime, timezone
-from logging import getLogger
 import json
+from logging import getLogger
 
-from database import get_async_session
-from shurl.utils import generate_random_string, validate_and_fix_url, generate_url_from_short_code
-from shurl.models import Link
-from shurl.schemas import ShortenedItem
-
-from redis_caching import r, write_stats_to_db
+from config import SHORTEN_BATCH_MAX_ITEMS, SHORTEN_BATCH_CHUNK_SIZE, HOT_LINKS_MAX_WINDOW, HOT_LINKS_CAPACITY
+from database import get_async_session, get_read_session, read_session, primary_read_session, is_replica_session
+from shurl.utils import validate_and_fix_url, generate_url_from_short_code
+from shurl.allocator import code_allocator
+from shurl.models import Link, LinkCode, ClickRollup, link_by_code, link_partition_key
+from shurl.partitions import expiry_error
+from shurl.schemas import ShortenedItem, ShortenRequest, RESERVED_ALIASES
+from shurl.statements import (SELECT_LINK_BY_CODE, INSERT_LINK, INSERT_LINK_CODE, DELETE_LINK_BY_CODE, DELETE_LINK_CODE,
+                              UPDATE_LINK_URL)
+from shurl.url_hash import canonicalize_url, url_hash
+
+from redis_caching import (record_hit, cache_link, get_cached_stats, pop_cached_stats, drop_cached_link,
+                           local_links, buffer_click, load_once, might_exist, add_code, add_codes, remember_missing,
+                           links_expired_until, is_counted_link,
+                           adjust_user_stats, record_click_event, count_hot_click, get_top_links, GRANULARITIES,
+                           HIT_OK)
 from auth.auth import User, current_active_user, current_user
 
 
@@ -26,13 +39,40 @@ router = APIRouter(
     tags=["Links"],
 )
 
+async def _find_duplicate(session: AsyncSession, original_url: str, user_id, expires_at: datetime | None) -> str | None:
+    """Код живой ссылки того же пользователя на тот же адрес (с точностью до канонической формы) и с тем же сроком."""
+    table = Link.__table__
+    expiry = func.coalesce(literal(expires_at, DateTime(timezone=True)), literal_column("'infinity'::timestamptz"))
+    query = select(table.c.short_url, table.c.original_url).where(
+        and_(table.c.url_hash == url_hash(original_url),
+             table.c.created_by_uuid.is_not_distinct_from(user_id),
+             # условие на ключ секционирования, чтобы смотреть одну секцию
+             link_partition_key(table) == expiry,
+             table.c.expires_at.is_not_distinct_from(expires_at),
+             or_(table.c.expires_at.is_(None), table.c.expires_at > datetime.now(timezone.utc)))
+    ) # type: ignore
+    result = await session.execute(query)
+    canonical = canonicalize_url(original_url)
+    # хэш мог совпасть у разных адресов, сверяем сами адреса
+    for row in result.all():
+        if canonicalize_url(row.original_url) == canonical:
+            return row.short_url
+    return None
+
+
 @router.post("/shorten", status_code=status.HTTP_201_CREATED)
 async def shorten_link(original_url: Annotated[str, Query()],
                        session: Annotated[AsyncSession, Depends(get_async_session)],
                        user: Annotated[User, Depends(current_user)],
-                       custom_alias: Annotated[str | None, Query()] = None,
-                       expires_at: Annotated[datetime | None, Query()] = None):
-    """Создает короткую ссылку."""
+                       response: Response,
+                       custom_alias: Annotated[str | None, Query(min_length=1, max_length=16)] = None,
+                       expires_at: Annotated[datetime | None, Query()] = None,
+                       dedup: Annotated[bool, Query()] = False):
+    """Создает короткую ссылку.
+
+    С dedup=true и без custom_alias, если у пользователя уже есть живая ссылка на тот же адрес с тем же сроком,
+    возвращает ее код со статусом 200 вместо создания новой.
+    """
     try:
 
         if user is not None:
@@ -41,25 +81,48 @@ async def shorten_link(original_url: Annotated[str, Query()],
             user_id = None
 
         original_url = validate_and_fix_url(original_url)
+        # секции под допустимые сроки созданы заранее, см. shurl.partitions
+        expiry_problem = expiry_error(expires_at)
+        if expiry_problem is not None:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=expiry_problem)
+        if custom_alias in RESERVED_ALIASES:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                detail=f"Alias '{custom_alias}' is reserved")
+
+        if dedup and custom_alias is None:
+            # одинаковые запросы ждут друг друга до конца транзакции, чтобы не создать две ссылки
+            await session.execute(select(func.pg_advisory_xact_lock(url_hash(original_url))))
+            existing = await _find_duplicate(session, original_url, user_id, expires_at)
+            if existing is not None:
+                await session.commit()
+                response.status_code = status.HTTP_200_OK
+                return {"short_url": generate_url_from_short_code(existing),
+                        "short_code": existing}
 
         if custom_alias is not None:
             short_code = custom_alias
         else:
-            short_code = generate_random_string()
+            short_code = await code_allocator.next_code()
 
         while True:
             shurl = ShortenedItem(short_url=short_code, original_url=original_url, expires_at=expires_at, created_by_uuid=user_id)
-            statement = insert(Link).values(**shurl.model_dump())
+            # в фильтр Блума до вставки: лишний код в фильтре безопасен, недостающий дал бы 404
+            await add_code(short_code)
             try:
-                await session.execute(statement)
+                # уникальность кода по всем секциям links проверяет link_codes
+                await session.execute(INSERT_LINK_CODE, {"short_url": short_code, "expires_at": expires_at})
+                await session.execute(INSERT_LINK, shurl.model_dump())
                 await session.commit()
+                # и после, на случай если фильтр перестраивался во время вставки
+                await add_code(short_code)
+                await adjust_user_stats({user_id: (0, 1)})
                 break
             except IntegrityError:
                 await session.rollback()
                 logger.debug("Collision occurred, retrying with new short code.")
 
                 if custom_alias is None:
-                    short_code = generate_random_string()
+                    short_code = await code_allocator.next_code()
                 else:
                     raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Custom alias already exists")
 
@@ -72,22 +135,153 @@ async def shorten_link(original_url: Annotated[str, Query()],
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 
+# Сколько раз перевыдавать коды, столкнувшиеся с существующими, прежде чем сдаться
+SHORTEN_BATCH_MAX_ATTEMPTS = 5
+
+
+def _parse_batch(body: bytes, content_type: str) -> List[Any]:
+    """Разбирает тело пакетного запроса: NDJSON (application/x-ndjson) или JSON-массив."""
+    if content_type.split(';')[0].strip() == 'application/x-ndjson':
+        return [json.loads(line) for line in body.splitlines() if line.strip()]
+    items = json.loads(body)
+    if not isinstance(items, list):
+        raise ValueError("Expected a JSON array")
+    return items
+
+
+async def _insert_batch_chunk(session: AsyncSession, chunk: List[Tuple[int, ShortenRequest]],
+                              user_id, results: List[Dict[str, Any] | None]):
+    """Занимает коды чанка одним INSERT INTO link_codes ... ON CONFLICT DO NOTHING RETURNING
+    и вставляет ссылки с занятыми кодами одним INSERT.
+
+    Повторно вставляются только строки, чьи выданные коды столкнулись с существующими,
+    столкнувшиеся кастомные алиасы сразу отдаются как conflict.
+    """
+    for _ in range(SHORTEN_BATCH_MAX_ATTEMPTS):
+        fresh_codes = iter(await code_allocator.take(sum(1 for _, item in chunk if item.custom_alias is None)))
+        rows: Dict[str, Tuple[int, ShortenRequest]] = {}
+        for index, item in chunk:
+            short_code = item.custom_alias if item.custom_alias is not None else next(fresh_codes)
+            if short_code in rows:
+                if item.custom_alias is not None:
+                    results[index] = {"index": index, "status": "conflict", "detail": "Duplicate custom alias in batch"}
+                    continue
+                while short_code in rows:
+                    short_code = await code_allocator.next_code()
+            rows[short_code] = (index, item)
+
+        if not rows:
+            return
+
+        statement = (
+            pg_insert(LinkCode).values([{"short_url": short_code, "expires_at": item.expires_at}
+                                        for short_code, (index, item) in rows.items()])
+            .on_conflict_do_nothing(index_elements=['short_url'])
+            .returning(LinkCode.__table__.c.short_url)
+        )
+        # в фильтр Блума до вставки и после, как и в shorten_link
+        await add_codes(rows)
+        result = await session.execute(statement)
+        inserted = set(result.scalars().all())
+        if inserted:
+            await session.execute(insert(Link).values([
+                ShortenedItem(short_url=short_code, original_url=item.original_url, expires_at=item.expires_at,
+                              created_by_uuid=user_id).model_dump()
+                for short_code, (index, item) in rows.items() if short_code in inserted
+            ]))
+        await session.commit()
+        await add_codes(inserted)
+        await adjust_user_stats({user_id: (0, len(inserted))})
+
+        chunk = []
+        for short_code, (index, item) in rows.items():
+            if short_code in inserted:
+                results[index] = {"index": index, "status": "created", "short_code": short_code,
+                                  "short_url": generate_url_from_short_code(short_code)}
+            elif item.custom_alias is not None:
+                results[index] = {"index": index, "status": "conflict", "detail": "Custom alias already exists"}
+            else:
+                chunk.append((index, item))
+
+        if not chunk:
+            return
+        logger.debug(f"{len(chunk)} collisions in batch, retrying with new short codes.")
+
+    for index, _ in chunk:
+        results[index] = {"index": index, "status": "error", "detail": "Could not allocate a unique short code"}
+
+
+@router.post("/shorten/batch", status_code=status.HTTP_201_CREATED)
+async def shorten_links_batch(request: Request,
+                              session: Annotated[AsyncSession, Depends(get_async_session)],
+                              user: Annotated[User, Depends(current_user)]):
+    """Создает короткие ссылки пачкой.
+
+    Принимает JSON-массив или NDJSON (Content-Type: application/x-ndjson) объектов
+    {original_url, custom_alias, expires_at}. Ссылки вставляются чанками по SHORTEN_BATCH_CHUNK_SIZE
+    строк, результат возвращается для каждого элемента в порядке запроса.
+    """
+    try:
+        try:
+            items = _parse_batch(await request.body(), request.headers.get('content-type', ''))
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Malformed batch: {e}")
+
+        if len(items) > SHORTEN_BATCH_MAX_ITEMS:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                detail=f"Batch is limited to {SHORTEN_BATCH_MAX_ITEMS} items")
+
+        if user is not None:
+            user_id = user.id
+        else:
+            user_id = None
+
+        results: List[Dict[str, Any] | None] = [None] * len(items)
+        valid: List[Tuple[int, ShortenRequest]] = []
+        for index, raw in enumerate(items):
+            try:
+                item = ShortenRequest.model_validate(raw)
+            except ValidationError as e:
+                results[index] = {"index": index, "status": "invalid",
+                                  "detail": e.errors(include_url=False, include_context=False)}
+                continue
+            expiry_problem = expiry_error(item.expires_at)
+            if expiry_problem is not None:
+                results[index] = {"index": index, "status": "invalid", "detail": expiry_problem}
+                continue
+            item.original_url = validate_and_fix_url(item.original_url)
+            valid.append((index, item))
+
+        for start in range(0, len(valid), SHORTEN_BATCH_CHUNK_SIZE):
+            await _insert_batch_chunk(session, valid[start:start + SHORTEN_BATCH_CHUNK_SIZE], user_id, results)
+
+        return {"created": sum(1 for result in results if result["status"] == "created"),
+                "results": results}
+    except HTTPException as http_exc:
+        raise http_exc
+    except Exception as e:
+        logger.warning(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+
 @router.get("/search")
 async def search_by_original_url(original_url: Annotated[str, Query()],
-                                 session: Annotated[AsyncSession, Depends(get_async_session)]):
+                                 session: Annotated[AsyncSession, Depends(get_read_session)]):
     try:
         original_url = validate_and_fix_url(original_url)
 
+        # ищем по индексу на хэше, а не на самих адресах
         query = select(Link.__table__).where(
-            and_(Link.__table__.c.original_url == original_url,
+            and_(Link.__table__.c.url_hash == url_hash(original_url),
             or_(Link.__table__.c.expires_at.is_(None), Link.__table__.c.expires_at > datetime.now(timezone.utc)))
         ) # type: ignore
 
         logger.debug(query)
 
         result = await session.execute(query)
-        await session.commit()
-        links = result.all()
+        canonical = canonicalize_url(original_url)
+        # хэш мог совпасть у разных адресов, сверяем сами адреса
+        links = [l for l in result.all() if canonicalize_url(l.original_url) == canonical]
         return [{
             "short_url": l.short_url,
             "created_at": l.created_at,
@@ -101,59 +295,107 @@ async def search_by_original_url(original_url: Annotated[str, Query()],
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 
-@router.get("/{short_code}")
-async def redirect_to_original(short_code: Annotated[str, Path(max_length=16)],
-                               session: Annotated[AsyncSession, Depends(get_async_session)]):
-    """Перенаправляет на оригинальный URL."""
+_WINDOW_UNITS = {"s": 1, "m": 60, "h": 3600}
+
+
+def _parse_window(window: str) -> int:
+    """Длина окна в секундах из строки вида 30s, 5m, 1h."""
+    unit = _WINDOW_UNITS.get(window[-1:])
+    if unit is None or not window[:-1].isdigit() or not 0 < int(window[:-1]) * unit <= HOT_LINKS_MAX_WINDOW:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f"window must look like 30s, 5m or 1h and be at most {HOT_LINKS_MAX_WINDOW}s")
+    return int(window[:-1]) * unit
+
+
+# GET /links/top - Самые популярные ссылки за последнее время
+@router.get("/top")
+async def get_hot_links(window: Annotated[str, Query()] = "5m",
+                        k: Annotated[int, Query(ge=1, le=HOT_LINKS_CAPACITY)] = 100):
+    """Не больше k ссылок с наибольшим числом переходов за последнее окно window (30s, 5m, 1h), по убыванию.
+
+    Считается по корзинам в Redis (см. redis_caching.hot_links), без обращения к БД и без перебора ссылок.
+    Числа переходов - оценки сверху, переходы последней секунды еще могут быть не учтены.
+    """
+    seconds = _parse_window(window)
     try:
-        cache_key = f"short_url:{short_code}"
-        stats_key = f"stats:{short_code}"
-        cached_data = await r.get(cache_key)
+        return {"window": window, "k": k, "links": await get_top_links(seconds, k)}
+    except Exception as e:
+        logger.warning(e)
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
-        if cached_data:
-            link_data = json.loads(cached_data)
-            stats = json.loads(await r.get(stats_key))
 
-            if link_data["expires_at"] and datetime.fromisoformat(link_data["expires_at"]) < datetime.now(timezone.utc):
-                logger.debug('cached link is expired')
-                await r.delete(cache_key)
+async def _find_link(session: AsyncSession, short_code: str):
+    """Ссылка по коду или None.
 
-                stats['last_used'] = datetime.fromisoformat(stats['last_used'])
+    Если сессия читает с реплики и ссылки там нет, она перепроверяется в основной БД: ссылка могла быть создана
+    только что и еще не доехать до реплики.
+    """
+    result = await session.execute(SELECT_LINK_BY_CODE, {"short_code": short_code})
+    link = result.one_or_none()
+    if link is None and is_replica_session(session):
+        async with primary_read_session() as primary:
+            result = await primary.execute(SELECT_LINK_BY_CODE, {"short_code": short_code})
+            link = result.one_or_none()
+    return link
 
-                await write_stats_to_db(short_code, stats)
-                await r.delete(stats_key)
-            else:
-                logger.debug('using cached')
 
-                stats['last_used'] = datetime.now(timezone.utc).isoformat()
-                stats['clicks'] = int(stats['clicks']) + 1
+async def _load_link(short_code: str) -> str:
+    """Загружает ссылку из БД и кладет ее в кэш, засчитывая клик. Возвращает original_url."""
+    async with read_session() as session:
+        link = await _find_link(session, short_code)
 
-                await r.set(stats_key, json.dumps(stats))
-                return RedirectResponse(url=link_data["original_url"], status_code=302)
+    if link is None:
+        await remember_missing(short_code)
+        raise NoResultFound()
 
-        # Если кэш пустой или ссылка просрочена, проверим бд (вдруг ссылку обновили?)
-        query = select(Link.__table__).where(Link.__table__.c.short_url == short_code) # type: ignore
-        result = await session.execute(query)
-        await session.commit()
-        link = result.one()
+    if link.expires_at is not None and link.expires_at < datetime.now(timezone.utc):
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail="Link has expired")
 
-        if link.expires_at is not None and link.expires_at < datetime.now(timezone.utc):
-            raise HTTPException(status_code=status.HTTP_410_GONE, detail="Link has expired")
+    # Сохраняем данные в кэш
+    await cache_link(short_code, link.original_url, link.expires_at, link.clicks, link.created_by_uuid)
+    return link.original_url
 
-        # Сохраняем данные в кэш
-        link_data = {
-            "original_url": link.original_url,
-            "expires_at": link.expires_at.isoformat() if link.expires_at else None
-        }
-        await r.set(cache_key, json.dumps(link_data), ex=60)  # Кэшируем на 60 секунд
 
-        stats = {
-            "clicks": link.clicks + 1,
-            "last_used": datetime.now(timezone.utc).isoformat()
-        }
-        await r.set(stats_key, json.dumps(stats))
+def _count_click(short_code: str, request: Request):
+    """Событие перехода для аналитики и клик для топа популярных ссылок, оба копятся в памяти воркера."""
+    record_click_event(short_code, request.headers.get('referer'), request.headers.get('user-agent'))
+    count_hot_click(short_code)
+
+
+@router.get("/{short_code}")
+async def redirect_to_original(short_code: Annotated[str, Path(max_length=16)], request: Request):
+    """Перенаправляет на оригинальный URL.
+
+    Сессия БД открывается только при промахе кэша, попадания обслуживаются целиком из Redis.
+    Перед Redis стоит локальный кэш воркера, клики по нему отправляются в Redis фоном.
+    Событие перехода для аналитики и клик для топа популярных ссылок тоже копятся в памяти и уходят в Redis фоном.
+    """
+    try:
+        original_url = local_links.get(short_code)
+        if original_url is not None:
+            buffer_click(short_code)
+            _count_click(short_code, request)
+            return RedirectResponse(url=original_url, status_code=302)
+
+        hit, original_url = await record_hit(short_code)
+
+        if hit == HIT_OK:
+            logger.debug('using cached')
+            _count_click(short_code, request)
+            return RedirectResponse(url=original_url, status_code=302)
+
+        # Неизвестные коды (опечатки, перебор) отсекаем фильтром Блума и кэшем ненайденных, не доходя до БД
+        if not await might_exist(short_code):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Short code not found")
+
+        # Если кэш пустой (в том числе потому, что ссылка истекла и Redis удалил запись), проверим бд.
+        # Одновременные промахи по одному коду ждут одну загрузку, а не идут в БД каждый
+        original_url, shared = await load_once(short_code, lambda: _load_link(short_code))
+        if shared:
+            buffer_click(short_code)
 
-        return RedirectResponse(url=link.original_url, status_code=302)
+        _count_click(short_code, request)
+        return RedirectResponse(url=original_url, status_code=302)
 
     except NoResultFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Short code not found")
@@ -170,23 +412,25 @@ async def delete_link(short_code: Annotated[str, Path(max_length=16)],
                       user: Annotated[User, Depends(current_active_user)]):
     """Удаляет связь."""
     try:
-        query = select(Link.__table__).where(Link.__table__.c.short_url == short_code) # type: ignore
-        result = await session.execute(query)
-        await session.commit()
+        # чтение и удаление в одной транзакции
+        result = await session.execute(SELECT_LINK_BY_CODE, {"short_code": short_code})
         link = result.one()
 
         if (link.created_by_uuid is not None) and (link.created_by_uuid != user.id):
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not an owner of this link")
 
-        # удаляем кэш, если есть
-        cache_key = f"short_url:{short_code}"
-        stats_key = f"stats:{short_code}"
-        await r.delete(cache_key)
-        await r.delete(stats_key)
-
-        delete_query = delete(Link.__table__).where(Link.__table__.c.short_url == short_code) # type: ignore
-        await session.execute(delete_query)
+        await session.execute(DELETE_LINK_BY_CODE, {"short_code": short_code})
+        await session.execute(DELETE_LINK_CODE, {"short_code": short_code})
         await session.commit()
+
+        expired_until = await links_expired_until()
+        # забираем статистики и удаляем кэш одним скриптом, чтобы не потерять клик между чтением и удалением.
+        # После коммита, чтобы параллельный промах не закэшировал старую версию
+        stats = await pop_cached_stats(short_code)
+        await adjust_user_stats({link.created_by_uuid: (-(link.clicks if stats is None else stats['clicks']),
+                                                        -is_counted_link(link.expires_at, expired_until))})
+        # из фильтра Блума код не удалить, поэтому запоминаем его как ненайденный
+        await remember_missing(short_code)
         return {"message": "Link deleted successfully"}
     except NoResultFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Short code not found")
@@ -204,9 +448,8 @@ async def update_link(short_code: Annotated[str, Path(max_length=16)],
                       user: Annotated[User, Depends(current_active_user)]):
     """Обновляет длинный адрес, на который ведет ссылка"""
     try:
-        query = select(Link.__table__).where(Link.__table__.c.short_url == short_code) # type: ignore
-        result = await session.execute(query)
-        await session.commit()
+        # чтение и обновление в одной транзакции
+        result = await session.execute(SELECT_LINK_BY_CODE, {"short_code": short_code})
         link = result.one()
 
         if (link.created_by_uuid is not None) and (link.created_by_uuid != user.id):
@@ -214,19 +457,19 @@ async def update_link(short_code: Annotated[str, Path(max_length=16)],
 
         original_url = validate_and_fix_url(original_url)
 
-        # удаляем кэш, если есть
-        cache_key = f"short_url:{short_code}"
-        stats_key = f"stats:{short_code}"
-        await r.delete(cache_key)
-        await r.delete(stats_key)
+        # удаляем кэш, если есть, чтобы флашер не перезаписал обнуленные статистики
+        stats = await pop_cached_stats(short_code)
+        clicks = link.clicks if stats is None else stats['clicks']
 
-        update_query = (
-            update(Link.__table__)
-            .where(Link.__table__.c.short_url == short_code)  # type: ignore
-            .values(original_url=original_url, clicks=0, last_used=None, updated_at=datetime.now(timezone.utc))
-        )
-        await session.execute(update_query)
+        await session.execute(UPDATE_LINK_URL, {"short_code": short_code, "new_url": original_url,
+                                                "new_url_hash": url_hash(original_url),
+                                                "now": datetime.now(timezone.utc)})
         await session.commit()
+
+        # и еще раз после коммита, чтобы параллельный промах не оставил в кэше старую версию
+        await drop_cached_link(short_code)
+        # клики ссылки обнулились, вычитаем их из агрегатов владельца
+        await adjust_user_stats({link.created_by_uuid: (-clicks, 0)})
         return {"message": "Link updated successfully"}
 
     except NoResultFound:
@@ -236,31 +479,73 @@ async def update_link(short_code: Annotated[str, Path(max_length=16)],
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 
+# Сколько интервалов отдавать в ряду переходов по умолчанию и максимум за запрос
+STATS_SERIES_DEFAULT_BUCKETS = {"hour": 24 * 7, "day": 90}
+STATS_SERIES_MAX_BUCKETS = 10000
+
+
+def _floor_to_bucket(moment: datetime, size: int) -> int:
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    seconds = int(moment.timestamp())
+    return seconds - seconds % size
+
+
+async def _click_series(session: AsyncSession, short_code: str, granularity: str,
+                        from_: datetime | None, to: datetime | None) -> List[Dict[str, Any]]:
+    """Переходы по интервалам из click_rollups, интервалы без переходов заполняются нулями."""
+    size = GRANULARITIES[granularity]
+    end = _floor_to_bucket(to, size) if to is not None else _floor_to_bucket(datetime.now(timezone.utc), size) + size
+    start = _floor_to_bucket(from_, size) if from_ is not None else end - STATS_SERIES_DEFAULT_BUCKETS[granularity] * size
+    if start >= end:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="'from' must be before 'to'")
+    if (end - start) // size > STATS_SERIES_MAX_BUCKETS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Range is limited to {STATS_SERIES_MAX_BUCKETS} buckets")
+
+    table = ClickRollup.__table__
+    query = select(table.c.bucket_start, table.c.clicks).where(
+        and_(table.c.short_url == short_code,
+             table.c.granularity == granularity,
+             table.c.bucket_start >= datetime.fromtimestamp(start, timezone.utc),
+             table.c.bucket_start < datetime.fromtimestamp(end, timezone.utc))
+    ) # type: ignore
+    result = await session.execute(query)
+    clicks = {int(row.bucket_start.timestamp()): row.clicks for row in result.all()}
+
+    return [{"bucket_start": datetime.fromtimestamp(bucket, timezone.utc), "clicks": clicks.get(bucket, 0)}
+            for bucket in range(start, end, size)]
+
+
 # GET /links/{short_code}/stats - Статистика по ссылке
 @router.get("/{short_code}/stats")
 async def get_link_stats(short_code: Annotated[str, Path(max_length=16)],
-                         session: Annotated[AsyncSession, Depends(get_async_session)]):
+                         session: Annotated[AsyncSession, Depends(get_read_session)],
+                         granularity: Annotated[Literal["hour", "day"] | None, Query()] = None,
+                         from_: Annotated[datetime | None, Query(alias="from")] = None,
+                         to: Annotated[datetime | None, Query()] = None):
+    """Статистика по ссылке.
+
+    С granularity=hour|day в ответ добавляется series - переходы по часам или суткам (UTC) в интервале [from, to),
+    по умолчанию за последние STATS_SERIES_DEFAULT_BUCKETS интервалов. Ряды строятся из свертки событий
+    переходов и отстают от счетчика clicks на период свертки.
+    """
     try:
-
-        query = select(Link.__table__).where(Link.__table__.c.short_url == short_code) # type: ignore
-        result = await session.execute(query)
-        await session.commit()
-        link = result.one()
+        link = await _find_link(session, short_code)
+        if link is None:
+            raise NoResultFound()
 
         # Ищем клики в кэше
-        stats_key = f"stats:{short_code}"
-
-        stats = await r.get(stats_key)
+        stats = await get_cached_stats(short_code)
 
         if stats is None:
             clicks = link.clicks
             last_used = link.last_used
         else:
-            stats = json.loads(stats)
-            clicks = int(stats['clicks'])
-            last_used = datetime.fromisoformat(stats['last_used'])
+            clicks = stats['clicks']
+            last_used = stats['last_used']
 
-        return {
+        report = {
             "short_code": link.short_url,
             "original_url": link.original_url,
             "created_at": link.created_at,
@@ -269,8 +554,16 @@ async def get_link_stats(short_code: Annotated[str, Path(max_length=16)],
             "clicks": clicks,
             "last_used": last_used
         }
+
+        if granularity is not None:
+            report["granularity"] = granularity
+            report["series"] = await _click_series(session, short_code, granularity, from_, to)
+
+        return report
     except NoResultFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Short code not found")
+    except HTTPException as http_exc:
+        raise http_exc
     except Exception as e:
         logger.warning(e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
@@ -1,7 +1,13 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator, model_validator
 from datetime import datetime, timezone
 from uuid import UUID
 
+from shurl.url_hash import url_hash
+
+# GET-ручки /links/top и /links/search объявлены раньше редиректа /links/{short_code}, ссылка с таким алиасом
+# была бы недостижима
+RESERVED_ALIASES = frozenset({"top", "search"})
+
 class GetOriginalURLResponse(BaseModel):
     original_url: str
 
@@ -10,4 +16,24 @@ class ShortenedItem(BaseModel):
     original_url: str
     created_by_uuid: UUID | None = Field(None)
     expires_at: datetime | None = Field(None)
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
\ No newline at end of file
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    url_hash: int | None = Field(None)
+
+    @model_validator(mode='after')
+    def fill_url_hash(self):
+        if self.url_hash is None:
+            self.url_hash = url_hash(self.original_url)
+        return self
+
+class ShortenRequest(BaseModel):
+    original_url: str
+    # редирект принимает коды не длиннее 16 символов, более длинный алиас был бы недостижим
+    custom_alias: str | None = Field(None, min_length=1, max_length=16)
+    expires_at: datetime | None = Field(None)
+
+    @field_validator('custom_alias')
+    @classmethod
+    def check_alias_not_reserved(cls, custom_alias: str | None) -> str | None:
+        if custom_alias in RESERVED_ALIASES:
+            raise ValueError(f"Alias '{custom_alias}' is reserved")
+        return custom_alias
@@ -0,0 +1,27 @@
+from sqlalchemy import bindparam, select, insert, delete, update
+
+from shurl.models import Link, LinkCode, link_by_code
+
+# Запросы горячих путей собираются один раз при импорте, значения передаются параметрами при выполнении:
+# session.execute(SELECT_LINK_BY_CODE, {"short_code": short_code}). Дерево выражения не строится на каждый
+# запрос, SQLAlchemy берет скомпилированный SQL из кэша, а asyncpg - подготовленный запрос из кэша соединения.
+
+_links, _codes = Link.__table__, LinkCode.__table__
+_short_code = bindparam("short_code")
+
+SELECT_LINK_BY_CODE = select(_links).where(link_by_code(_short_code)) # type: ignore
+
+# параметры - все колонки вставляемой строки, как в ShortenedItem.model_dump()
+INSERT_LINK = insert(_links)
+INSERT_LINK_CODE = insert(_codes)
+
+DELETE_LINK_BY_CODE = delete(_links).where(link_by_code(_short_code)) # type: ignore
+DELETE_LINK_CODE = delete(_codes).where(_codes.c.short_url == _short_code)
+
+# имена параметров не совпадают с колонками: такие имена SQLAlchemy резервирует под SET
+UPDATE_LINK_URL = (
+    update(_links)
+    .where(link_by_code(_short_code)) # type: ignore
+    .values(original_url=bindparam("new_url"), url_hash=bindparam("new_url_hash"), clicks=0, last_used=None,
+            updated_at=bindparam("now"))
+)
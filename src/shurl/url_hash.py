@@ -0,0 +1,35 @@
+from hashlib import blake2b
+from urllib.parse import urlsplit, urlunsplit
+
+# Поиск ссылок по длинному адресу идет не по самому original_url, а по 64-битному хэшу его канонической формы
+# (links.url_hash): индекс по BIGINT в разы меньше индекса по строкам произвольной длины. Модуль не зависит
+# от конфига, потому что им же хэши заполняются в миграции.
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def canonicalize_url(url: str) -> str:
+    """Каноническая форма адреса: схема и хост в нижнем регистре, без порта по умолчанию и фрагмента,
+    пустой путь заменен на "/". Адреса, ведущие на один ресурс, получают одну форму."""
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        # некорректный порт или хост: такой адрес оставляем как есть
+        return url.strip()
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if ":" in host:
+        host = f"[{host}]"
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{port}"
+    if parts.username is not None:
+        userinfo = parts.username if parts.password is None else f"{parts.username}:{parts.password}"
+        host = f"{userinfo}@{host}"
+    return urlunsplit((scheme, host, parts.path or "/", parts.query, ""))
+
+
+def url_hash(url: str) -> int:
+    """Знаковый 64-битный хэш канонической формы адреса, помещается в BIGINT."""
+    digest = blake2b(canonicalize_url(url).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
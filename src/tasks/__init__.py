@@ -1,32 +1,41 @@
 import asyncio
 from celery import Celery
-from sqlalchemy import delete
-from datetime import datetime, timedelta, timezone
-from shurl.models import Link
-from database import get_async_session
-from config import REDIS_HOST, REDIS_PORT, REDIS_PASSWORD
+from shurl.partitions import maintain_partitions
+from redis_caching import rollup_click_events
+from config import REDIS_HOST, REDIS_PORT, REDIS_PASSWORD, CLICK_ROLLUP_INTERVAL
 from celery.schedules import crontab
 
 app = Celery("tasks", broker=f"redis://default:{REDIS_PASSWORD}@{REDIS_HOST}:{REDIS_PORT}/0")
 
-async def adelete_expired_links():
-    async for session in get_async_session():
-        try:
-            one_hour_ago = datetime.now(timezone.utc) - timedelta(hours=1)
-            statement = delete(Link.__table__).where(Link.__table__.c.expires_at < one_hour_ago)
-            await session.execute(statement)
-            await session.commit()
-            print(f"Удалены устаревшие ссылки до {one_hour_ago}")
-        except Exception as e:
-            print(f"Ошибка при удалении устаревших ссылок: {e}")
-            await session.rollback()
-        finally:
-            await session.close()
+async def adelete_expired_links() -> int:
+    """Удаляет секции links, все ссылки которых истекли больше часа назад, и заранее создает будущие секции.
+
+    Возвращает количество удаленных ссылок.
+    """
+    try:
+        purged = await maintain_partitions()
+        print(f"Удалено устаревших ссылок: {purged}")
+        return purged
+    except Exception as e:
+        print(f"Ошибка при удалении устаревших ссылок: {e}")
+        return 0
 
 @app.task
 def delete_expired_links():
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(adelete_expired_links())
+    return loop.run_until_complete(adelete_expired_links())
+
+async def arollup_click_events():
+    try:
+        processed = await rollup_click_events()
+        print(f"Свернуто событий переходов: {processed}")
+    except Exception as e:
+        print(f"Ошибка при свертке событий переходов: {e}")
+
+@app.task
+def rollup_clicks():
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(arollup_click_events())
 
 app.conf.broker_connection_retry_on_startup = True
 
@@ -35,6 +44,10 @@ app.conf.beat_schedule = {
         "task": "tasks.delete_expired_links",
         "schedule": crontab(minute="*/10"),  # Каждые 10 минут
     },
+    "rollup-click-events": {
+        "task": "tasks.rollup_clicks",
+        "schedule": CLICK_ROLLUP_INTERVAL,
+    },
 }
 
 app.conf.update(imports=['tasks'])
\ No newline at end of file